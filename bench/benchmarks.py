@@ -0,0 +1,353 @@
+# bench/benchmarks.py
+"""
+Benchmarks reproduïbles de gemini_chess.
+
+Mesura:
+  - GameLogic: make_move / undo_move i navegació (inici, següent, anterior, final)
+  - ChessboardWidget.update_board amb la plataforma Qt 'offscreen'
+  - PGN: lectura i exportació d'un fitxer gran generat (llavor fixa)
+  - ChessEngine.get_analysis: cost d'anada i tornada a un nombre fix de nodes
+
+Ús (des de l'arrel del projecte):
+    python bench/benchmarks.py                       # executa i mostra resultats
+    python bench/benchmarks.py --save-baseline       # desa bench/baselines/baseline.json
+    python bench/benchmarks.py --compare             # compara amb la línia base
+    python bench/benchmarks.py --only pgn,board --quick
+    python bench/benchmarks.py --engine assets/engines/stockfish-...
+
+--compare retorna codi de sortida 1 si algun benchmark és més lent que la
+línia base per sobre del llindar (--threshold, per defecte 15%).
+"""
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SRC_DIR = os.path.join(ROOT_DIR, "src")
+sys.path.insert(0, SRC_DIR)
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import chess
+import chess.pgn
+
+BASELINE_DIR = os.path.join(ROOT_DIR, "bench", "baselines")
+DEFAULT_BASELINE = os.path.join(BASELINE_DIR, "baseline.json")
+DEFAULT_ENGINE = os.path.join(ROOT_DIR, "assets", "engines", "stockfish-ubuntu-x86-64-sse41-popcnt")
+SEED = 20250424
+
+
+# --- Utilitats de mesura ---
+
+def measure(func, number: int, repeat: int = 5) -> dict:
+    """
+    Executa func() 'number' cops, 'repeat' vegades, i retorna el millor temps
+    per operació (com timeit: el mínim és el menys sorollós).
+    """
+    timings = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                func()
+            timings.append((time.perf_counter() - start) / number)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    best = min(timings)
+    return {
+        "best_ms": best * 1000.0,
+        "mean_ms": sum(timings) / len(timings) * 1000.0,
+        "ops_per_sec": 1.0 / best if best else float("inf"),
+    }
+
+
+def random_game(rng: random.Random, max_plies: int = 120, annotate: bool = True) -> chess.pgn.Game:
+    """Genera una partida aleatòria legal (amb alguns comentaris, NAGs i variants)."""
+    game = chess.pgn.Game()
+    game.headers["Event"] = f"Bench {rng.randint(1, 999)}"
+    game.headers["White"] = f"Blanques {rng.randint(1, 5000)}"
+    game.headers["Black"] = f"Negres {rng.randint(1, 5000)}"
+    node = game
+    board = game.board()
+    for ply in range(max_plies):
+        moves = list(board.legal_moves)
+        if not moves:
+            break
+        move = rng.choice(moves)
+        if annotate and len(moves) > 1 and rng.random() < 0.05:
+            alternative = rng.choice([m for m in moves if m != move])
+            side = node.add_variation(alternative)
+            side.comment = "alternativa"
+        node = node.add_variation(move)
+        if annotate and rng.random() < 0.05:
+            node.comment = f"comentari {ply}"
+        if annotate and rng.random() < 0.03:
+            node.nags.add(rng.choice([1, 2, 3, 4, 5, 6]))
+        board.push(move)
+    game.headers["Result"] = board.result(claim_draw=True)
+    return game
+
+
+def write_pgn_file(path: str, num_games: int, seed: int = SEED) -> int:
+    """Escriu num_games partides aleatòries a 'path'. Retorna la mida en bytes."""
+    rng = random.Random(seed)
+    with open(path, "w") as f:
+        exporter = chess.pgn.FileExporter(f)
+        for _ in range(num_games):
+            random_game(rng).accept(exporter)
+    return os.path.getsize(path)
+
+
+# --- Benchmarks ---
+
+def bench_game_logic(quick: bool) -> dict:
+    from game_logic import GameLogic
+
+    rng = random.Random(SEED)
+    moves = list(random_game(rng, max_plies=100, annotate=False).mainline_moves())
+    logic = GameLogic()
+    results = {}
+
+    def play_and_undo():
+        for move in moves:
+            logic.make_move(chess.Move(move.from_square, move.to_square, move.promotion))
+        while logic.undo_move():
+            pass
+
+    number = 3 if quick else 20
+    timing = measure(play_and_undo, number)
+    # Normalitza per jugada (make + undo)
+    per_ply = timing["best_ms"] / len(moves)
+    results["game_logic.make_undo_per_ply"] = {"best_ms": per_ply, "ops_per_sec": 1000.0 / per_ply}
+
+    # Navegació per una partida carregada
+    for move in moves:
+        logic.make_move(chess.Move(move.from_square, move.to_square, move.promotion))
+
+    def navigate():
+        logic.go_to_start()
+        while not logic._current_node.is_end():
+            logic.next_move()
+        while logic._current_node.parent:
+            logic.previous_move()
+        logic.go_to_end()
+
+    timing = measure(navigate, number)
+    per_ply = timing["best_ms"] / (2 * len(moves))
+    results["game_logic.navigate_per_ply"] = {"best_ms": per_ply, "ops_per_sec": 1000.0 / per_ply}
+    return results
+
+
+def bench_board(quick: bool) -> dict:
+    from PySide6.QtWidgets import QApplication
+    from chessboard_widget import ChessboardWidget
+
+    app = QApplication.instance() or QApplication([])
+    widget = ChessboardWidget(resources_path=os.path.join(ROOT_DIR, "assets", "pieces", "berlin"))
+    rng = random.Random(SEED)
+    boards = []
+    board = chess.Board()
+    for move in random_game(rng, max_plies=60, annotate=False).mainline_moves():
+        board.push(move)
+        boards.append(board.copy())
+    index = [0]
+
+    def update():
+        widget.update_board(boards[index[0] % len(boards)])
+        index[0] += 1
+
+    def update_and_paint():
+        update()
+        widget.viewport().repaint()
+
+    number = 20 if quick else 200
+    widget.show()
+    app.processEvents()
+    results = {
+        "board.update_board": measure(update, number),
+        "board.update_and_paint": measure(update_and_paint, number),
+    }
+    widget.close()
+    return results
+
+
+def bench_pgn(quick: bool) -> dict:
+    from game_logic import GameLogic
+
+    num_games = 200 if quick else 2000
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.pgn")
+        size = write_pgn_file(path, num_games)
+
+        def parse_all():
+            with open(path) as f:
+                while chess.pgn.read_game(f) is not None:
+                    pass
+
+        timing = measure(parse_all, 1, repeat=3)
+        results["pgn.parse_games"] = {
+            "best_ms": timing["best_ms"] / num_games,
+            "ops_per_sec": num_games / (timing["best_ms"] / 1000.0),
+            "mb_per_sec": size / 1e6 / (timing["best_ms"] / 1000.0),
+        }
+
+        with open(path) as f:
+            games = [chess.pgn.read_game(f) for _ in range(num_games)]
+
+        def export_all():
+            out = io.StringIO()
+            exporter = chess.pgn.FileExporter(out)
+            for game in games:
+                game.accept(exporter)
+
+        timing = measure(export_all, 1, repeat=3)
+        results["pgn.export_games"] = {
+            "best_ms": timing["best_ms"] / num_games,
+            "ops_per_sec": num_games / (timing["best_ms"] / 1000.0),
+        }
+
+        # Anada i tornada a través de GameLogic (una partida llarga)
+        single = os.path.join(tmp, "single.pgn")
+        write_pgn_file(single, 1, seed=SEED + 1)
+        out_path = os.path.join(tmp, "out.pgn")
+        logic = GameLogic()
+
+        def load_save():
+            logic.load_pgn(single)
+            logic.save_pgn(out_path)
+
+        results["pgn.game_logic_load_save"] = measure(load_save, 5 if quick else 50)
+    return results
+
+
+def bench_engine(quick: bool, engine_path: str, nodes: int) -> dict:
+    from engine_manager import ChessEngine
+
+    if not engine_path or not os.path.exists(engine_path):
+        print(f"  (engine) Motor no trobat a '{engine_path}', s'omet.")
+        return {}
+    engine = ChessEngine(engine_path)
+    rng = random.Random(SEED)
+    fens = []
+    board = chess.Board()
+    for move in random_game(rng, max_plies=40, annotate=False).mainline_moves():
+        board.push(move)
+        fens.append(board.fen())
+    index = [0]
+
+    def analyse():
+        engine.get_analysis(fens[index[0] % len(fens)], num_lines=1, nodes=nodes)
+        index[0] += 1
+
+    number = 5 if quick else 40
+    results = {f"engine.get_analysis_{nodes}_nodes": measure(analyse, number, repeat=3)}
+
+    def analyse_multipv():
+        engine.get_analysis(fens[index[0] % len(fens)], num_lines=3, nodes=nodes)
+        index[0] += 1
+
+    results[f"engine.get_analysis_{nodes}_nodes_multipv3"] = measure(analyse_multipv, number, repeat=3)
+    engine.close()
+    return results
+
+
+BENCHES = {
+    "game_logic": lambda args: bench_game_logic(args.quick),
+    "board": lambda args: bench_board(args.quick),
+    "pgn": lambda args: bench_pgn(args.quick),
+    "engine": lambda args: bench_engine(args.quick, args.engine, args.nodes),
+}
+
+
+# --- Línia base ---
+
+def host_info() -> dict:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "chess": chess.__version__,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Retorna la llista de benchmarks més lents que la línia base."""
+    regressions = []
+    base_results = baseline.get("results", {})
+    print(f"\n{'benchmark':<45}{'base ms':>12}{'ara ms':>12}{'canvi':>10}")
+    for name, data in results.items():
+        base = base_results.get(name)
+        if not base:
+            print(f"{name:<45}{'-':>12}{data['best_ms']:>12.4f}{'nou':>10}")
+            continue
+        change = (data["best_ms"] - base["best_ms"]) / base["best_ms"]
+        flag = "  <-- REGRESSIÓ" if change > threshold else ""
+        print(f"{name:<45}{base['best_ms']:>12.4f}{data['best_ms']:>12.4f}{change:>+10.1%}{flag}")
+        if change > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks de gemini_chess")
+    parser.add_argument("--only", default="", help="Llista separada per comes: " + ",".join(BENCHES))
+    parser.add_argument("--quick", action="store_true", help="Menys iteracions (prova ràpida)")
+    parser.add_argument("--engine", default=os.environ.get("GEMINI_CHESS_ENGINE", DEFAULT_ENGINE))
+    parser.add_argument("--nodes", type=int, default=20000, help="Nodes per cerca al benchmark del motor")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.15)
+    parser.add_argument("--json", help="Desa també els resultats en aquest fitxer")
+    args = parser.parse_args(argv)
+
+    selected = [name for name in args.only.split(",") if name] or list(BENCHES)
+    results = {}
+    for name in selected:
+        if name not in BENCHES:
+            parser.error(f"Benchmark desconegut: {name}")
+        print(f"Executant {name}...")
+        results.update(BENCHES[name](args))
+
+    print(f"\n{'benchmark':<45}{'millor ms':>12}{'ops/s':>14}")
+    for name, data in results.items():
+        print(f"{name:<45}{data['best_ms']:>12.4f}{data['ops_per_sec']:>14.1f}")
+
+    report = {"host": host_info(), "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+              "quick": args.quick, "results": results}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nLínia base desada a {args.baseline}")
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"\nNo hi ha línia base a {args.baseline} (usa --save-baseline)")
+            return 1
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("host", {}).get("machine") != report["host"]["machine"]:
+            print("\nAvís: la línia base és d'una altra màquina, la comparació és orientativa.")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regressió(ns): {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+# src/analysis_server.py
+"""
+Servidor local d'anàlisi: diverses instàncies de la interfície (o scripts)
+comparteixen un sol grup de motors en lloc d'engegar cadascuna el seu Stockfish.
+
+- Un grup de ENGINES motors (ChessEngine) que es reparteixen els fils del
+  perfil interactiu (engine_profiles.budgets): el servidor no fa servir
+  més nuclis que una sola interfície.
+- Memòria cau compartida (AnalysisCache): una posició ja analitzada per un
+  client, a igual o més profunditat, es respon a l'instant a tots els altres.
+- Deduplicació de peticions en curs: si dos clients demanen la mateixa
+  posició amb els mateixos límits mentre encara s'analitza, la segona espera
+  el resultat de la primera en lloc d'ocupar un altre motor.
+
+Protocol: una línia JSON per petició i una per resposta, sobre TCP (per
+defecte 127.0.0.1:PORT, només local) o un socket Unix ("unix:/camí"):
+    {"op": "analyse", "fen": "...", "depth": 15, "lines": 1, "nodes": null}
+        -> {"ok": true, "result": [...], "cached": false}
+    {"op": "stats"} -> {"ok": true, "stats": {...}}
+    {"op": "ping"}  -> {"ok": true}
+
+Ús (des de src):
+    python analysis_server.py [--address 127.0.0.1:7425] [--engines 2]
+i a cada client:
+    GEMINI_CHESS_ANALYSIS_SERVER=127.0.0.1:7425 python main.py
+(el motor principal de la finestra passa a ser un engine_manager.RemoteEngine;
+si el servidor no respon, es fa servir el motor local).
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+from collections import Counter
+from concurrent.futures import Future
+import chess
+from engine_manager import ChessEngine, AnalysisCache, parse_address
+from engine_profiles import EngineProfiles
+
+log = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_ENGINE = os.environ.get("GEMINI_CHESS_ENGINE") or \
+    os.path.join(BASE_DIR, "..", "assets", "engines", "stockfish-ubuntu-x86-64-sse41-popcnt")
+DEFAULT_ADDRESS = "127.0.0.1:7425"
+ENGINES = 2
+CACHE_ENTRIES = 1 << 16
+MAX_DEPTH = 40 # Límits per petició: un client no pot bloquejar un motor indefinidament
+MAX_LINES = 10
+
+
+class AnalysisService:
+    """Grup de motors + memòria cau + peticions en curs (independent de la xarxa)."""
+    def __init__(self, engines: list, cache: AnalysisCache | None = None):
+        self.engines = engines
+        self.cache = cache if cache is not None else AnalysisCache(CACHE_ENTRIES)
+        self._idle = queue.Queue()
+        for engine in engines:
+            self._idle.put(engine)
+        self._inflight = {} # (posició, depth, línies, nodes) -> Future
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    def _count(self, name: str):
+        with self._lock: # Un fil per client: el += d'un Counter no és atòmic
+            self.stats[name] += 1
+
+    def analyse(self, fen: str, depth: int = 15, lines: int = 1, nodes: int | None = None) -> tuple[list | None, bool]:
+        """(línies, si venia de la memòria cau o d'una altra petició)."""
+        self._count("requests")
+        if not nodes: # Les cerques per nodes no són comparables amb les de profunditat: no es guarden
+            cached = self.cache.get(fen, depth, lines)
+            if cached is not None:
+                self._count("cache_hits")
+                return cached, True
+        key = (AnalysisCache.position_key(fen), depth, lines, nodes)
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+        if not owner:
+            self._count("shared")
+            try:
+                return future.result(), True
+            except Exception as e: # La cerca compartida ha fallat: aquest client rep un error, no es penja
+                log.warning("Ha fallat l'anàlisi compartida de %s: %s", fen, e)
+                return None, True
+        try:
+            engine = self._idle.get()
+            try:
+                result = engine.get_analysis(fen, depth, lines, nodes=nodes)
+            finally:
+                self._idle.put(engine)
+            self._count("searches")
+            if result is not None and not nodes:
+                self.cache.put(fen, depth, lines, result)
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def handle(self, message: dict) -> dict:
+        op = message.get("op")
+        if op == "analyse":
+            depth = min(int(message.get("depth") or 15), MAX_DEPTH)
+            lines = max(1, min(int(message.get("lines") or 1), MAX_LINES))
+            nodes = int(message["nodes"]) if message.get("nodes") else None
+            # El FEN va directe a l'entrada del motor compartit: només se'n passa el que regenera python-chess
+            # (un salt de línia podria afegir ordres UCI, i una posició impossible pot fer caure Stockfish)
+            try:
+                board = chess.Board(message["fen"])
+            except (ValueError, TypeError) as e:
+                return {"ok": False, "error": f"FEN invàlid: {e}"}
+            if not board.is_valid():
+                return {"ok": False, "error": f"Posició impossible: {board.status()!r}"}
+            result, cached = self.analyse(board.fen(), depth, lines, nodes)
+            if result is None:
+                return {"ok": False, "error": "El motor no ha pogut analitzar la posició"}
+            return {"ok": True, "result": result, "cached": cached}
+        if op == "stats":
+            return {"ok": True, "stats": dict(self.stats, engines=len(self.engines), idle=self._idle.qsize())}
+        if op == "ping":
+            return {"ok": True}
+        return {"ok": False, "error": f"Operació desconeguda: {op}"}
+
+    def close(self):
+        for engine in self.engines:
+            engine.close()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        service = self.server.service
+        service._count("connections")
+        for line in self.rfile:
+            try:
+                reply = service.handle(json.loads(line))
+            except (ValueError, KeyError, TypeError) as e:
+                reply = {"ok": False, "error": f"Petició invàlida: {e}"}
+            except Exception as e: # El motor ha fallat: es respon igualment, el fil del client continua
+                log.exception("Error atenent una petició")
+                reply = {"ok": False, "error": f"Error del servidor: {e}"}
+            try:
+                self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+                self.wfile.flush()
+            except OSError: # El client ha marxat
+                return
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+    class _UnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+
+def make_server(address: str, service: AnalysisService) -> socketserver.BaseServer:
+    """Servidor (encara sense arrencar) a l'adreça donada; un fil per client."""
+    family, target = parse_address(address)
+    if family == socket.AF_INET:
+        server = _TCPServer(target, _RequestHandler)
+    else:
+        if os.path.exists(target): # Socket d'una execució anterior
+            os.remove(target)
+        server = _UnixServer(target, _RequestHandler)
+    server.service = service
+    return server
+
+
+def main(argv=None) -> int:
+    from log_setup import setup_logging
+    parser = argparse.ArgumentParser(description="Servidor local d'anàlisi compartit")
+    parser.add_argument("--address", default=DEFAULT_ADDRESS, help="host:port o unix:/camí (per defecte %(default)s)")
+    parser.add_argument("--engine", default=DEFAULT_ENGINE)
+    parser.add_argument("--engines", type=int, default=ENGINES, help="Motors del grup (per defecte %(default)s)")
+    args = parser.parse_args(argv)
+    setup_logging("INFO")
+    profiles = EngineProfiles()
+    engines = [ChessEngine(args.engine, params) for params in profiles.budgets(max(1, args.engines))]
+    service = AnalysisService(engines)
+    server = make_server(args.address, service)
+    log.info("Servidor d'anàlisi a %s amb %d motors", args.address, len(engines))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        log.info("Servidor aturat: %s", dict(service.stats))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,28 @@
+# src/app_paths.py
+"""
+Directoris per usuari de l'aplicació (fora del codi font): el diari
+d'autodesat, els perfils del motor... Amb QStandardPaths, per exemple a
+Linux ~/.local/share/gemini_chess i ~/.config/gemini_chess.
+"""
+import os
+from PySide6.QtCore import QCoreApplication, QStandardPaths
+
+APP_NAME = "gemini_chess"
+
+
+def _location(kind: QStandardPaths.StandardLocation) -> str:
+    if QCoreApplication.applicationName() != APP_NAME: # Si no, el nom seria el de l'executable (python)
+        QCoreApplication.setApplicationName(APP_NAME)
+    path = QStandardPaths.writableLocation(kind)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def data_dir() -> str:
+    """Dades de l'usuari (diaris de sessió)."""
+    return _location(QStandardPaths.StandardLocation.AppDataLocation)
+
+
+def config_dir() -> str:
+    """Configuració de l'usuari (perfils del motor)."""
+    return _location(QStandardPaths.StandardLocation.AppConfigLocation)
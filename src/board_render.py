@@ -0,0 +1,305 @@
+# src/board_render.py
+"""
+Diagrames del tauler sense finestra: PNG (QImage) o SVG (QSvgGenerator).
+
+Mateix dibuix que ChessboardWidget (caselles de colors i peces SVG
+d'assets/pieces), però amb QPainter directament sobre una imatge:
+
+- Les peces de cada joc i mida es rasteritzen un sol cop (glyphs(): 12
+  QImage per (directori, mida)). Un diagrama és una còpia del fons (les
+  caselles i les coordenades també es dibuixen un sol cop) i 32 drawImage
+  com a màxim. En SVG les peces són vectorials (QSvgRenderer per fitxer,
+  també en memòria cau).
+- render_batch() reparteix l'escriptura dels fitxers (la compressió PNG és
+  el que més costa) entre diversos fils: PySide allibera el GIL durant les
+  crides a Qt.
+- ThumbnailCache: miniatures en un directori (per la llista de partides).
+  El nom del fitxer és un hash de la posició i de l'estil, així que la
+  mateixa posició no es torna a dibuixar mai i canviar de joc de peces no
+  barreja miniatures.
+
+Ús (des de src; no cal pantalla):
+    python board_render.py posicions.epd --output diagrames/ [--format svg] [--size 400] [--pieces cburnett]
+Cada línia del fitxer és un FEN o una línia EPD (si té 'id', és el nom del fitxer).
+"""
+import argparse
+import hashlib
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import chess
+from PySide6.QtCore import QRectF, QSize, Qt
+from PySide6.QtGui import QColor, QFont, QImage, QPainter
+from PySide6.QtSvg import QSvgGenerator, QSvgRenderer
+from helpers import SQUARE_SIZE, piece_to_filename, light_color, dark_color
+
+log = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PIECES_BASE_DIR = os.path.join(BASE_DIR, "..", "assets", "pieces")
+DEFAULT_PIECES = "cburnett"
+THUMBNAIL_SQUARE = 20 # px per casella de les miniatures (160 x 160)
+PNG_QUALITY = 80 # 0..100 de QImage.save: zlib de nivell 2, gairebé igual de petit i molt més ràpid que el per defecte
+BORDER_COLOR = QColor("#404040")
+
+_glyph_cache = {} # (directori, mida) -> {símbol: QImage}
+_svg_cache = {} # directori -> {símbol: QSvgRenderer}
+_cache_lock = threading.Lock()
+
+
+def _svg_renderers(pieces_dir: str) -> dict:
+    with _cache_lock:
+        renderers = _svg_cache.get(pieces_dir)
+        if renderers is None:
+            renderers = {}
+            for symbol in "PNBRQKpnbrqk":
+                path = os.path.join(pieces_dir, piece_to_filename(chess.Piece.from_symbol(symbol)))
+                renderer = QSvgRenderer(path)
+                if renderer.isValid():
+                    renderers[symbol] = renderer
+                else:
+                    log.warning("No s'ha pogut carregar la peça: %s", path)
+            _svg_cache[pieces_dir] = renderers
+        return renderers
+
+
+def glyphs(pieces_dir: str, size: int) -> dict:
+    """Les 12 peces d'un joc rasteritzades a size x size (en memòria cau)."""
+    key = (pieces_dir, size)
+    with _cache_lock:
+        cached = _glyph_cache.get(key)
+    if cached is not None:
+        return cached
+    images = {}
+    for symbol, renderer in _svg_renderers(pieces_dir).items():
+        image = QImage(size, size, QImage.Format.Format_ARGB32_Premultiplied)
+        image.fill(Qt.GlobalColor.transparent)
+        painter = QPainter(image)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        renderer.render(painter, _fit(renderer.defaultSize(), QRectF(0, 0, size, size)))
+        painter.end()
+        images[symbol] = image
+    with _cache_lock:
+        _glyph_cache[key] = images
+    return images
+
+
+def _fit(source: QSize, target: QRectF) -> QRectF:
+    """Rectangle centrat dins 'target' amb la proporció de 'source' (com KeepAspectRatio)."""
+    if source.isEmpty():
+        return target
+    scale = min(target.width() / source.width(), target.height() / source.height())
+    width, height = source.width() * scale, source.height() * scale
+    return QRectF(target.x() + (target.width() - width) / 2, target.y() + (target.height() - height) / 2,
+                  width, height)
+
+
+class BoardRenderer:
+    """Dibuixa posicions amb un estil fix (joc de peces, mida, colors, orientació, coordenades)."""
+    def __init__(self, pieces_dir: str = os.path.join(PIECES_BASE_DIR, DEFAULT_PIECES),
+                 square_size: int = SQUARE_SIZE, light: QColor = light_color, dark: QColor = dark_color,
+                 flipped: bool = False, coordinates: bool = False):
+        if not os.path.isdir(pieces_dir):
+            raise FileNotFoundError(f"El directori de peces no existeix: {pieces_dir}")
+        self.pieces_dir = os.path.abspath(pieces_dir)
+        self.square_size = square_size
+        self.light, self.dark = QColor(light), QColor(dark)
+        self.flipped = flipped
+        self.margin = square_size // 3 if coordinates else 0
+        self.size = 8 * square_size + 2 * self.margin
+        self._glyphs = glyphs(self.pieces_dir, square_size)
+        # Opac (RGB32): en desar el PNG no cal convertir des d'alfa premultiplicat
+        self._background = QImage(self.size, self.size, QImage.Format.Format_RGB32)
+        painter = QPainter(self._background)
+        self._paint_squares(painter)
+        painter.end()
+
+    def style_key(self) -> str:
+        """Identifica l'estil (per als noms de fitxer de ThumbnailCache)."""
+        return (f"{os.path.basename(self.pieces_dir)}-{self.square_size}-{self.light.name()}-{self.dark.name()}"
+                f"-{int(self.flipped)}-{self.margin}")
+
+    def _square_rect(self, square: chess.Square) -> QRectF:
+        file, rank = chess.square_file(square), chess.square_rank(square)
+        if self.flipped:
+            file, rank = 7 - file, 7 - rank
+        return QRectF(self.margin + file * self.square_size, self.margin + (7 - rank) * self.square_size,
+                      self.square_size, self.square_size)
+
+    def _paint_squares(self, painter: QPainter):
+        painter.fillRect(QRectF(0, 0, self.size, self.size), BORDER_COLOR if self.margin else self.light)
+        for square in chess.SQUARES:
+            dark = (chess.square_file(square) + chess.square_rank(square)) % 2 == 0 # a1 és fosca
+            painter.fillRect(self._square_rect(square), self.dark if dark else self.light)
+        if self.margin:
+            font = QFont()
+            font.setPixelSize(max(6, self.margin * 3 // 4))
+            painter.setFont(font)
+            painter.setPen(QColor("#E0E0E0"))
+            for i in range(8):
+                file_name = chess.FILE_NAMES[7 - i if self.flipped else i]
+                rank_name = chess.RANK_NAMES[i if self.flipped else 7 - i]
+                offset = self.margin + i * self.square_size
+                painter.drawText(QRectF(offset, self.size - self.margin, self.square_size, self.margin),
+                                 Qt.AlignmentFlag.AlignCenter, file_name)
+                painter.drawText(QRectF(0, offset, self.margin, self.square_size),
+                                 Qt.AlignmentFlag.AlignCenter, rank_name)
+
+    def render(self, board: chess.Board | str) -> QImage:
+        """Diagrama de la posició (un chess.Board o un FEN) com a QImage."""
+        if isinstance(board, str):
+            board = chess.Board(board)
+        image = self._background.copy()
+        painter = QPainter(image)
+        for square, piece in board.piece_map().items():
+            glyph = self._glyphs.get(piece.symbol())
+            if glyph is not None:
+                painter.drawImage(self._square_rect(square).topLeft(), glyph)
+        painter.end()
+        return image
+
+    def save_png(self, board: chess.Board | str, path: str) -> bool:
+        return self.render(board).save(path, "PNG", PNG_QUALITY)
+
+    def save_svg(self, board: chess.Board | str, path: str, title: str = ""):
+        """Diagrama vectorial: les peces són els SVG originals, no imatges."""
+        if isinstance(board, str):
+            board = chess.Board(board)
+        generator = QSvgGenerator()
+        generator.setFileName(path)
+        generator.setSize(QSize(self.size, self.size))
+        generator.setViewBox(QRectF(0, 0, self.size, self.size))
+        generator.setTitle(title or board.fen())
+        painter = QPainter(generator)
+        self._paint_squares(painter)
+        renderers = _svg_renderers(self.pieces_dir)
+        for square, piece in board.piece_map().items():
+            renderer = renderers.get(piece.symbol())
+            if renderer is not None:
+                renderer.render(painter, _fit(renderer.defaultSize(), self._square_rect(square)))
+        painter.end()
+
+
+def render_batch(items: list[tuple[str, str]], directory: str, renderer: BoardRenderer,
+                 fmt: str = "png", workers: int | None = None, progress=None) -> int:
+    """
+    Escriu un diagrama per cada (nom, FEN) a 'directory' (nom.png o nom.svg).
+    Retorna quants se n'han escrit. progress(fets, total).
+    """
+    os.makedirs(directory, exist_ok=True)
+    total = len(items)
+    done = [0]
+    lock = threading.Lock()
+
+    def write(item) -> bool:
+        name, fen = item
+        path = os.path.join(directory, f"{name}.{fmt}")
+        try:
+            if fmt == "svg":
+                renderer.save_svg(fen, path)
+                ok = True
+            else:
+                ok = renderer.save_png(fen, path)
+        except ValueError as e:
+            log.warning("%s: FEN invàlid (%s)", name, e)
+            ok = False
+        with lock:
+            done[0] += 1
+            if progress is not None:
+                progress(done[0], total)
+        return ok
+
+    if fmt == "svg": # Els QSvgRenderer compartits no es poden fer servir des de diversos fils alhora
+        return sum(write(item) for item in items)
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        return sum(pool.map(write, items))
+
+
+class ThumbnailCache:
+    """Miniatures PNG de posicions en un directori, creades la primera vegada que es demanen."""
+    def __init__(self, directory: str, renderer: BoardRenderer | None = None):
+        self.directory = directory
+        self.renderer = renderer or BoardRenderer(square_size=THUMBNAIL_SQUARE)
+        os.makedirs(directory, exist_ok=True)
+
+    def set_pieces(self, pieces_dir: str):
+        """Canvia el joc de peces (les miniatures de l'estil anterior es queden al disc)."""
+        old = self.renderer
+        self.renderer = BoardRenderer(pieces_dir, old.square_size, old.light, old.dark, old.flipped)
+
+    def path(self, fen: str) -> str | None:
+        """Camí de la miniatura de la posició (la dibuixa si encara no hi és); None si el FEN no és vàlid."""
+        placement = " ".join(fen.split()[:2]) # Peces i torn: la resta no es veu al diagrama
+        digest = hashlib.blake2b(f"{self.renderer.style_key()}|{placement}".encode(), digest_size=10).hexdigest()
+        path = os.path.join(self.directory, digest[:2], digest + ".png")
+        if os.path.exists(path):
+            return path
+        try:
+            image = self.renderer.render(fen)
+        except ValueError:
+            return None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f"{path}.{threading.get_ident()}.tmp"
+        if not image.save(temporary, "PNG", PNG_QUALITY):
+            log.warning("No s'ha pogut desar la miniatura %s", path)
+            return None
+        os.replace(temporary, path) # Mai una miniatura a mitges al disc
+        return path
+
+
+def read_positions(path: str) -> list[tuple[str, str]]:
+    """(nom, FEN) de cada línia d'un fitxer de FEN o EPD."""
+    items = []
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                board, ops = chess.Board.from_epd(line)
+            except ValueError:
+                try:
+                    board, ops = chess.Board(line), {}
+                except ValueError as e:
+                    log.warning("%s:%d: posició invàlida (%s)", path, number, e)
+                    continue
+            name = str(ops.get("id") or f"{number:05d}")
+            items.append(("".join(c if c.isalnum() or c in "-_." else "_" for c in name), board.fen()))
+    return items
+
+
+def main(argv=None) -> int:
+    from log_setup import setup_logging
+    parser = argparse.ArgumentParser(description="Diagrames PNG/SVG de posicions (sense pantalla)")
+    parser.add_argument("file", help="Fitxer amb un FEN o una línia EPD per línia")
+    parser.add_argument("--output", "-o", required=True, help="Directori de sortida")
+    parser.add_argument("--format", choices=("png", "svg"), default="png")
+    parser.add_argument("--size", type=int, default=8 * SQUARE_SIZE, help="Costat del tauler en px")
+    parser.add_argument("--pieces", default=DEFAULT_PIECES, help="Joc de peces (subdirectori d'assets/pieces)")
+    parser.add_argument("--light", default=light_color.name())
+    parser.add_argument("--dark", default=dark_color.name())
+    parser.add_argument("--flip", action="store_true", help="Negres a baix")
+    parser.add_argument("--coordinates", action="store_true")
+    parser.add_argument("--workers", type=int, help="Fils d'escriptura (per defecte, un per nucli)")
+    args = parser.parse_args(argv)
+    setup_logging("INFO")
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtGui import QGuiApplication
+    app = QGuiApplication.instance() or QGuiApplication([]) # Fonts i plugins d'imatge
+    renderer = BoardRenderer(os.path.join(PIECES_BASE_DIR, args.pieces), max(8, args.size // 8),
+                             QColor(args.light), QColor(args.dark), args.flip, args.coordinates)
+    items = read_positions(args.file)
+    started = time.perf_counter()
+    written = render_batch(items, args.output, renderer, args.format, args.workers)
+    seconds = time.perf_counter() - started
+    print(f"{args.output}: {written} diagrames en {seconds:.2f} s")
+    del app
+    return 0 if written == len(items) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,32 @@
 # src.chessboard_widget.py
 import os
+import logging
 import chess
 from PySide6.QtWidgets import (QGraphicsView, QGraphicsScene, QGraphicsRectItem,
                                QGraphicsPixmapItem, QGraphicsItem)
 from PySide6.QtGui import QColor, QBrush, QPen, QPixmap, QMouseEvent, QPainter
 from PySide6.QtCore import Qt, Signal, QPointF, QRectF
-from helpers import SQUARE_SIZE, square_to_coords, coords_to_square, piece_to_filename
+from helpers import SQUARE_SIZE, square_to_coords, coords_to_square
+from instrumentation import metrics, timed
+from board_render import glyphs
+
+log = logging.getLogger(__name__)
+
+_pixmap_cache = {} # (directori de peces, mida) -> {símbol: QPixmap}
+
+
+def piece_pixmaps(resources_dir: str, size: int = SQUARE_SIZE) -> dict:
+    """
+    Les peces d'un joc com a QPixmap de size x size. Es rasteritzen un sol cop
+    i les comparteixen tots els taulers (pestanyes): cada QGraphicsPixmapItem
+    només en guarda una referència.
+    """
+    key = (resources_dir, size)
+    pixmaps = _pixmap_cache.get(key)
+    if pixmaps is None:
+        pixmaps = {symbol: QPixmap.fromImage(image) for symbol, image in glyphs(resources_dir, size).items()}
+        _pixmap_cache[key] = pixmaps
+    return pixmaps
 
 
 class ChessboardWidget(QGraphicsView):
@@ -36,7 +57,7 @@ class ChessboardWidget(QGraphicsView):
 
         # Guarda la ruta als recursos (ara és obligatòria)
         self.resources_dir = resources_path
-        print(f"ChessboardWidget inicialitzat amb resources_dir: {self.resources_dir}") # Per depuració
+        log.debug("ChessboardWidget inicialitzat amb resources_dir: %s", self.resources_dir)
 
         
         # Configuració de la vista
@@ -72,7 +93,7 @@ class ChessboardWidget(QGraphicsView):
         Canvia el color de les caselles existents sense eliminar-les ni les peces.
         """
         if not self._board_items:
-            print("Avís: S'ha intentat canviar colors però no hi ha caselles (_board_items buit).")
+            log.warning("S'ha intentat canviar colors però no hi ha caselles (_board_items buit).")
             return
 
         # print(f"Canviant colors a Light={light_color.name()}, Dark={dark_color.name()}") # Per depurar
@@ -110,7 +131,7 @@ class ChessboardWidget(QGraphicsView):
         cridant a update_board.
         """
         if not os.path.isdir(new_resources_dir):
-            print(f"Error: El directori de peces especificat no existeix: '{new_resources_dir}'")
+            log.error("El directori de peces especificat no existeix: '%s'", new_resources_dir)
             # Podries mostrar un QMessageBox aquí si vols informar l'usuari
             # o simplement no fer el canvi.
             return False # Indica que el canvi no s'ha fet
@@ -148,6 +169,7 @@ class ChessboardWidget(QGraphicsView):
         self.setSceneRect(0, 0, SQUARE_SIZE * 8, SQUARE_SIZE * 8)
 
         
+    @timed("board.update_board")
     def update_board(self, board: chess.Board):
         """
         Actualitza la posició de les peces al tauler gràfic segons l'estat
@@ -160,49 +182,33 @@ class ChessboardWidget(QGraphicsView):
         self._piece_items.clear()
 
         
-        # 2. Col·loca les peces noves segons el 'board'
+        # 2. Col·loca les peces noves segons el 'board' (imatges de la memòria cau compartida)
+        pixmaps = piece_pixmaps(self.resources_dir)
         for square, piece in board.piece_map().items():
-            filename = piece_to_filename(piece)
-            filepath = os.path.join(self.resources_dir, filename)
-
-            # --- IMPRESSIÓ DE DEPURACIÓ ---
-            # print(f"Intentant carregar peça des de: {filepath}")
-            # -------------------------------
-
-            if os.path.exists(filepath):
-                pixmap_original = QPixmap(filepath)
-                if pixmap_original.isNull():
-                    print(f"Avís: QPixmap és nul després de carregar: {filepath}")
-                    continue             
-
-                # Escala la imatge a la mida de la casella mantenint la relació d'aspecte
-                scaled_pixmap = pixmap_original.scaled(SQUARE_SIZE, SQUARE_SIZE,
-                                              Qt.AspectRatioMode.KeepAspectRatio,
-                                              Qt.TransformationMode.SmoothTransformation)
-                item = QGraphicsPixmapItem(scaled_pixmap)
-
-                # Calcula la posició per centrar la peça dins la casella
-                x, y = square_to_coords(square)
-                offset_x = (SQUARE_SIZE - scaled_pixmap.width()) / 2
-                offset_y = (SQUARE_SIZE - scaled_pixmap.height()) / 2
-                item.setPos(x + offset_x, y + offset_y)
-
-                # Emmagatzema la casella a l'ítem per identificar-lo posteriorment
-                item.setData(0, square)
-                # Assegura que les peces es dibuixin sobre les caselles i ressaltats
-                item.setZValue(1.0)
-
-                self.scene.addItem(item)
-                self._piece_items[square] = item
-            else:
-                # --- AVIS SI NO TROBA EL FITXER ---
-                print(f"Avís: No s'ha trobat la imatge per a la peça: {filepath}")
-                # ----------------------------------
+            pixmap = pixmaps.get(piece.symbol())
+            if pixmap is None: # La imatge que falta ja s'ha avisat en carregar el joc de peces
+                continue
+            item = QGraphicsPixmapItem(pixmap)
+            x, y = square_to_coords(square)
+            item.setPos(x, y)
+            # Emmagatzema la casella a l'ítem per identificar-lo posteriorment
+            item.setData(0, square)
+            # Assegura que les peces es dibuixin sobre les caselles i ressaltats
+            item.setZValue(1.0)
+            self.scene.addItem(item)
+            self._piece_items[square] = item
 
         # Esborra qualsevol ressaltat que pogués quedar
         self._clear_highlights()
         # self._selected_square = None # Normalment no volem deseleccionar en actualitzar
 
+    def paintEvent(self, event):
+        """Pinta la vista; amb la instrumentació activa en mesura el temps de frame."""
+        if not metrics.enabled:
+            return super().paintEvent(event)
+        with metrics.timer("board.frame"):
+            super().paintEvent(event)
+
     def mousePressEvent(self, event: QMouseEvent):
         """Gestiona els clics del ratolí per seleccionar/deseleccionar caselles i intentar moviments."""
         if event.button() == Qt.MouseButton.LeftButton:
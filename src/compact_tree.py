@@ -0,0 +1,394 @@
+# src/compact_tree.py
+"""
+Arbre de partida compacte, guardat en arrays paral·lels.
+
+chess.pgn.GameNode és un objecte Python complet per cada jugada (diccionari,
+llista de variants, conjunt de NAGs...). Amb fitxers d'anàlisi grans, amb
+moltes variants, això són centenars de MB. Aquí cada node ocupa 14 bytes:
+
+    _moves[i]         jugada codificada en 16 bits (origen | destí << 6 | promoció << 12)
+    _parent[i]        índex del node pare (-1 per l'arrel)
+    _first_child[i]   primer fill (-1 si no en té): és la línia principal
+    _next_sibling[i]  següent germà (-1 si és l'últim): les variants
+
+Els comentaris i NAGs, que són escassos, van en diccionaris per índex.
+NodeView és una vista lleugera (__slots__) amb la mateixa interfície bàsica
+que GameNode, i la conversió a chess.pgn.Game només es fa en exportar.
+
+Per llegir un PGN directament a aquest format:
+    tree = chess.pgn.read_game(handle, Visitor=CompactTreeBuilder)
+"""
+from array import array
+import chess
+import chess.pgn
+
+NO_INDEX = -1
+
+
+def encode_move(move: chess.Move) -> int:
+    """Codifica una jugada en 16 bits (6 origen, 6 destí, 3 promoció)."""
+    return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+
+def decode_move(code: int) -> chess.Move:
+    promotion = code >> 12
+    return chess.Move(code & 0x3F, (code >> 6) & 0x3F, promotion or None)
+
+
+class CompactGameTree:
+    """
+    Partida (capçaleres + arbre de jugades) en format compacte.
+    Imita la part de chess.pgn.Game que fa servir GameLogic: headers, setup(),
+    board(), end(), mainline_moves() i accept() (aquest darrer via to_game()).
+    """
+    def __init__(self, headers: chess.pgn.Headers | None = None):
+        self.headers = headers if headers is not None else chess.pgn.Headers()
+        self.errors = []
+        self._moves = array('H', [0]) # El node 0 és l'arrel (sense jugada)
+        self._parent = array('i', [NO_INDEX])
+        self._first_child = array('i', [NO_INDEX])
+        self._next_sibling = array('i', [NO_INDEX])
+        self._comments = {} # índex -> comentari
+        self._starting_comments = {} # índex -> comentari d'inici de variant
+        self._nags = {} # índex -> set de NAGs
+        self._removed = 0
+        self._root_board = None # Cache del tauler inicial
+
+    # --- Estructura ---
+    def __len__(self) -> int:
+        """Nombre de nodes vius (inclosa l'arrel)."""
+        return len(self._moves) - self._removed
+
+    def root(self) -> "NodeView":
+        return NodeView(self, 0)
+
+    def add_node(self, parent: int, move: chess.Move) -> int:
+        """Afegeix un fill al final de les variants de 'parent'. Retorna el nou índex."""
+        index = len(self._moves)
+        self._moves.append(encode_move(move))
+        self._parent.append(parent)
+        self._first_child.append(NO_INDEX)
+        self._next_sibling.append(NO_INDEX)
+        child = self._first_child[parent]
+        if child == NO_INDEX:
+            self._first_child[parent] = index
+        else:
+            while self._next_sibling[child] != NO_INDEX:
+                child = self._next_sibling[child]
+            self._next_sibling[child] = index
+        return index
+
+    def remove_node(self, index: int):
+        """Desenganxa un node (i el seu subarbre) del seu pare."""
+        parent = self._parent[index]
+        if parent == NO_INDEX:
+            raise ValueError("No es pot eliminar l'arrel")
+        child = self._first_child[parent]
+        if child == index:
+            self._first_child[parent] = self._next_sibling[index]
+        else:
+            while self._next_sibling[child] != index:
+                child = self._next_sibling[child]
+            self._next_sibling[child] = self._next_sibling[index]
+        # L'espai no es recupera (els arrays només creixen), però sí els comentaris
+        stack = [index]
+        while stack:
+            node = stack.pop()
+            self._removed += 1
+            self._comments.pop(node, None)
+            self._starting_comments.pop(node, None)
+            self._nags.pop(node, None)
+            child = self._first_child[node]
+            while child != NO_INDEX:
+                stack.append(child)
+                child = self._next_sibling[child]
+
+    def children(self, index: int) -> list[int]:
+        result = []
+        child = self._first_child[index]
+        while child != NO_INDEX:
+            result.append(child)
+            child = self._next_sibling[child]
+        return result
+
+    def move_at(self, index: int) -> chess.Move | None:
+        return decode_move(self._moves[index]) if index else None
+
+    def path_moves(self, index: int) -> list[chess.Move]:
+        """Jugades des de l'arrel fins al node 'index'."""
+        codes = []
+        while index > 0:
+            codes.append(self._moves[index])
+            index = self._parent[index]
+        return [decode_move(code) for code in reversed(codes)]
+
+    # --- Interfície tipus chess.pgn.Game ---
+    def setup(self, board: chess.Board | str):
+        """Com chess.pgn.Game.setup: fixa la posició inicial a les capçaleres."""
+        if isinstance(board, str):
+            board = chess.Board(board)
+        fen = board.fen()
+        if fen == chess.STARTING_FEN:
+            self.headers.pop("SetUp", None)
+            self.headers.pop("FEN", None)
+        else:
+            self.headers["SetUp"] = "1"
+            self.headers["FEN"] = fen
+        self._root_board = None
+
+    def board(self) -> chess.Board:
+        """Tauler de la posició inicial (nou objecte cada vegada)."""
+        if self._root_board is None:
+            self._root_board = self.headers.board()
+        return self._root_board.copy(stack=False)
+
+    def end(self) -> "NodeView":
+        return self.root().end()
+
+    def mainline_moves(self):
+        return self.root().mainline_moves()
+
+    def accept(self, visitor):
+        """Exporta (p. ex. amb chess.pgn.FileExporter) via conversió a chess.pgn.Game."""
+        return self.to_game().accept(visitor)
+
+    def __str__(self) -> str:
+        return str(self.to_game())
+
+    # --- Conversions ---
+    def to_game(self) -> chess.pgn.Game:
+        """Construeix un chess.pgn.Game equivalent (només quan cal exportar)."""
+        game = chess.pgn.Game()
+        game.headers = chess.pgn.Headers(self.headers)
+        game.comment = self._comments.get(0, "")
+        stack = [(0, game)]
+        while stack:
+            index, node = stack.pop()
+            for child in self.children(index):
+                child_node = node.add_variation(
+                    decode_move(self._moves[child]),
+                    comment=self._comments.get(child, ""),
+                    starting_comment=self._starting_comments.get(child, ""),
+                    nags=self._nags.get(child, ()))
+                stack.append((child, child_node))
+        return game
+
+    @classmethod
+    def from_game(cls, game: chess.pgn.Game) -> "CompactGameTree":
+        tree = cls(chess.pgn.Headers(game.headers))
+        if game.comment:
+            tree._comments[0] = game.comment
+        stack = [(game, 0)]
+        while stack:
+            node, index = stack.pop()
+            for child in node.variations:
+                child_index = tree.add_node(index, child.move)
+                if child.comment:
+                    tree._comments[child_index] = child.comment
+                if child.starting_comment:
+                    tree._starting_comments[child_index] = child.starting_comment
+                if child.nags:
+                    tree._nags[child_index] = set(child.nags)
+                stack.append((child, child_index))
+        return tree
+
+
+class NodeView:
+    """Vista d'un node de CompactGameTree amb la interfície bàsica de GameNode."""
+    __slots__ = ("tree", "index")
+
+    def __init__(self, tree: CompactGameTree, index: int):
+        self.tree = tree
+        self.index = index
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, NodeView) and other.tree is self.tree and other.index == self.index
+
+    def __hash__(self) -> int:
+        return hash((id(self.tree), self.index))
+
+    def __repr__(self) -> str:
+        return f"<NodeView {self.index} {self.move}>"
+
+    @property
+    def move(self) -> chess.Move | None:
+        return self.tree.move_at(self.index)
+
+    @property
+    def parent(self) -> "NodeView | None":
+        parent = self.tree._parent[self.index]
+        return NodeView(self.tree, parent) if parent != NO_INDEX else None
+
+    @property
+    def headers(self) -> chess.pgn.Headers:
+        return self.tree.headers
+
+    @property
+    def variations(self) -> list["NodeView"]:
+        return [NodeView(self.tree, child) for child in self.tree.children(self.index)]
+
+    def variation(self, move: int | chess.Move) -> "NodeView":
+        """Com GameNode.variation: per índex o per jugada (KeyError si no hi és)."""
+        children = self.tree.children(self.index)
+        if isinstance(move, int):
+            if 0 <= move < len(children):
+                return NodeView(self.tree, children[move])
+        else:
+            code = encode_move(move)
+            for child in children:
+                if self.tree._moves[child] == code:
+                    return NodeView(self.tree, child)
+        raise KeyError("variation not found")
+
+    def is_end(self) -> bool:
+        return self.tree._first_child[self.index] == NO_INDEX
+
+    def is_main_variation(self) -> bool:
+        parent = self.tree._parent[self.index]
+        return parent == NO_INDEX or self.tree._first_child[parent] == self.index
+
+    def game(self) -> "NodeView":
+        return NodeView(self.tree, 0)
+
+    def add_variation(self, move: chess.Move, *, comment: str = "",
+                      starting_comment: str = "", nags=()) -> "NodeView":
+        index = self.tree.add_node(self.index, move)
+        if comment:
+            self.tree._comments[index] = comment
+        if starting_comment:
+            self.tree._starting_comments[index] = starting_comment
+        if nags:
+            self.tree._nags[index] = set(nags)
+        return NodeView(self.tree, index)
+
+    def add_main_variation(self, move: chess.Move, *, comment: str = "", nags=()) -> "NodeView":
+        """Afegeix la jugada com a primera variant (línia principal)."""
+        node = self.add_variation(move, comment=comment, nags=nags)
+        tree = self.tree
+        if tree._first_child[self.index] != node.index:
+            # Mou el nou node (l'últim germà) al capdavant
+            child = tree._first_child[self.index]
+            while tree._next_sibling[child] != node.index:
+                child = tree._next_sibling[child]
+            tree._next_sibling[child] = NO_INDEX
+            tree._next_sibling[node.index] = tree._first_child[self.index]
+            tree._first_child[self.index] = node.index
+        return node
+
+    def remove_variation(self, move: int | chess.Move):
+        self.tree.remove_node(self.variation(move).index)
+
+    def board(self) -> chess.Board:
+        """Tauler de la posició d'aquest node (reprodueix les jugades des de l'arrel)."""
+        board = self.tree.board()
+        for move in self.tree.path_moves(self.index):
+            board.push(move)
+        return board
+
+    def ply(self) -> int:
+        depth = 0
+        index = self.index
+        while self.tree._parent[index] != NO_INDEX:
+            depth += 1
+            index = self.tree._parent[index]
+        return depth + self.tree.board().ply()
+
+    def end(self) -> "NodeView":
+        index = self.index
+        first_child = self.tree._first_child
+        while first_child[index] != NO_INDEX:
+            index = first_child[index]
+        return NodeView(self.tree, index)
+
+    def mainline_moves(self):
+        """Generador de les jugades de la línia principal a partir d'aquest node."""
+        first_child = self.tree._first_child
+        index = first_child[self.index]
+        while index != NO_INDEX:
+            yield decode_move(self.tree._moves[index])
+            index = first_child[index]
+
+    # --- Anotacions ---
+    @property
+    def comment(self) -> str:
+        return self.tree._comments.get(self.index, "")
+
+    @comment.setter
+    def comment(self, value: str):
+        if value:
+            self.tree._comments[self.index] = value
+        else:
+            self.tree._comments.pop(self.index, None)
+
+    @property
+    def starting_comment(self) -> str:
+        return self.tree._starting_comments.get(self.index, "")
+
+    @starting_comment.setter
+    def starting_comment(self, value: str):
+        if value:
+            self.tree._starting_comments[self.index] = value
+        else:
+            self.tree._starting_comments.pop(self.index, None)
+
+    @property
+    def nags(self) -> set:
+        """Conjunt de NAGs (modificable: es crea i es guarda en demanar-lo)."""
+        return self.tree._nags.setdefault(self.index, set())
+
+
+class CompactTreeBuilder(chess.pgn.BaseVisitor):
+    """
+    Visitor per a chess.pgn.read_game que construeix directament un
+    CompactGameTree, sense crear cap GameNode intermedi.
+    Segueix la mateixa lògica que chess.pgn.GameBuilder.
+    """
+    def begin_game(self):
+        self.tree = CompactGameTree()
+        self.variation_stack = [0]
+        self.starting_comment = ""
+        self.in_variation = False
+
+    def begin_headers(self) -> chess.pgn.Headers:
+        return self.tree.headers
+
+    def visit_header(self, tagname: str, tagvalue: str):
+        self.tree.headers[tagname] = tagvalue
+
+    def visit_nag(self, nag: int):
+        self.tree._nags.setdefault(self.variation_stack[-1], set()).add(nag)
+
+    def begin_variation(self):
+        parent = self.tree._parent[self.variation_stack[-1]]
+        assert parent != NO_INDEX, "begin_variation called, but root node on top of stack"
+        self.variation_stack.append(parent)
+        self.in_variation = False
+
+    def end_variation(self):
+        self.variation_stack.pop()
+
+    def visit_result(self, result: str):
+        if self.tree.headers.get("Result", "*") == "*":
+            self.tree.headers["Result"] = result
+
+    def visit_comment(self, comment: str):
+        top = self.variation_stack[-1]
+        comments = self.tree._comments
+        if self.in_variation or (top == 0 and self.tree._first_child[0] == NO_INDEX):
+            comments[top] = " ".join(filter(None, [comments.get(top, ""), comment]))
+        else:
+            self.starting_comment = " ".join(filter(None, [self.starting_comment, comment]))
+
+    def visit_move(self, board: chess.Board, move: chess.Move):
+        index = self.tree.add_node(self.variation_stack[-1], move)
+        self.variation_stack[-1] = index
+        if self.starting_comment:
+            self.tree._starting_comments[index] = self.starting_comment
+            self.starting_comment = ""
+        self.in_variation = True
+
+    def handle_error(self, error: Exception):
+        self.tree.errors.append(error)
+
+    def result(self) -> CompactGameTree:
+        return self.tree
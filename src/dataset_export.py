@@ -0,0 +1,298 @@
+# src/dataset_export.py
+"""
+Exportació de posicions de fitxers PGN a tensors per entrenar xarxes (NumPy).
+
+Per cada posició de la línia principal (abans de cada jugada) es guarden:
+
+    planes     uint8   (N, 12, 64)  una capa per peça i color (blanques P N B R Q K, negres igual;
+                                    l'ordre de position_search.BITBOARD_COLUMNS), casella a1=0 ... h8=63
+    turn       uint8   (N,)         1 si mouen les blanques
+    castling   uint8   (N, 4)       drets d'enroc K Q k q
+    result     int8    (N,)         resultat de la partida des de les blanques (1, 0, -1)
+    eval       float32 (N,)         avaluació dels comentaris [%eval] (cp, blanques; NaN si no n'hi ha)
+
+Les posicions es reparteixen en fragments (shards) de SHARD_POSITIONS; cada
+fragment és un .npy per camp (<directori>/00000.planes.npy...) que es pot
+obrir amb np.load(..., mmap_mode="r") sense llegir-lo sencer.
+manifest.json diu quants fragments i posicions hi ha.
+
+El PGN es llegeix en streaming (pgn_io) i les partides es parsegen en
+WORKERS processos (el parseig és Python pur: amb fils no es faria servir més
+d'un nucli). Cada procés torna les posicions en forma compacta, 12 bitboards
+uint64 per posició (96 bytes); el procés principal en fa les capes amb
+np.unpackbits sobre tot el bloc i les escriu al memmap del fragment per trossos
+de CHUNK_POSITIONS. Cap bucle per casella ni crida a Board.piece_at.
+Hi ha com a molt 2 * WORKERS lots en vol: la memòria no depèn de la mida del fitxer.
+
+Ús (des de src):
+    python dataset_export.py partides.pgn.zst [més.pgn ...] --output dataset/ [--workers 8] [--min-ply 8]
+"""
+import argparse
+import io
+import json
+import logging
+import math
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import chess
+import chess.pgn
+
+try:
+    import numpy as np
+except ImportError: # Opcional, com a position_search
+    np = None
+
+from pgn_io import open_pgn_binary, iter_games
+
+log = logging.getLogger(__name__)
+
+SHARD_POSITIONS = 1 << 20
+CHUNK_POSITIONS = 1 << 16 # Posicions per escriptura al memmap (48 MB de capes)
+BATCH_GAMES = 256 # Partides per lot enviat a un procés
+MATE_SCORE = 10000 # cp equivalents a un mat (el signe diu qui guanya)
+RESULTS = {"1-0": 1, "0-1": -1, "1/2-1/2": 0}
+FIELDS = ("planes", "turn", "castling", "result", "eval")
+# Casella de la torre de cada dret d'enroc (bits de Board.castling_rights): K Q k q
+CASTLING_SQUARES = (chess.H1, chess.A1, chess.H8, chess.A8)
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("Cal el paquet 'numpy' per exportar posicions (pip install numpy)")
+
+
+class PositionVisitor(chess.pgn.BaseVisitor):
+    """
+    Recull cada posició de la línia principal (abans de cada jugada) sense
+    construir l'arbre: el tauler és el que ja manté el parser.
+    """
+    def begin_game(self):
+        self.result_tag = "*"
+        self.bitboards = [] # 12 enters per posició, seguits
+        self.turns = []
+        self.castling = []
+        self.evals = []
+        self._eval = math.nan # Avaluació del comentari després de l'última jugada
+
+    def visit_header(self, tagname: str, tagvalue: str):
+        if tagname == "Result":
+            self.result_tag = tagvalue
+
+    def end_headers(self):
+        if self.result_tag not in RESULTS: # Sense resultat no hi ha etiqueta: no cal parsejar les jugades
+            return chess.pgn.SKIP
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def visit_comment(self, comment: str):
+        match = chess.pgn.EVAL_REGEX.search(comment)
+        if match is None:
+            return
+        if match.group("mate"):
+            mate = int(match.group("mate"))
+            self._eval = float((MATE_SCORE - abs(mate)) * (1 if mate > 0 else -1))
+        else:
+            self._eval = float(match.group("cp")) * 100
+
+    def visit_move(self, board: chess.Board, move: chess.Move):
+        white, black = board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK]
+        masks = (board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings)
+        self.bitboards.extend([m & white for m in masks] + [m & black for m in masks])
+        self.turns.append(board.turn)
+        self.castling.append(board.castling_rights)
+        self.evals.append(self._eval)
+        self._eval = math.nan
+
+    def handle_error(self, error: Exception):
+        log.debug("Error de sintaxi PGN (s'ignora la resta de la partida): %s", error)
+
+    def result(self):
+        return self
+
+
+def convert_games(texts: list[bytes], min_ply: int = 0) -> dict:
+    """
+    Posicions d'un lot de partides en forma compacta (s'executa als processos):
+    bitboards (n, 12) uint64, turn, castling_rights (uint64), result, eval.
+    """
+    bitboards, turns, castling, results, evals = [], [], [], [], []
+    skipped = 0
+    for data in texts:
+        visitor = chess.pgn.read_game(io.StringIO(data.decode("utf-8", errors="replace")), Visitor=PositionVisitor)
+        if visitor is None:
+            continue
+        result = RESULTS.get(visitor.result_tag)
+        if result is None: # Partida sense acabar: no hi ha etiqueta de resultat
+            skipped += 1
+            continue
+        bitboards.extend(visitor.bitboards[min_ply * 12:])
+        turns.extend(visitor.turns[min_ply:])
+        castling.extend(visitor.castling[min_ply:])
+        evals.extend(visitor.evals[min_ply:])
+        results.extend([result] * max(0, len(visitor.turns) - min_ply))
+    return {
+        "bitboards": np.array(bitboards, dtype=np.uint64).reshape(-1, 12),
+        "turn": np.array(turns, dtype=np.uint8),
+        "castling_rights": np.array(castling, dtype=np.uint64),
+        "result": np.array(results, dtype=np.int8),
+        "eval": np.array(evals, dtype=np.float32),
+        "games": len(texts) - skipped,
+        "skipped": skipped,
+    }
+
+
+def bitboard_planes(bitboards) -> "np.ndarray":
+    """(n, 12) bitboards uint64 -> (n, 12, 64) capes uint8 (bit i = casella i)."""
+    as_bytes = bitboards.astype("<u8", copy=False).view(np.uint8).reshape(len(bitboards), 12, 8)
+    return np.unpackbits(as_bytes, axis=-1, bitorder="little")
+
+
+def castling_planes(rights) -> "np.ndarray":
+    """castling_rights (n,) uint64 -> (n, 4) uint8 K Q k q."""
+    shifts = np.array(CASTLING_SQUARES, dtype=np.uint64)
+    return ((rights[:, None] >> shifts) & np.uint64(1)).astype(np.uint8)
+
+
+class ShardWriter:
+    """Acumula posicions compactes i escriu un fragment cada 'shard_positions'."""
+    def __init__(self, directory: str, shard_positions: int = SHARD_POSITIONS):
+        _require_numpy()
+        self.directory = directory
+        self.shard_positions = shard_positions
+        self.manifest = {"fields": {name: None for name in FIELDS}, "shards": [], "positions": 0, "games": 0}
+        self._pending = []
+        self._pending_count = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, batch: dict):
+        self.manifest["games"] += batch["games"]
+        if not len(batch["turn"]):
+            return
+        self._pending.append(batch)
+        self._pending_count += len(batch["turn"])
+        while self._pending_count >= self.shard_positions:
+            self._flush(self.shard_positions)
+
+    def close(self):
+        if self._pending_count:
+            self._flush(self._pending_count)
+        self._save_manifest()
+
+    def _take(self, count: int) -> dict:
+        """Les primeres 'count' posicions pendents (les que sobren queden per al fragment següent)."""
+        merged = {name: np.concatenate([batch[name] for batch in self._pending])
+                  for name in ("bitboards", "turn", "castling_rights", "result", "eval")}
+        rest = {name: values[count:] for name, values in merged.items()}
+        self._pending = [rest] if len(rest["turn"]) else []
+        self._pending_count = len(rest["turn"])
+        return {name: values[:count] for name, values in merged.items()}
+
+    def _flush(self, count: int):
+        data = self._take(count)
+        name = f"{len(self.manifest['shards']):05d}"
+        shapes = {"planes": ((count, 12, 64), np.uint8), "turn": ((count,), np.uint8),
+                  "castling": ((count, 4), np.uint8), "result": ((count,), np.int8),
+                  "eval": ((count,), np.float32)}
+        outputs = {field: np.lib.format.open_memmap(os.path.join(self.directory, f"{name}.{field}.npy"),
+                                                    mode="w+", dtype=dtype, shape=shape)
+                   for field, (shape, dtype) in shapes.items()}
+        for start in range(0, count, CHUNK_POSITIONS):
+            end = min(start + CHUNK_POSITIONS, count)
+            outputs["planes"][start:end] = bitboard_planes(data["bitboards"][start:end])
+            outputs["castling"][start:end] = castling_planes(data["castling_rights"][start:end])
+        outputs["turn"][:] = data["turn"]
+        outputs["result"][:] = data["result"]
+        outputs["eval"][:] = data["eval"]
+        for field, output in outputs.items():
+            self.manifest["fields"][field] = {"dtype": output.dtype.str, "shape": list(output.shape[1:])}
+            output.flush()
+        del outputs # Tanca els memmaps
+        self.manifest["shards"].append({"name": name, "positions": count})
+        self.manifest["positions"] += count
+        self._save_manifest() # Els fragments ja escrits es poden fer servir encara que s'interrompi
+        log.info("Fragment %s: %d posicions (%d en total)", name, count, self.manifest["positions"])
+
+    def _save_manifest(self):
+        with open(os.path.join(self.directory, "manifest.json"), "w") as f:
+            json.dump(self.manifest, f, indent=2)
+
+
+def _batches(filenames: list[str], batch_games: int):
+    """Lots de text de partides de tots els fitxers, en ordre."""
+    batch = []
+    for filename in filenames:
+        with open_pgn_binary(filename) as stream:
+            for _, data in iter_games(stream):
+                batch.append(data)
+                if len(batch) >= batch_games:
+                    yield batch
+                    batch = []
+    if batch:
+        yield batch
+
+
+def export(filenames: list[str], directory: str, workers: int = 1, min_ply: int = 0,
+           shard_positions: int = SHARD_POSITIONS, batch_games: int = BATCH_GAMES, progress=None) -> dict:
+    """
+    Exporta les posicions dels fitxers a 'directory'. Retorna el manifest.
+    progress(partides, posicions) després de cada lot.
+    """
+    _require_numpy()
+    writer = ShardWriter(directory, shard_positions)
+    skipped = 0
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+        in_flight = deque()
+        batches = _batches(filenames, batch_games)
+        for batch in batches:
+            in_flight.append(pool.submit(convert_games, batch, min_ply))
+            if len(in_flight) < 2 * workers:
+                continue
+            result = in_flight.popleft().result() # En ordre: el conjunt és reproduïble
+            writer.add(result)
+            skipped += result["skipped"]
+            if progress is not None:
+                progress(writer.manifest["games"], writer.manifest["positions"] + writer._pending_count)
+        while in_flight:
+            result = in_flight.popleft().result()
+            writer.add(result)
+            skipped += result["skipped"]
+    writer.manifest["skipped_games"] = skipped
+    writer.manifest["sources"] = [os.path.basename(filename) for filename in filenames]
+    writer.close()
+    seconds = time.perf_counter() - started
+    log.info("Exportades %d posicions de %d partides en %.1f s (%.0f posicions/min)",
+             writer.manifest["positions"], writer.manifest["games"], seconds,
+             writer.manifest["positions"] * 60 / seconds if seconds else 0)
+    return writer.manifest
+
+
+def load_shard(directory: str, name: str) -> dict:
+    """Camps d'un fragment com a memmaps de només lectura."""
+    _require_numpy()
+    return {field: np.load(os.path.join(directory, f"{name}.{field}.npy"), mmap_mode="r") for field in FIELDS}
+
+
+def main(argv=None) -> int:
+    from log_setup import setup_logging
+    parser = argparse.ArgumentParser(description="Exporta posicions de PGN a capes NumPy (.npy)")
+    parser.add_argument("files", nargs="+", help="Fitxers PGN (.pgn, .gz, .bz2, .xz, .zst)")
+    parser.add_argument("--output", "-o", required=True, help="Directori de sortida")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Processos de conversió (per defecte, un per nucli)")
+    parser.add_argument("--min-ply", type=int, default=0, help="Salta les primeres posicions de cada partida")
+    parser.add_argument("--shard-size", type=int, default=SHARD_POSITIONS, help="Posicions per fragment")
+    args = parser.parse_args(argv)
+    setup_logging("INFO")
+    manifest = export(args.files, args.output, args.workers, args.min_ply, args.shard_size)
+    print(f"{args.output}: {manifest['positions']} posicions de {manifest['games']} partides "
+          f"en {len(manifest['shards'])} fragments")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,434 @@
+# src/db_manager.py
+"""
+Accés a la base de dades SQLite de partides (assets/db/chess.db).
+
+La taula 'games' és la de l'esquema original (capçaleres en camps TEXT i
+les jugades en un BLOB). Les jugades de la línia principal es guarden com
+a enters de 16 bits (encode_move de compact_tree), en l'ordre en què es
+van jugar. Les capçaleres que no tenen camp propi van a 'extra' en JSON.
+
+Per poder reimportar un PGN de forma incremental, cada partida recorda de
+quin fitxer ve (source_id) i a quin offset hi comença (source_offset), i la
+taula 'pgn_sources' guarda l'empremta del fitxer a l'última importació.
+
+La cerca de text (jugadors, torneig, lloc i comentaris) fa servir una taula
+FTS5 'games_fts' (rowid = games.id) que s'omple durant la importació. Si
+l'SQLite no té FTS5, search_condition() fa servir LIKE (lent, però funciona).
+
+Cada partida té un hash canònic (game_hash, veure dedup.py) amb índex, per
+detectar duplicats en importar sense comparar partides de dues en dues.
+"""
+import json
+import logging
+import os
+import re
+import sqlite3
+from array import array
+import chess
+import chess.pgn
+from compact_tree import encode_move, decode_move
+from dedup import game_hash
+
+log = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DB = os.path.join(BASE_DIR, "..", "assets", "db", "chess.db")
+DEFAULT_USER = "local" # Usuari propietari de les partides importades
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS "games" (
+    "id"	INTEGER NOT NULL,
+    "user_id"	INTEGER NOT NULL,
+    "fen"	TEXT NOT NULL DEFAULT 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+    "ply"	INTEGER NOT NULL DEFAULT 0,
+    "white"	TEXT NOT NULL,
+    "black"	TEXT NOT NULL,
+    "elo_white"	INTEGER DEFAULT 0,
+    "elo_black"	INTEGER DEFAULT 0,
+    "tournament"	TEXT DEFAULT '',
+    "location"	TEXT DEFAULT '',
+    "round_num"	TEXT DEFAULT '',
+    "result"	TEXT DEFAULT '',
+    "team_white"	TEXT DEFAULT '',
+    "team_black"	TEXT DEFAULT '',
+    "eco"	TEXT DEFAULT '',
+    "date"	TEXT DEFAULT CURRENT_TIMESTAMP,
+    "extra"	TEXT,
+    "moves"	BLOB NOT NULL DEFAULT '',
+    FOREIGN KEY("user_id") REFERENCES "users"("id"),
+    PRIMARY KEY("id" AUTOINCREMENT)
+);
+CREATE TABLE IF NOT EXISTS pgn_sources (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL UNIQUE,
+    size INTEGER NOT NULL DEFAULT 0,
+    mtime REAL NOT NULL DEFAULT 0,
+    inode INTEGER NOT NULL DEFAULT 0,
+    last_offset INTEGER NOT NULL DEFAULT 0,
+    end_offset INTEGER NOT NULL DEFAULT 0,
+    head_hash BLOB,
+    tail_hash BLOB,
+    checkpoints TEXT,
+    game_count INTEGER NOT NULL DEFAULT 0,
+    imported_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+# Índex de text complet: rowid = games.id. Accents ignorats i índex de prefixos de 2 i 3 lletres
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE games_fts USING fts5(
+    white, black, event, site, comments,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+)
+"""
+FTS_COLUMNS = ("white", "black", "event", "site", "comments")
+
+# Capçalera PGN -> columna de 'games'
+HEADER_COLUMNS = {
+    "White": "white",
+    "Black": "black",
+    "Event": "tournament",
+    "Site": "location",
+    "Round": "round_num",
+    "Result": "result",
+    "WhiteTeam": "team_white",
+    "BlackTeam": "team_black",
+    "ECO": "eco",
+    "Date": "date",
+}
+# Columnes amb índex (id inclòs per desempatar): la llista de partides només hi ordena
+SORTABLE_COLUMNS = ("white", "black", "elo_white", "elo_black", "result", "date", "tournament", "eco", "ply")
+INSERT_COLUMNS = ("user_id", "fen", "ply", "white", "black", "elo_white", "elo_black",
+                  "tournament", "location", "round_num", "result", "team_white",
+                  "team_black", "eco", "date", "extra", "moves", "source_id", "source_offset", "game_hash")
+# Columnes que una partida duplicada pot completar si a l'original hi falten (veure merge_game)
+MERGE_COLUMNS = ("elo_white", "elo_black", "tournament", "location", "round_num",
+                 "team_white", "team_black", "eco", "date")
+SOURCE_FIELDS = ("size", "mtime", "inode", "last_offset", "end_offset",
+                 "head_hash", "tail_hash", "checkpoints", "game_count")
+
+
+def encode_moves(moves) -> bytes:
+    """Jugades -> BLOB (uint16 little-endian per jugada)."""
+    return array('H', (encode_move(m) for m in moves)).tobytes()
+
+
+def decode_moves(blob: bytes) -> list[chess.Move]:
+    codes = array('H')
+    codes.frombytes(blob)
+    return [decode_move(code) for code in codes]
+
+
+def fts_query(text: str) -> str:
+    """
+    Converteix el text del quadre de cerca en una consulta FTS5: cada paraula
+    es busca com a prefix i totes han de coincidir. "white:carlsen" restringeix
+    la paraula a una columna (white, black, event, site, comments).
+    """
+    terms = []
+    for word in text.split():
+        column = None
+        if ":" in word:
+            prefix, rest = word.split(":", 1)
+            if prefix.lower() in FTS_COLUMNS:
+                column, word = prefix.lower(), rest
+        word = re.sub(r'["*^():]', " ", word).strip()
+        for token in word.split():
+            term = f'"{token}"*'
+            terms.append(f"{column} : {term}" if column else term)
+    return " ".join(terms)
+
+
+def _elo(value: str | None) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def game_row(headers, moves: list[chess.Move], user_id: int,
+             source_id: int | None = None, source_offset: int | None = None,
+             comments: str = "") -> dict:
+    """
+    Construeix la fila de 'games' a partir de capçaleres i jugades de la línia
+    principal. 'comments' només va a l'índex de text, no a la taula.
+    """
+    row = {column: headers.get(tag, "") or "" for tag, column in HEADER_COLUMNS.items()}
+    extra = {tag: value for tag, value in headers.items()
+             if tag not in HEADER_COLUMNS and tag not in ("WhiteElo", "BlackElo", "FEN", "SetUp")}
+    row.update(
+        user_id=user_id,
+        fen=headers.get("FEN") or chess.STARTING_FEN,
+        ply=len(moves),
+        elo_white=_elo(headers.get("WhiteElo")),
+        elo_black=_elo(headers.get("BlackElo")),
+        extra=json.dumps(extra, ensure_ascii=False) if extra else None,
+        moves=encode_moves(moves),
+        comments=comments,
+        source_id=source_id,
+        source_offset=source_offset,
+    )
+    row["game_hash"] = game_hash(row["white"], row["black"], row["result"], row["fen"], row["moves"], row["ply"])
+    return row
+
+
+def _unknown(column: str, value) -> bool:
+    """Cert si el valor d'una capçalera no aporta informació (buit, '?', Elo 0...)."""
+    if column in ("elo_white", "elo_black"):
+        return not value
+    return not value or set(str(value)) <= set("?.-")
+
+
+def merge_updates(existing, row: dict) -> dict:
+    """Capçaleres de 'row' que completen les d'una partida igual 'existing' (columna -> valor)."""
+    updates = {column: row[column] for column in MERGE_COLUMNS
+               if _unknown(column, existing[column]) and not _unknown(column, row[column])}
+    new_date, old_date = str(row["date"]), str(existing["date"] or "?")
+    if "date" not in updates and not _unknown("date", new_date) and new_date.count("?") < old_date.count("?"):
+        updates["date"] = row["date"] # Data més completa ("2024.05.12" en lloc de "2024.??.??")
+    return updates
+
+
+class GameDatabase:
+    """
+    Connexió a la BBDD de partides. Crea les taules que falten i afegeix
+    les columnes noves a una BBDD antiga (migració mínima, veure _ensure_column).
+    """
+    def __init__(self, path: str = DEFAULT_DB):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute("PRAGMA journal_mode = WAL") # Lectures mentre s'importa
+        self.has_fts = False
+        self._create_schema()
+        self.user_id = self.ensure_user(DEFAULT_USER)
+
+    def _create_schema(self):
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+            self._ensure_column("games", "source_id", "INTEGER REFERENCES pgn_sources(id)")
+            self._ensure_column("games", "source_offset", "INTEGER")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_games_source ON games(source_id, source_offset)")
+            if self._ensure_column("games", "game_hash", "INTEGER"):
+                self._fill_game_hashes()
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_games_hash ON games(game_hash)")
+            for column in SORTABLE_COLUMNS:
+                self.conn.execute(f"CREATE INDEX IF NOT EXISTS idx_games_{column} ON games({column}, id)")
+        self._create_fts()
+
+    def _create_fts(self):
+        exists = self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'games_fts'").fetchone()
+        if exists:
+            self.has_fts = True
+            return
+        try:
+            with self.conn:
+                self.conn.execute(FTS_SCHEMA)
+        except sqlite3.OperationalError as e: # SQLite compilat sense FTS5
+            log.warning("FTS5 no disponible (%s): la cerca de text serà lenta", e)
+            return
+        self.has_fts = True
+        if self.count_games():
+            self.rebuild_fts()
+
+    def rebuild_fts(self):
+        """Reomple l'índex de text a partir de les capçaleres (els comentaris no es guarden a 'games')."""
+        with self.conn:
+            self.conn.execute("DELETE FROM games_fts")
+            self.conn.execute("INSERT INTO games_fts (rowid, white, black, event, site, comments) "
+                              "SELECT id, white, black, tournament, location, '' FROM games")
+        log.info("Índex de text complet reconstruït")
+
+    def _ensure_column(self, table: str, column: str, declaration: str) -> bool:
+        """Afegeix la columna si no hi és; retorna cert si l'ha afegit."""
+        columns = {row["name"] for row in self.conn.execute(f'PRAGMA table_info("{table}")')}
+        if column in columns:
+            return False
+        log.info("BBDD: afegint la columna %s.%s", table, column)
+        self.conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {declaration}')
+        return True
+
+    def _fill_game_hashes(self):
+        """Calcula game_hash de les partides d'una BBDD anterior a la detecció de duplicats."""
+        last_id, total = 0, 0
+        while True: # Per trams d'id: no cal tenir tota la taula en memòria
+            rows = self.conn.execute("SELECT id, white, black, result, fen, moves, ply FROM games "
+                                     "WHERE id > ? ORDER BY id LIMIT 50000", (last_id,)).fetchall()
+            if not rows:
+                break
+            self.conn.executemany("UPDATE games SET game_hash = ? WHERE id = ?",
+                                  ((game_hash(r["white"], r["black"], r["result"], r["fen"], r["moves"], r["ply"]),
+                                    r["id"]) for r in rows))
+            last_id, total = rows[-1]["id"], total + len(rows)
+        if total:
+            log.info("BBDD: hash canònic calculat per %d partides", total)
+
+    def ensure_user(self, username: str) -> int:
+        row = self.conn.execute("SELECT id FROM users WHERE username = ?", (username,)).fetchone()
+        if row:
+            return row["id"]
+        with self.conn:
+            cursor = self.conn.execute("INSERT INTO users (username, password) VALUES (?, '')", (username,))
+        return cursor.lastrowid
+
+    # --- Fonts PGN (empremtes per la importació incremental) ---
+    def get_source(self, path: str) -> dict | None:
+        row = self.conn.execute("SELECT * FROM pgn_sources WHERE path = ?", (path,)).fetchone()
+        return dict(row) if row else None
+
+    def save_source(self, path: str, **fields) -> int:
+        """Crea o actualitza la font; no fa commit (va dins la transacció de la importació)."""
+        fields = {k: v for k, v in fields.items() if k in SOURCE_FIELDS}
+        source = self.get_source(path)
+        if source is None:
+            columns = ("path",) + tuple(fields)
+            cursor = self.conn.execute(
+                f"INSERT INTO pgn_sources ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                (path, *fields.values()))
+            return cursor.lastrowid
+        if fields:
+            assignments = ", ".join(f"{k} = ?" for k in fields)
+            self.conn.execute(f"UPDATE pgn_sources SET {assignments}, imported_at = CURRENT_TIMESTAMP WHERE id = ?",
+                              (*fields.values(), source["id"]))
+        return source["id"]
+
+    def delete_source_games(self, source_id: int, from_offset: int = 0) -> int:
+        if self.has_fts:
+            self.conn.execute("DELETE FROM games_fts WHERE rowid IN "
+                              "(SELECT id FROM games WHERE source_id = ? AND source_offset >= ?)",
+                              (source_id, from_offset))
+        cursor = self.conn.execute("DELETE FROM games WHERE source_id = ? AND source_offset >= ?",
+                                   (source_id, from_offset))
+        return cursor.rowcount
+
+    # --- Partides ---
+    def insert_games(self, rows) -> int:
+        """Insereix files (dicts de game_row) i les afegeix a l'índex de text; no fa commit."""
+        sql = f"INSERT INTO games ({', '.join(INSERT_COLUMNS)}) VALUES ({', '.join('?' * len(INSERT_COLUMNS))})"
+        if not self.has_fts:
+            cursor = self.conn.executemany(sql, ([row[c] for c in INSERT_COLUMNS] for row in rows))
+            return cursor.rowcount
+        fts_rows = []
+        for row in rows: # Un a un per saber l'id (rowid de l'índex de text)
+            game_id = self.conn.execute(sql, [row[c] for c in INSERT_COLUMNS]).lastrowid
+            fts_rows.append((game_id, row["white"], row["black"], row["tournament"],
+                             row["location"], row.get("comments", "")))
+        self.conn.executemany("INSERT INTO games_fts (rowid, white, black, event, site, comments) "
+                              "VALUES (?, ?, ?, ?, ?, ?)", fts_rows)
+        return len(fts_rows)
+
+    def find_game_by_hash(self, value: int) -> int | None:
+        row = self.conn.execute("SELECT id FROM games WHERE game_hash = ? LIMIT 1", (value,)).fetchone()
+        return row["id"] if row else None
+
+    def merge_game(self, game_id: int, row: dict) -> bool:
+        """
+        Completa la partida 'game_id' amb les capçaleres de 'row' (una fila de
+        game_row duplicada) que hi falten. No fa commit. Retorna cert si ha canviat res.
+        """
+        existing = self.conn.execute(f"SELECT {', '.join(MERGE_COLUMNS)} FROM games WHERE id = ?",
+                                     (game_id,)).fetchone()
+        if existing is None:
+            return False
+        updates = merge_updates(existing, row)
+        if not updates:
+            return False
+        assignments = ", ".join(f"{column} = ?" for column in updates)
+        self.conn.execute(f"UPDATE games SET {assignments} WHERE id = ?", (*updates.values(), game_id))
+        if self.has_fts and ("tournament" in updates or "location" in updates):
+            self.conn.execute("UPDATE games_fts SET event = (SELECT tournament FROM games WHERE id = ?), "
+                              "site = (SELECT location FROM games WHERE id = ?) WHERE rowid = ?",
+                              (game_id, game_id, game_id))
+        return True
+
+    def search_condition(self, text: str) -> tuple[str, tuple]:
+        """
+        Condició SQL (sobre 'games') i paràmetres per una cerca de text.
+        Amb FTS5 retorna una subconsulta MATCH; sense, LIKE sobre les capçaleres.
+        """
+        if self.has_fts:
+            query = fts_query(text)
+            if not query:
+                return "", ()
+            return "id IN (SELECT rowid FROM games_fts WHERE games_fts MATCH ?)", (query,)
+        conditions, params = [], []
+        for word in text.split():
+            conditions.append("(white LIKE ? OR black LIKE ? OR tournament LIKE ? OR location LIKE ?)")
+            params.extend([f"%{word}%"] * 4)
+        return " AND ".join(conditions), tuple(params)
+
+    def search(self, text: str, limit: int = 100) -> list[int]:
+        """Ids de les partides que coincideixen, les més rellevants primer (bm25)."""
+        if not self.has_fts:
+            where, params = self.search_condition(text)
+            sql = f"SELECT id FROM games WHERE {where} LIMIT ?" if where else "SELECT id FROM games LIMIT ?"
+            return [r[0] for r in self.conn.execute(sql, (*params, limit))]
+        query = fts_query(text)
+        if not query:
+            return []
+        return [r[0] for r in self.conn.execute(
+            "SELECT rowid FROM games_fts WHERE games_fts MATCH ? ORDER BY rank LIMIT ?", (query, limit))]
+
+    def set_result_ids(self, ids) -> str:
+        """
+        Desa una llista d'ids (resultat d'una cerca fora d'SQL) en una taula
+        temporal i retorna la condició per filtrar-hi 'games'.
+        """
+        with self.conn:
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS result_ids (id INTEGER PRIMARY KEY)")
+            self.conn.execute("DELETE FROM temp.result_ids")
+            self.conn.executemany("INSERT OR IGNORE INTO temp.result_ids (id) VALUES (?)", ((i,) for i in ids))
+        return "id IN (SELECT id FROM temp.result_ids)"
+
+    def count_games(self, source_id: int | None = None) -> int:
+        if source_id is None:
+            return self.conn.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+        return self.conn.execute("SELECT COUNT(*) FROM games WHERE source_id = ?", (source_id,)).fetchone()[0]
+
+    def get_game(self, game_id: int) -> chess.pgn.Game | None:
+        """Reconstrueix la partida (capçaleres i línia principal) a partir de la fila."""
+        row = self.conn.execute("SELECT * FROM games WHERE id = ?", (game_id,)).fetchone()
+        if row is None:
+            return None
+        game = chess.pgn.Game()
+        for tag, column in HEADER_COLUMNS.items():
+            if row[column]:
+                game.headers[tag] = row[column]
+        if row["elo_white"]:
+            game.headers["WhiteElo"] = str(row["elo_white"])
+        if row["elo_black"]:
+            game.headers["BlackElo"] = str(row["elo_black"])
+        for tag, value in json.loads(row["extra"] or "{}").items():
+            game.headers[tag] = value
+        if row["fen"] != chess.STARTING_FEN:
+            game.setup(row["fen"])
+        node = game
+        for move in decode_moves(row["moves"]):
+            node = node.add_variation(move)
+        return game
+
+    def final_fen(self, game_id: int) -> str | None:
+        """FEN de la posició final de la partida (per les miniatures), sense construir l'arbre PGN."""
+        row = self.conn.execute("SELECT fen, moves FROM games WHERE id = ?", (game_id,)).fetchone()
+        if row is None:
+            return None
+        board = chess.Board(row["fen"])
+        for move in decode_moves(row["moves"]):
+            board.push(move)
+        return board.fen()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,160 @@
+# src/dedup.py
+"""
+Detecció de partides duplicades en importar (una sola passada, O(n)).
+
+Cada partida té un hash canònic de 64 bits (game_hash) calculat a partir de:
+- la posició inicial i les jugades de la línia principal (el BLOB de 'moves'),
+- els cognoms dels jugadors normalitzats ("Carlsen, Magnus", "Magnus Carlsen"
+  i "Carlsen,M." donen "carlsen"),
+- el resultat.
+La resta de capçaleres (data, torneig, ronda, Elo...) no hi entren: són les
+que més varien entre fonts diferents de la mateixa partida. Les partides de
+menys de MIN_PLIES jugades no tenen hash (no es consideren mai duplicades:
+hi ha massa abandonaments i taules curtes legítimament iguals).
+
+DuplicateIndex respon "aquesta partida ja hi és?" amb un filtre de Bloom en
+memòria (BloomFilter) i, només si el filtre diu que potser, amb l'índex
+idx_games_hash de la BBDD. La gran majoria de partides noves no toquen l'índex.
+"""
+import hashlib
+import logging
+import math
+import re
+import unicodedata
+import chess
+
+try:
+    import numpy as np
+except ImportError: # Opcional: només accelera la càrrega del filtre
+    np = None
+
+log = logging.getLogger(__name__)
+
+MIN_PLIES = 10
+BLOOM_ERROR_RATE = 0.01
+MIN_BLOOM_CAPACITY = 1 << 20
+
+
+def normalize_player(name: str) -> str:
+    """Cognom en minúscules, sense accents ni signes de puntuació."""
+    name = unicodedata.normalize("NFKD", name or "")
+    name = "".join(c for c in name if not unicodedata.combining(c)).lower()
+    if "," in name:
+        surname = name.split(",", 1)[0]
+    else:
+        words = name.split()
+        surname = words[-1] if words else ""
+    return re.sub(r"[^0-9a-z]", "", surname)
+
+
+def game_hash(white: str, black: str, result: str, fen: str, moves: bytes, ply: int) -> int | None:
+    """Hash canònic (enter de 64 bits amb signe, com els INTEGER de SQLite) o None si és massa curta."""
+    if ply < MIN_PLIES:
+        return None
+    digest = hashlib.blake2b(digest_size=8)
+    key = "\x1f".join((normalize_player(white), normalize_player(black), (result or "*").strip(),
+                       "" if fen == chess.STARTING_FEN else fen))
+    digest.update(key.encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(moves)
+    return int.from_bytes(digest.digest(), "little", signed=True)
+
+
+class BloomFilter:
+    """
+    Filtre de Bloom sobre hashes de 64 bits ja uniformes (no es tornen a
+    hashejar): les k posicions surten del doble hashing h1 + i*h2. La mida
+    és una potència de 2 (una màscara en lloc del mòdul, molt més ràpid en NumPy).
+    """
+    def __init__(self, capacity: int, error_rate: float = BLOOM_ERROR_RATE):
+        self.capacity = capacity = max(1, capacity)
+        bits = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.size = 1 << (bits - 1).bit_length()
+        self.hashes = max(1, round(-math.log2(error_rate))) # k òptim per l'error demanat
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value: int):
+        value &= 0xFFFFFFFFFFFFFFFF
+        h1, h2 = value & 0xFFFFFFFF, (value >> 32) | 1
+        mask = self.size - 1
+        return ((h1 + i * h2) & mask for i in range(self.hashes))
+
+    def add(self, value: int):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def add_many(self, values):
+        """Afegeix molts hashes de cop (vectoritzat si hi ha NumPy)."""
+        if np is None:
+            for value in values:
+                self.add(value)
+            return
+        values = np.asarray(values, dtype=np.int64).view(np.uint64)
+        h1 = values & np.uint64(0xFFFFFFFF)
+        h2 = (values >> np.uint64(32)) | np.uint64(1)
+        bits = np.frombuffer(self.bits, dtype=np.uint8)
+        for i in range(self.hashes):
+            positions = (h1 + np.uint64(i) * h2) & np.uint64(self.size - 1)
+            np.bitwise_or.at(bits, (positions >> np.uint64(3)).astype(np.intp),
+                             np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8))
+        self.count += len(values)
+
+    def __contains__(self, value: int) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class DuplicateIndex:
+    """
+    Partides que ja hi ha a la BBDD (i les del batch pendent d'inserir),
+    per hash canònic. S'ha de crear dins la transacció de la importació,
+    després d'esborrar les partides que es tornaran a importar.
+    """
+    LOAD_BATCH = 1 << 16
+
+    def __init__(self, db):
+        self.db = db
+        self.pending = {} # hash -> fila del batch encara no inserit
+        self.index_lookups = 0
+        self._load()
+
+    def _load(self):
+        """(Re)construeix el filtre amb el doble de capacitat de les partides que hi ha."""
+        existing = self.db.conn.execute("SELECT COUNT(*) FROM games WHERE game_hash IS NOT NULL").fetchone()[0]
+        self.bloom = BloomFilter(max(MIN_BLOOM_CAPACITY, 2 * (existing + len(self.pending))))
+        cursor = self.db.conn.execute("SELECT game_hash FROM games WHERE game_hash IS NOT NULL")
+        while True:
+            rows = cursor.fetchmany(self.LOAD_BATCH)
+            if not rows:
+                break
+            self.bloom.add_many([row[0] for row in rows])
+        self.bloom.add_many(list(self.pending))
+        log.debug("Filtre de duplicats: %d partides, %d bits, %d hashes",
+                  self.bloom.count, self.bloom.size, self.bloom.hashes)
+
+    def find(self, row: dict):
+        """
+        La partida que 'row' duplica: una fila pendent (dict), l'id d'una
+        partida de la BBDD (int) o None si és nova.
+        """
+        value = row["game_hash"]
+        if value is None or value not in self.bloom:
+            return None
+        if value in self.pending:
+            return self.pending[value]
+        self.index_lookups += 1
+        return self.db.find_game_by_hash(value)
+
+    def add(self, row: dict):
+        if row["game_hash"] is None:
+            return
+        self.pending[row["game_hash"]] = row
+        if self.bloom.count >= self.bloom.capacity: # Ple: els falsos positius es dispararien
+            self._load()
+        else:
+            self.bloom.add(row["game_hash"])
+
+    def flushed(self):
+        """El batch pendent ja és a la BBDD (ara el troba l'índex)."""
+        self.pending.clear()
@@ -0,0 +1,175 @@
+# src/eco.py
+"""
+Classificació ECO per posició (hash Zobrist), no per seqüència de jugades.
+
+La taula (assets/eco/*.tsv, format "eco<TAB>name<TAB>pgn" com el del
+repositori chess-openings de lichess) es carrega en un dict
+hash Zobrist -> Opening amb la posició final de cada línia. Com que la clau
+és la posició, les transposicions (1.Nf3 d5 2.d4 = 1.d4 d5 2.Nf3) troben
+la mateixa obertura. Es pot ampliar la taula afegint-hi més fitxers .tsv:
+els posteriors (en ordre alfabètic) substitueixen les posicions repetides.
+
+classify() recorre les primeres jugades d'una partida calculant el hash de
+forma incremental (només es fa XOR de les caselles que han canviat, no es
+recalcula tot el tauler) i es queda amb la coincidència més profunda
+(matches() les retorna totes). Para quan la partida surt de les línies
+conegudes durant més de MAX_OFF_BOOK jugades o passa de la profunditat
+màxima de la taula.
+"""
+import functools
+import glob
+import logging
+import os
+import chess
+import chess.polyglot
+from typing import NamedTuple
+
+log = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ECO_DIR = os.path.join(BASE_DIR, "..", "assets", "eco")
+MAX_OFF_BOOK = 4 # Jugades fora de la taula abans de parar (per transposicions tardanes)
+
+_HASHER = chess.polyglot.ZobristHasher(chess.polyglot.POLYGLOT_RANDOM_ARRAY)
+_RANDOM = chess.polyglot.POLYGLOT_RANDOM_ARRAY
+_TURN_KEY = _RANDOM[780]
+
+
+class Opening(NamedTuple):
+    eco: str
+    name: str
+    ply: int # Mitges jugades de la línia de la taula
+
+
+def _piece_bitboards(board: chess.Board) -> tuple:
+    """Bitboards en l'ordre dels índexs de peça de Polyglot ((tipus - 1) * 2 + color)."""
+    black, white = board.occupied_co[chess.BLACK], board.occupied_co[chess.WHITE]
+    return (board.pawns & black, board.pawns & white, board.knights & black, board.knights & white,
+            board.bishops & black, board.bishops & white, board.rooks & black, board.rooks & white,
+            board.queens & black, board.queens & white, board.kings & black, board.kings & white)
+
+
+def iter_hashes(board: chess.Board, moves):
+    """
+    Hash Zobrist (Polyglot) de la posició després de cada jugada. Modifica
+    'board' (li fa push de les jugades). Mateix resultat que
+    chess.polyglot.zobrist_hash, però actualitzant només el que canvia.
+    """
+    value = _HASHER(board)
+    pieces = _piece_bitboards(board)
+    state = _HASHER.hash_castling(board) ^ _HASHER.hash_ep_square(board)
+    for move in moves:
+        board.push(move)
+        new_pieces = _piece_bitboards(board)
+        for index, (old, new) in enumerate(zip(pieces, new_pieces)):
+            changed = old ^ new
+            while changed:
+                square = (changed & -changed).bit_length() - 1
+                value ^= _RANDOM[64 * index + square]
+                changed &= changed - 1
+        new_state = _HASHER.hash_castling(board) ^ _HASHER.hash_ep_square(board)
+        value ^= state ^ new_state ^ _TURN_KEY
+        pieces, state = new_pieces, new_state
+        yield value
+
+
+class EcoTable:
+    """Taula d'obertures indexada pel hash Zobrist de la posició."""
+    def __init__(self):
+        self.positions: dict[int, Opening] = {}
+        self.known: set[int] = set() # Posicions de totes les línies (també les intermèdies)
+        self.max_ply = 0
+
+    @classmethod
+    def load(cls, directory: str = ECO_DIR) -> "EcoTable":
+        table = cls()
+        for path in sorted(glob.glob(os.path.join(directory, "*.tsv"))):
+            table.load_tsv(path)
+        log.debug("Taula ECO: %d posicions (fins a %d mitges jugades)", len(table.positions), table.max_ply)
+        return table
+
+    def load_tsv(self, path: str):
+        with open(path, encoding="utf-8") as f:
+            for number, line in enumerate(f, 1):
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) < 3 or fields[0] == "eco":
+                    continue
+                eco, name, pgn = fields[:3]
+                board = chess.Board()
+                try:
+                    for token in self._tokens(pgn):
+                        board.push_san(token)
+                except ValueError as e:
+                    log.warning("%s:%d: línia ECO invàlida (%s)", path, number, e)
+                    continue
+                self.add(eco, name, board.move_stack)
+
+    @staticmethod
+    def _tokens(pgn: str):
+        return [token for token in pgn.split() if not token[0].isdigit() or not token.endswith(".")]
+
+    def add(self, eco: str, name: str, moves: list[chess.Move]):
+        board = chess.Board()
+        self.known.add(_HASHER(board))
+        value = None
+        for value in iter_hashes(board, moves):
+            self.known.add(value)
+        if value is not None:
+            self.positions[value] = Opening(eco, name, len(moves))
+            self.max_ply = max(self.max_ply, len(moves))
+
+    def lookup(self, board: chess.Board) -> Opening | None:
+        """Obertura d'aquesta posició exacta (O(1)); None si no és a la taula."""
+        return self.positions.get(_HASHER(board))
+
+    def matches(self, moves, board: chess.Board | None = None) -> list[Opening]:
+        """Obertures de la taula per on passa la partida, en ordre (l'última és la més profunda)."""
+        board = board.copy(stack=False) if board is not None else chess.Board()
+        found = []
+        off_book = 0
+        for ply, value in enumerate(iter_hashes(board, moves), 1):
+            opening = self.positions.get(value)
+            if opening is not None:
+                found.append(opening)
+            if value in self.known:
+                off_book = 0
+            else:
+                off_book += 1
+                if off_book > MAX_OFF_BOOK:
+                    break
+            if ply >= self.max_ply + MAX_OFF_BOOK:
+                break
+        return found
+
+    def classify(self, moves, board: chess.Board | None = None) -> Opening | None:
+        """Coincidència més profunda al llarg de les jugades (partides des de la posició inicial)."""
+        found = self.matches(moves, board)
+        return found[-1] if found else None
+
+
+@functools.lru_cache(maxsize=1)
+def default_table() -> EcoTable:
+    """Taula d'assets/eco (es carrega un sol cop)."""
+    return EcoTable.load()
+
+
+def classify_headers(headers, moves: list[chess.Move], table: EcoTable | None = None) -> Opening | None:
+    """
+    Omple les capçaleres ECO i Opening a partir de les jugades. L'ECO de la
+    capçalera es manté si és un dels codis per on passa la partida segons la
+    taula (p. ex. una transposició que la capçalera classifica diferent); si
+    no hi és o contradiu les jugades, se substitueix.
+    """
+    if headers.get("FEN") or headers.get("SetUp") == "1": # Només partides des de la posició inicial
+        return None
+    found = (table or default_table()).matches(moves)
+    if not found:
+        return None
+    opening = found[-1]
+    current = (headers.get("ECO") or "").strip().upper()
+    if current not in {match.eco for match in found}:
+        headers["ECO"] = opening.eco
+        headers["Opening"] = opening.name
+    elif not headers.get("Opening"):
+        headers["Opening"] = opening.name
+    return opening
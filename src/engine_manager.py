@@ -1,33 +1,283 @@
 from stockfish import Stockfish
+import chess
+import chess.engine
+import json
 import os
+import logging
+import socket
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from instrumentation import metrics
+
+log = logging.getLogger(__name__)
+
+# Membres interns de la llibreria stockfish que fa servir ChessEngine (versió fixada a requirements.txt)
+STOCKFISH_INTERNALS = ("_put", "_read_line", "_stockfish")
+
+# Servidor d'anàlisi compartit (analysis_server.py): "host:port" o "unix:/camí/socket"
+DEFAULT_ANALYSIS_SERVER = os.environ.get("GEMINI_CHESS_ANALYSIS_SERVER") or None
 
-# (La classe UCIMotor pot quedar aquí, però no l'usarem inicialment)
 class UCIMotor:
-    # ... (el teu codi existent) ...
-    pass
+    """
+    Motor UCI qualsevol (Leela, Komodo, Berserk...) a través de chess.engine
+    de python-chess. La llibreria stockfish només entén Stockfish (llegeix la
+    versió de la primera línia); aquesta classe ofereix la mateixa interfície
+    que ChessEngine per l'anàlisi: get_analysis, set_parameters i close.
+    """
+    def __init__(self, path: str, parameters: dict | None = None):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"El fitxer del motor no s'ha trobat a: {path}")
+        self.engine = chess.engine.SimpleEngine.popen_uci(path)
+        log.info("Motor UCI inicialitzat: %s (%s)", self.engine.id.get("name", "?"), path)
+        if parameters:
+            self.set_parameters(parameters)
+
+    def get_analysis(self, fen: str, depth: int = 15, num_lines: int = 1,
+                     nodes: int | None = None) -> list | None:
+        """Mateix format que ChessEngine.get_analysis (puntuació des del punt de vista de les blanques)."""
+        try:
+            limit = chess.engine.Limit(nodes=nodes) if nodes else chess.engine.Limit(depth=depth)
+            started = time.perf_counter()
+            infos = self.engine.analyse(chess.Board(fen), limit, multipv=num_lines)
+            if metrics.enabled:
+                metrics.observe("engine.search", (time.perf_counter() - started) * 1000.0)
+                metrics.inc("engine.searches")
+        except (chess.engine.EngineError, chess.engine.EngineTerminatedError, ValueError) as e:
+            log.error("Error durant l'anàlisi del motor UCI: %s", e)
+            return None
+        top_moves = []
+        for info in infos:
+            if not info.get("pv"):
+                continue
+            score = info["score"].white()
+            top_moves.append({
+                "Move": info["pv"][0].uci(),
+                "Centipawn": score.score(),
+                "Mate": score.mate(),
+                "PV": [move.uci() for move in info["pv"]],
+            })
+        return top_moves
+
+    def set_parameters(self, params: dict):
+        """Només les opcions que el motor declara (MultiPV el gestiona analyse)."""
+        supported = {name: value for name, value in params.items()
+                     if name in self.engine.options and name != "MultiPV"}
+        self.engine.configure(supported)
+        log.info("Paràmetres del motor UCI actualitzats: %s", supported)
+
+    def close(self):
+        try:
+            self.engine.quit()
+        except (chess.engine.EngineTerminatedError, TimeoutError):
+            pass
+
+
+def parse_address(address: str) -> tuple:
+    """(família del socket, adreça) d'un "host:port" o "unix:/camí"."""
+    if address.startswith("unix:"):
+        if not hasattr(socket, "AF_UNIX"):
+            raise ValueError("Aquest sistema no té sockets Unix: fes servir host:port")
+        return socket.AF_UNIX, address[5:]
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+class RemoteEngine:
+    """
+    Client del servidor d'anàlisi: mateixa interfície que ChessEngine per
+    l'anàlisi, però les cerques les fa (o les treu de la memòria cau
+    compartida) el servidor. Protocol: una línia JSON per petició i resposta.
+    """
+    TIMEOUT = 600 # s: una anàlisi profunda pot trigar, però no ha de penjar el worker per sempre
+
+    def __init__(self, address: str):
+        self.address = address
+        self._file = None
+        self._lock = threading.Lock()
+        self._connect()
+        log.info("Connectat al servidor d'anàlisi %s", address)
+
+    def _connect(self):
+        family, target = parse_address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(self.TIMEOUT)
+        try:
+            sock.connect(target)
+        except OSError:
+            sock.close()
+            raise
+        self._file = sock.makefile("rwb")
+        sock.close() # El fitxer en manté una referència
+
+    def _request(self, message: dict) -> dict:
+        data = (json.dumps(message) + "\n").encode("utf-8")
+        with self._lock:
+            for attempt in range(2): # Si el servidor s'ha reiniciat, es reconnecta un cop
+                try:
+                    if self._file is None:
+                        self._connect()
+                    self._file.write(data)
+                    self._file.flush()
+                    line = self._file.readline()
+                    if not line:
+                        raise ConnectionError("El servidor ha tancat la connexió")
+                    return json.loads(line)
+                except OSError:
+                    self.close()
+                    if attempt:
+                        raise
+
+    def get_analysis(self, fen: str, depth: int = 15, num_lines: int = 1,
+                     nodes: int | None = None) -> list | None:
+        try:
+            reply = self._request({"op": "analyse", "fen": fen, "depth": depth, "lines": num_lines, "nodes": nodes})
+        except (OSError, ValueError) as e:
+            log.error("Error de comunicació amb el servidor d'anàlisi %s: %s", self.address, e)
+            return None
+        if not reply.get("ok"):
+            log.error("El servidor d'anàlisi ha retornat un error: %s", reply.get("error"))
+            return None
+        if metrics.enabled:
+            metrics.inc("engine.remote_cached" if reply.get("cached") else "engine.remote_searches")
+        return reply["result"]
+
+    def set_parameters(self, params: dict):
+        """Els recursos dels motors els decideix el servidor: només es registra."""
+        log.debug("Motor remot: s'ignoren els paràmetres %s", params)
+
+    def close(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+
+def create_engine(path: str, parameters: dict | None = None, server: str | None = None):
+    """
+    RemoteEngine si es dona l'adreça d'un servidor d'anàlisi i respon;
+    si no, ChessEngine per Stockfish (i derivats amb el mateix nom) i UCIMotor per la resta.
+    """
+    if server:
+        try:
+            return RemoteEngine(server)
+        except (OSError, ValueError) as e:
+            log.warning("Servidor d'anàlisi %s no disponible (%s): s'usa un motor local", server, e)
+    if "stockfish" in os.path.basename(path).lower():
+        return ChessEngine(path, parameters)
+    return UCIMotor(path, parameters)
+
+
+class AnalysisCache:
+    """
+    Memòria cau (LRU) de resultats de get_analysis, indexada per posició.
+    La clau ignora els comptadors de jugades del FEN, així una mateixa posició
+    arribada per un altre ordre de jugades també encerta.
+    Un resultat serveix si s'ha calculat amb igual o més profunditat i línies.
+    """
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # clau -> (depth, num_lines, resultat)
+        self._lock = threading.Lock() # Es pot compartir entre fils (workers)
+
+    @staticmethod
+    def position_key(fen: str) -> str:
+        """Posició + torn + enroc + al pas, sense els comptadors de jugades."""
+        return " ".join(fen.split()[:4])
+
+    def get(self, fen: str, depth: int, num_lines: int) -> list | None:
+        """Retorna les línies guardades per la posició o None si no n'hi ha prou."""
+        key = self.position_key(fen)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            cached_depth, cached_lines, result = entry
+            # Si hi ha menys línies que les demanades només serveix si la posició
+            # no té més jugades legals (el motor ja les va tornar totes)
+            if cached_depth < depth or (cached_lines < num_lines and len(result) >= cached_lines):
+                return None
+            self._entries.move_to_end(key)
+            return result[:num_lines]
+
+    def put(self, fen: str, depth: int, num_lines: int, result: list):
+        """Guarda un resultat (no substitueix un de més profund)."""
+        key = self.position_key(fen)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > depth:
+                return
+            self._entries[key] = (depth, num_lines, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __contains__(self, fen: str) -> bool:
+        with self._lock:
+            return self.position_key(fen) in self._entries
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
 
 
 class ChessEngine:
-    def __init__(self, path_to_stockfish: str):
+    def __init__(self, path_to_stockfish: str, parameters: dict | None = None):
         if not os.path.exists(path_to_stockfish):
              raise FileNotFoundError(f"El fitxer del motor Stockfish no s'ha trobat a: {path_to_stockfish}")
         try:
-            # Pots passar paràmetres inicials aquí si vols
-            # self.stockfish = Stockfish(path=path_to_stockfish, depth=10, parameters={"Threads": 2, "Hash": 128})
-            self.stockfish = Stockfish(path=path_to_stockfish)
-            print(f"Stockfish inicialitzat correctament des de: {path_to_stockfish}")
-            print(f"Paràmetres actuals: {self.stockfish.get_parameters()}")
+            # Paràmetres inicials (Threads, Hash...): vegeu engine_profiles
+            self.stockfish = Stockfish(path=path_to_stockfish, parameters=parameters)
+            log.info("Stockfish inicialitzat correctament des de: %s", path_to_stockfish)
+            log.debug("Paràmetres actuals: %s", self.stockfish.get_parameters())
         except Exception as e:
-            print(f"Error inicialitzant Stockfish: {e}")
+            log.error("Error inicialitzant Stockfish: %s", e)
             # Pots llançar l'excepció o manejar-la d'una altra manera
             raise
+        missing = [name for name in STOCKFISH_INTERNALS if not hasattr(self.stockfish, name)]
+        if missing: # Una altra versió de la llibreria: millor un error clar que cerques penjades
+            raise RuntimeError(f"Aquesta versió de la llibreria stockfish no té {', '.join(missing)}: "
+                               "instal·la la de requirements.txt")
+        self._search_start = None # Moment d'inici de la cerca en curs (instrumentació)
+        self._install_info_probe()
+
+    def _install_info_probe(self):
+        """
+        Intercepta les línies que llegeix la llibreria stockfish per extreure'n
+        nps, profunditat i el temps fins a la primera línia 'info'.
+        Si la instrumentació està desactivada només costa una comprovació per línia.
+        """
+        read_line = self.stockfish._read_line
+
+        def probed_read_line():
+            line = read_line()
+            if metrics.enabled and self._search_start is not None and line.startswith("info") and " score " in line:
+                if self._first_info_pending:
+                    self._first_info_pending = False
+                    metrics.observe("engine.time_to_first_info", (time.perf_counter() - self._search_start) * 1000.0)
+                tokens = line.split()
+                for key in ("depth", "nps", "nodes"):
+                    if key in tokens:
+                        try:
+                            metrics.set_gauge(f"engine.{key}", int(tokens[tokens.index(key) + 1]))
+                        except (ValueError, IndexError):
+                            pass
+            return line
+
+        self.stockfish._read_line = probed_read_line
 
 
     # NOU Mètode (o reemplaça get_best_move_and_eval)
-    def get_analysis(self, fen: str, depth: int = 15, num_lines: int = 1) -> list | None:
+    def get_analysis(self, fen: str, depth: int = 15, num_lines: int = 1,
+                     nodes: int | None = None) -> list | None:
         """
         Obté les 'num_lines' millors línies d'anàlisi per a una posició FEN.
         Cada línia inclou el moviment, l'avaluació i la Variant Principal (PV).
+        Si es dona 'nodes', la cerca es limita a aquest nombre de nodes en
+        lloc de la profunditat (resultats reproduïbles, útil per a benchmarks).
         Retorna una llista de diccionaris o None si hi ha error.
         """
         try:
@@ -39,18 +289,21 @@ class ChessEngine:
             self.stockfish.set_depth(depth) # Estableix la profunditat
 
             # Obté les millors línies
-            top_moves = self.stockfish.get_top_moves(num_lines)
+            self._search_start = time.perf_counter()
+            self._first_info_pending = True
+            # get_top_moves de la llibreria no torna la PV: es llegeix de les línies 'info'
+            go_command = f"go nodes {nodes}" if nodes else f"go depth {depth}"
+            top_moves = self._top_moves_limited(go_command, fen)
+            if metrics.enabled:
+                metrics.observe("engine.search", (time.perf_counter() - self._search_start) * 1000.0)
+                metrics.inc("engine.searches")
+            self._search_start = None
 
-            # --- LÍNIA DE DEPURACIÓ ---
-            print("-" * 20)
-            print(f"[DEBUG engine_manager] FEN analitzat: {fen}")
-            print(f"[DEBUG engine_manager] Resultat de get_top_moves({num_lines}): {top_moves}")
-            print("-" * 20)
-            # --- FI DEPURACIÓ ---
+            log.debug("FEN analitzat: %s -> get_top_moves(%d): %s", fen, num_lines, top_moves)
 
 
             if not top_moves:
-                print("[engine manager] Stockfish no ha retornat cap línia.")
+                log.info("Stockfish no ha retornat cap línia.")
                 return [] # Retorna llista buida en lloc de None per simplificar el maneig
 
             # El resultat de get_top_moves ja és una llista de diccionaris com:
@@ -58,14 +311,102 @@ class ChessEngine:
             return top_moves
 
         except Exception as e:
-            print(f"Error durant l'anàlisi de Stockfish (get_analysis): {e}")
+            log.error("Error durant l'anàlisi de Stockfish (get_analysis): %s", e)
             return None # Indica un error més seriós
 
 
+    def _top_moves_limited(self, go_command: str, fen: str) -> list:
+        """
+        Llança una cerca amb un límit qualsevol (nodes, temps...) i en llegeix
+        l'última línia 'info' de cada MultiPV. get_top_moves de la llibreria
+        només accepta línies de la profunditat configurada, i amb aquests límits
+        no sabem a quina profunditat acabarà la cerca.
+        """
+        self.stockfish._put(go_command)
+        last_info = {} # multipv -> tokens de l'última línia amb puntuació
+        while True:
+            tokens = self.stockfish._read_line().split()
+            if not tokens:
+                continue
+            if tokens[0] == "bestmove":
+                if len(tokens) > 1 and tokens[1] == "(none)":
+                    return []
+                break
+            if tokens[0] == "info" and "score" in tokens and "pv" in tokens \
+                    and "lowerbound" not in tokens and "upperbound" not in tokens:
+                multipv = int(tokens[tokens.index("multipv") + 1]) if "multipv" in tokens else 1
+                last_info[multipv] = tokens
+
+        # Mateixa convenció que la llibreria: puntuació des del punt de vista de les blanques
+        multiplier = 1 if fen.split()[1] == "w" else -1
+        top_moves = []
+        for multipv in sorted(last_info):
+            tokens = last_info[multipv]
+            score_type = tokens[tokens.index("score") + 1]
+            score_value = int(tokens[tokens.index("score") + 2]) * multiplier
+            pv = tokens[tokens.index("pv") + 1:]
+            top_moves.append({
+                "Move": pv[0],
+                "Centipawn": score_value if score_type == "cp" else None,
+                "Mate": score_value if score_type == "mate" else None,
+                "PV": pv,
+            })
+        return top_moves
+
+    def search_trace(self, fen: str, movetime: int | None = None, nodes: int | None = None,
+                     depth: int | None = None) -> dict | None:
+        """
+        Cerca d'una sola línia amb un límit de temps (ms), nodes o profunditat,
+        guardant l'evolució de la millor jugada: cada línia 'info' amb PV dona
+        (temps ms, profunditat, nodes, nps, jugada). Per mesurar el temps fins
+        a la solució en un test EPD. Retorna {"best_move", "infos"} o None si hi ha error.
+        """
+        if movetime:
+            go_command = f"go movetime {movetime}"
+        elif nodes:
+            go_command = f"go nodes {nodes}"
+        else:
+            go_command = f"go depth {depth or 15}"
+        try:
+            self.stockfish.set_fen_position(fen) # Inclou ucinewgame: cada posició comença amb la taula buida
+            self.stockfish.update_engine_parameters({"MultiPV": 1})
+            self.stockfish._put(go_command)
+            infos = []
+            while True:
+                tokens = self.stockfish._read_line().split()
+                if not tokens:
+                    continue
+                if tokens[0] == "bestmove":
+                    best_move = tokens[1] if len(tokens) > 1 and tokens[1] != "(none)" else None
+                    break
+                if tokens[0] == "info" and "pv" in tokens and tokens.index("pv") + 1 < len(tokens):
+                    values = {}
+                    for key in ("time", "depth", "nodes", "nps"):
+                        if key in tokens:
+                            values[key] = int(tokens[tokens.index(key) + 1])
+                    infos.append((values.get("time", 0), values.get("depth", 0), values.get("nodes", 0),
+                                  values.get("nps", 0), tokens[tokens.index("pv") + 1]))
+            if metrics.enabled:
+                metrics.inc("engine.searches")
+            return {"best_move": best_move, "infos": infos}
+        except Exception as e:
+            log.error("Error durant la cerca de Stockfish (search_trace): %s", e)
+            return None
+
+    def close(self):
+        """Envia 'quit' al motor i espera que el procés acabi."""
+        process = self.stockfish._stockfish
+        if process.poll() is None:
+            try:
+                self.stockfish._put("quit")
+                process.wait(timeout=2)
+            except (BrokenPipeError, subprocess.TimeoutExpired):
+                process.kill()
+
     def set_parameters(self, params: dict):
          """Estableix paràmetres al motor Stockfish."""
          self.stockfish.update_engine_parameters(params)
-         print(f"Paràmetres de Stockfish actualitzats: {self.stockfish.get_parameters()}")
+         log.info("Paràmetres de Stockfish actualitzats: %s", self.stockfish.get_parameters())
         
 
     def get_best_move_and_eval(self, fen: str, depth: int = 10, movetime: int | None = None):
@@ -90,7 +431,7 @@ class ChessEngine:
                  best_move = self.stockfish.get_best_move() # Aquesta trucada usarà el depth configurat
 
             if best_move is None:
-                print("Stockfish no ha retornat cap moviment.")
+                log.info("Stockfish no ha retornat cap moviment.")
                 return None # O una altra indicació d'error
 
             evaluation = self.stockfish.get_evaluation()
@@ -100,7 +441,7 @@ class ChessEngine:
                 "evaluation": evaluation # Aquest ja és un diccionari {'type': 'cp'/'mate', 'value': ...}
             }
         except Exception as e:
-            print(f"Error durant l'anàlisi de Stockfish: {e}")
+            log.error("Error durant l'anàlisi de Stockfish: %s", e)
             return None
 
         
@@ -0,0 +1,250 @@
+# src/engine_profiles.py
+"""
+Perfils de recursos del motor (Threads, Hash) segons els nuclis i la memòria de la màquina.
+
+Dos perfils:
+- "interactive": un sol motor per l'anàlisi de la interfície. Tots els
+  nuclis menys UI_RESERVED_CORES (la interfície i el worker han d'anar
+  fluids) i 1/8 de la memòria, fins a MAX_INTERACTIVE_HASH MB.
+- "batch": molts motors d'un fil en paral·lel (tests EPD, anàlisi de
+  BBDD...). 'workers' motors, un per nucli, que es reparteixen 1/4 de la
+  memòria (fins a MAX_BATCH_HASH MB cadascun).
+El Hash és sempre una potència de 2 (la taula de Stockfish en fa servir
+tota la mida i així les mides no varien per pocs MB de diferència).
+
+Els perfils es desen a un fitxer JSON (GEMINI_CHESS_ENGINE_CONFIG, per
+defecte profiles.json al directori de configuració de l'usuari, vegeu
+app_paths) que es pot editar a mà: només es recalculen si canvia la màquina
+(nuclis o memòria).
+
+Amb diversos motors d'anàlisi alhora (la llista "engines" del mateix
+fitxer), budgets() reparteix els fils i el Hash del perfil interactiu entre
+tots, descomptant-ne els d'altres motors que treballen alhora (el del gràfic
+d'avaluació): la suma no passa dels nuclis reservats per l'anàlisi.
+
+calibrate() fa una cerca curta amb 1, 2, 4... fils i mesura els nps: el
+perfil interactiu es queda amb el nombre de fils a partir del qual afegir-ne
+més no guanya com a mínim MIN_THREAD_GAIN (els nuclis lògics de
+l'hyperthreading o una màquina virtual amb menys CPU de les que anuncia).
+
+Ús (des de src):
+    python engine_profiles.py                 # mostra els perfils
+    python engine_profiles.py --calibrate     # mesura els nps i ajusta els fils
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import app_paths
+from engine_manager import ChessEngine
+
+log = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_NAME = "profiles.json"
+PROFILES = ("interactive", "batch")
+UI_RESERVED_CORES = 1
+MIN_HASH = 16 # MB (el valor per defecte de Stockfish)
+MAX_INTERACTIVE_HASH = 2048
+MAX_BATCH_HASH = 256
+FALLBACK_MEMORY_MB = 4096 # Si no es pot saber la memòria de la màquina
+CALIBRATION_MOVETIME = 500 # ms per posició i nombre de fils
+MIN_THREAD_GAIN = 0.10
+CALIBRATION_FENS = (
+    "r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N1PN2/PP2BPPP/R2QKB1R w KQ - 0 8", # Gambit de dama
+    "r2q1rk1/1b1nbppp/p2ppn2/1p6/3NP3/1BN1BP2/PPPQ2PP/2KR3R w - - 0 12", # Siciliana
+    "8/5pk1/6p1/3R4/5P2/r5P1/6K1/8 w - - 0 50", # Final de torres
+)
+
+
+def default_config_path() -> str:
+    """GEMINI_CHESS_ENGINE_CONFIG o profiles.json al directori de configuració de l'usuari."""
+    return os.environ.get("GEMINI_CHESS_ENGINE_CONFIG") or os.path.join(app_paths.config_dir(), CONFIG_NAME)
+
+
+def usable_cores() -> int:
+    """Nuclis que pot fer servir aquest procés (respecta l'afinitat, p. ex. en contenidors)."""
+    if hasattr(os, "sched_getaffinity"):
+        return max(1, len(os.sched_getaffinity(0)))
+    return os.cpu_count() or 1
+
+
+def total_memory_mb() -> int:
+    """Memòria física total en MB (FALLBACK_MEMORY_MB si no es pot saber)."""
+    try:
+        if sys.platform == "win32":
+            import ctypes
+
+            class MemoryStatus(ctypes.Structure):
+                _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong),
+                            ("ullTotalPhys", ctypes.c_ulonglong), ("ullAvailPhys", ctypes.c_ulonglong),
+                            ("ullTotalPageFile", ctypes.c_ulonglong), ("ullAvailPageFile", ctypes.c_ulonglong),
+                            ("ullTotalVirtual", ctypes.c_ulonglong), ("ullAvailVirtual", ctypes.c_ulonglong),
+                            ("ullAvailExtendedVirtual", ctypes.c_ulonglong)]
+
+            status = MemoryStatus()
+            status.dwLength = ctypes.sizeof(status)
+            ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status))
+            return int(status.ullTotalPhys // (1 << 20))
+        return int(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1 << 20))
+    except (AttributeError, OSError, ValueError):
+        return FALLBACK_MEMORY_MB
+
+
+def host_resources() -> dict:
+    return {"cores": usable_cores(), "memory_mb": total_memory_mb()}
+
+
+def _hash_mb(megabytes: float, maximum: int) -> int:
+    """Potència de 2 més gran que no passa de 'megabytes' (entre MIN_HASH i 'maximum')."""
+    value = MIN_HASH
+    while value * 2 <= min(megabytes, maximum):
+        value *= 2
+    return value
+
+
+def size_profiles(host: dict, interactive_threads: int | None = None) -> dict:
+    """Perfils per a una màquina {"cores", "memory_mb"}."""
+    cores, memory = host["cores"], host["memory_mb"]
+    threads = interactive_threads or max(1, cores - UI_RESERVED_CORES)
+    workers = cores
+    return {
+        "interactive": {"Threads": threads, "Hash": _hash_mb(memory / 8, MAX_INTERACTIVE_HASH)},
+        "batch": {"Threads": 1, "Hash": _hash_mb(memory / 4 / workers, MAX_BATCH_HASH), "workers": workers},
+    }
+
+
+def measure_nps(engine_path: str, threads: int, hash_mb: int = MIN_HASH,
+                movetime: int = CALIBRATION_MOVETIME) -> int:
+    """nps mitjans d'un motor amb 'threads' fils sobre CALIBRATION_FENS."""
+    engine = ChessEngine(engine_path, {"Threads": threads, "Hash": hash_mb})
+    try:
+        engine.search_trace(CALIBRATION_FENS[0], movetime=50) # Escalfa (fils i taula creats)
+        samples = []
+        for fen in CALIBRATION_FENS:
+            trace = engine.search_trace(fen, movetime=movetime)
+            if trace and trace["infos"]:
+                samples.append(trace["infos"][-1][3])
+        return int(sum(samples) / len(samples)) if samples else 0
+    finally:
+        engine.close()
+
+
+def pick_threads(nps_by_threads: dict) -> int:
+    """Menys fils amb què afegir-ne més ja no guanya MIN_THREAD_GAIN de nps."""
+    chosen, best = 1, 0
+    for threads in sorted(nps_by_threads):
+        nps = nps_by_threads[threads]
+        if not best or nps >= best * (1 + MIN_THREAD_GAIN):
+            chosen, best = threads, nps
+    return chosen
+
+
+class EngineProfiles:
+    """Perfils desats al fitxer de configuració (es creen o recalculen si cal)."""
+    def __init__(self, path: str | None = None):
+        self.path = path or default_config_path()
+        self.data = {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self.data = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            log.warning("No s'ha pogut llegir la configuració del motor %s: %s", self.path, e)
+        host = host_resources()
+        if self.data.get("host") != host or not all(name in self.data.get("profiles", {}) for name in PROFILES):
+            log.info("Perfils del motor per a %d nuclis i %d MB", host["cores"], host["memory_mb"])
+            self.data = {"host": host, "profiles": size_profiles(host), "engines": self.data.get("engines", [])}
+            self.save()
+
+    def options(self, name: str) -> dict:
+        """Paràmetres UCI del perfil (Threads, Hash...)."""
+        return {key: value for key, value in self.data["profiles"][name].items() if key != "workers"}
+
+    def workers(self, name: str = "batch") -> int:
+        return self.data["profiles"][name].get("workers", 1)
+
+    def budgets(self, count: int, reserved_threads: int = 0) -> list[dict]:
+        """
+        Threads i Hash del perfil interactiu repartits entre 'count' motors
+        simultanis, descomptant els 'reserved_threads' d'altres motors que
+        treballen alhora amb fils fixos (el del gràfic d'avaluació).
+        """
+        total = self.data["profiles"]["interactive"]
+        threads = total["Threads"] - reserved_threads
+        if count > threads:
+            log.warning("%d motors per %d fils (%d reservats): cada motor en farà servir un",
+                        count, total["Threads"], reserved_threads)
+            threads = count
+        hash_mb = _hash_mb(total["Hash"] / count, total["Hash"])
+        return [{"Threads": max(1, threads // count + (1 if i < threads % count else 0)), "Hash": hash_mb}
+                for i in range(count)]
+
+    def engines(self) -> list[dict]:
+        """Motors d'anàlisi addicionals: [{"name", "path", "options"}]."""
+        return self.data.get("engines", [])
+
+    def add_engine(self, name: str, path: str, options: dict | None = None):
+        self.data.setdefault("engines", []).append({"name": name, "path": path, "options": options or {}})
+        self.save()
+
+    def clear_engines(self):
+        self.data["engines"] = []
+        self.save()
+
+    def calibrate(self, engine_path: str, progress=None) -> dict:
+        """
+        Mesura els nps amb 1, 2, 4... fils (fins als del perfil interactiu
+        calculat) i ajusta els fils del perfil interactiu. progress(fets, total).
+        Retorna {fils: nps}.
+        """
+        host = self.data["host"]
+        limit = max(1, host["cores"] - UI_RESERVED_CORES)
+        candidates = sorted({1, limit} | {1 << i for i in range(limit.bit_length()) if 1 << i <= limit})
+        hash_mb = self.data["profiles"]["interactive"]["Hash"]
+        results = {}
+        for done, threads in enumerate(candidates):
+            if progress is not None:
+                progress(done, len(candidates))
+            results[threads] = measure_nps(engine_path, threads, hash_mb)
+            log.info("Calibratge: %d fils -> %d nps", threads, results[threads])
+        if progress is not None:
+            progress(len(candidates), len(candidates))
+        self.data["profiles"]["interactive"]["Threads"] = pick_threads(results)
+        self.data["calibration"] = {"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                                    "nps": {str(threads): nps for threads, nps in results.items()}}
+        self.save()
+        return results
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump(self.data, f, indent=2)
+        except OSError as e:
+            log.warning("No s'ha pogut desar la configuració del motor %s: %s", self.path, e)
+
+
+def main(argv=None) -> int:
+    from log_setup import setup_logging
+    parser = argparse.ArgumentParser(description="Perfils de recursos del motor (Threads, Hash)")
+    parser.add_argument("--config", help="Fitxer dels perfils (per defecte GEMINI_CHESS_ENGINE_CONFIG o "
+                        "profiles.json al directori de configuració de l'usuari)")
+    parser.add_argument("--engine", default=os.environ.get("GEMINI_CHESS_ENGINE") or
+                        os.path.join(BASE_DIR, "..", "assets", "engines", "stockfish-ubuntu-x86-64-sse41-popcnt"))
+    parser.add_argument("--calibrate", action="store_true", help="Mesura els nps per triar el nombre de fils")
+    args = parser.parse_args(argv)
+    setup_logging("INFO")
+    profiles = EngineProfiles(args.config)
+    if args.calibrate:
+        for threads, nps in profiles.calibrate(args.engine).items():
+            print(f"{threads:>4} fils: {nps:>12} nps")
+    print(json.dumps(profiles.data, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+# src/epd_suite.py
+"""
+Execució de tests EPD (WAC, STS, ...) contra el motor, en paral·lel.
+
+Cada línia EPD és una posició amb operacions; es fan servir:
+    bm  jugada(es) correcta(es)         am  jugada(es) a evitar
+    id  nom de la posició               c0  punts per jugada (format STS: "Qg6=10, Rae1=3")
+Una posició és resolta si la jugada final del motor és a bm (i, si n'hi ha,
+no és a am). El temps fins a la solució és el 'time' de la línia 'info' a
+partir de la qual la primera jugada de la PV ja no canvia a una de dolenta.
+
+Les posicions es reparteixen entre --workers processos del motor (un
+ChessEngine per fil: el fil només espera el motor, no competeix pel GIL).
+Per defecte, el nombre de motors i les seves opcions surten del perfil
+"batch" d'engine_profiles (un motor d'un fil per nucli): els resultats
+depenen menys de la càrrega de la màquina. El límit de cada cerca és de
+temps (--movetime ms), de nodes (--nodes, reproduïble) o de profunditat
+(--depth).
+
+Ús (des de src):
+    python epd_suite.py wac.epd --movetime 1000 --workers 4 --json wac.json
+    python epd_suite.py sts1.epd sts2.epd --nodes 200000 --min-solve-rate 0.8
+
+El JSON inclou la màquina, els paràmetres, el resum (taxa de resolució,
+temps mitjà fins a la solució, nps, punts STS) i el resultat de cada posició.
+Amb --min-solve-rate el codi de sortida és 1 si no s'arriba a la taxa
+(per validar una compilació del motor o una configuració de màquina).
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import queue
+import re
+import sys
+import threading
+import time
+import chess
+from typing import NamedTuple
+from engine_manager import ChessEngine
+from engine_profiles import EngineProfiles
+
+log = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_ENGINE = os.environ.get("GEMINI_CHESS_ENGINE") or \
+    os.path.join(BASE_DIR, "..", "assets", "engines", "stockfish-ubuntu-x86-64-sse41-popcnt")
+DEFAULT_MOVETIME = 1000 # ms
+_POINTS = re.compile(r"([^\s,=]+)\s*=\s*(\d+)")
+
+
+class EpdPosition(NamedTuple):
+    id: str
+    fen: str
+    best: tuple[str, ...] # uci
+    avoid: tuple[str, ...] # uci
+    points: dict # uci -> punts (STS)
+
+
+def parse_epd_line(line: str, number: int = 0) -> EpdPosition | None:
+    """Una línia EPD; None si és buida, un comentari o no té bm/am."""
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    board, ops = chess.Board.from_epd(line)
+    best = tuple(move.uci() for move in ops.get("bm") or [])
+    avoid = tuple(move.uci() for move in ops.get("am") or [])
+    if not best and not avoid:
+        return None
+    points = {}
+    comment = ops.get("c0")
+    if isinstance(comment, str):
+        for san, value in _POINTS.findall(comment):
+            try:
+                points[board.parse_san(san).uci()] = int(value)
+            except ValueError:
+                pass
+    return EpdPosition(str(ops.get("id") or f"#{number}"), board.fen(), best, avoid, points)
+
+
+def load_epd(path: str) -> list[EpdPosition]:
+    positions = []
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for number, line in enumerate(f, 1):
+            try:
+                position = parse_epd_line(line, number)
+            except ValueError as e:
+                log.warning("%s:%d: línia EPD invàlida (%s)", path, number, e)
+                continue
+            if position is not None:
+                positions.append(position)
+    return positions
+
+
+def is_solution(position: EpdPosition, move: str | None) -> bool:
+    if move is None:
+        return False
+    if position.best and move not in position.best:
+        return False
+    return move not in position.avoid
+
+
+def score_position(position: EpdPosition, trace: dict | None) -> dict:
+    """Resultat d'una posició a partir de la traça de ChessEngine.search_trace."""
+    result = {"id": position.id, "fen": position.fen, "best": list(position.best), "avoid": list(position.avoid)}
+    if trace is None:
+        result.update(move=None, solved=False, error=True)
+        return result
+    move = trace["best_move"]
+    infos = trace["infos"]
+    solved = is_solution(position, move)
+    time_to_solution = None
+    if solved:
+        time_to_solution = 0
+        for info in reversed(infos): # Primera línia d'una ratxa final de jugades correctes
+            if not is_solution(position, info[4]):
+                break
+            time_to_solution = info[0]
+    last = infos[-1] if infos else (0, 0, 0, 0, None)
+    result.update(move=move, solved=solved, time_to_solution_ms=time_to_solution,
+                  time_ms=last[0], depth=last[1], nodes=last[2], nps=last[3])
+    if position.points:
+        result["points"] = position.points.get(move, 0)
+        result["max_points"] = max(position.points.values())
+    return result
+
+
+def run_suite(positions: list[EpdPosition], engine_path: str = DEFAULT_ENGINE, workers: int = 1,
+              movetime: int | None = None, nodes: int | None = None, depth: int | None = None,
+              engine_options: dict | None = None, progress=None) -> list[dict]:
+    """
+    Analitza totes les posicions repartint-les entre 'workers' motors.
+    Retorna els resultats en l'ordre de 'positions'. progress(fets, total).
+    """
+    if not (movetime or nodes or depth):
+        movetime = DEFAULT_MOVETIME
+    workers = max(1, min(workers, len(positions)))
+    options = {"Threads": 1, **(engine_options or {})}
+    engines = []
+    for _ in range(workers): # Es creen abans dels fils: un error del motor surt aquí
+        engines.append(ChessEngine(engine_path, options))
+    pending = queue.Queue()
+    for item in enumerate(positions):
+        pending.put(item)
+    results = [None] * len(positions)
+    done = [0]
+    lock = threading.Lock()
+
+    def work(engine: ChessEngine):
+        while True:
+            try:
+                index, position = pending.get_nowait()
+            except queue.Empty:
+                return
+            trace = engine.search_trace(position.fen, movetime=movetime, nodes=nodes, depth=depth)
+            results[index] = score_position(position, trace)
+            with lock:
+                done[0] += 1
+                if progress is not None:
+                    progress(done[0], len(positions))
+
+    threads = [threading.Thread(target=work, args=(engine,), daemon=True) for engine in engines]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        for engine in engines:
+            engine.close()
+    return results
+
+
+def summarize(results: list[dict]) -> dict:
+    solved = [r for r in results if r["solved"]]
+    total_nodes = sum(r.get("nodes", 0) for r in results)
+    total_ms = sum(r.get("time_ms", 0) for r in results)
+    summary = {
+        "positions": len(results),
+        "solved": len(solved),
+        "solve_rate": len(solved) / len(results) if results else 0.0,
+        "mean_time_to_solution_ms": sum(r["time_to_solution_ms"] for r in solved) / len(solved) if solved else None,
+        "errors": sum(1 for r in results if r.get("error")),
+        "nodes": total_nodes,
+        "nps": int(total_nodes * 1000 / total_ms) if total_ms else 0, # Per motor (mitjana ponderada pel temps)
+    }
+    scored = [r for r in results if "points" in r]
+    if scored:
+        summary["points"] = sum(r["points"] for r in scored)
+        summary["max_points"] = sum(r["max_points"] for r in scored)
+    return summary
+
+
+def main(argv=None) -> int:
+    from log_setup import setup_logging
+    parser = argparse.ArgumentParser(description="Executa tests EPD (bm/am) contra el motor")
+    parser.add_argument("files", nargs="+", help="Fitxers .epd")
+    parser.add_argument("--engine", default=DEFAULT_ENGINE)
+    parser.add_argument("--workers", type=int, help="Processos del motor en paral·lel (per defecte, els del perfil batch)")
+    limit = parser.add_mutually_exclusive_group()
+    limit.add_argument("--movetime", type=int, help=f"ms per posició (per defecte {DEFAULT_MOVETIME})")
+    limit.add_argument("--nodes", type=int, help="Nodes per posició")
+    limit.add_argument("--depth", type=int, help="Profunditat per posició")
+    parser.add_argument("--threads", type=int, help="Threads de cada motor (per defecte, els del perfil batch)")
+    parser.add_argument("--hash", type=int, help="Hash (MB) de cada motor (per defecte, el del perfil batch)")
+    parser.add_argument("--json", help="Desa els resultats en aquest fitxer ('-' per la sortida estàndard)")
+    parser.add_argument("--min-solve-rate", type=float, help="Codi de sortida 1 si la taxa és inferior")
+    args = parser.parse_args(argv)
+    setup_logging("WARNING")
+
+    profiles = EngineProfiles()
+    options = profiles.options("batch")
+    if args.threads:
+        options["Threads"] = args.threads
+    if args.hash:
+        options["Hash"] = args.hash
+    if not args.workers:
+        args.workers = profiles.workers("batch")
+    report = {"host": {"platform": platform.platform(), "machine": platform.machine(), "cpus": os.cpu_count()},
+              "date": time.strftime("%Y-%m-%d %H:%M:%S"), "engine": os.path.basename(args.engine),
+              "limit": {"movetime": args.movetime, "nodes": args.nodes, "depth": args.depth},
+              "workers": args.workers, "engine_options": options, "suites": {}}
+    failed = False
+    for filename in args.files:
+        positions = load_epd(filename)
+        if not positions:
+            print(f"{filename}: cap posició amb bm/am", file=sys.stderr)
+            continue
+        started = time.perf_counter()
+        results = run_suite(positions, args.engine, args.workers, args.movetime, args.nodes, args.depth, options)
+        summary = summarize(results)
+        summary["seconds"] = round(time.perf_counter() - started, 3)
+        report["suites"][os.path.basename(filename)] = {"summary": summary, "results": results}
+        tts = summary["mean_time_to_solution_ms"]
+        line = (f"{filename}: {summary['solved']}/{summary['positions']} ({summary['solve_rate']:.1%}), "
+                f"temps mitjà fins a la solució {'-' if tts is None else f'{tts:.0f} ms'}, "
+                f"{summary['nps']} nps, {summary['seconds']:.1f} s")
+        if "points" in summary:
+            line += f", {summary['points']}/{summary['max_points']} punts"
+        print(line, file=sys.stderr if args.json == "-" else sys.stdout)
+        if args.min_solve_rate is not None and summary["solve_rate"] < args.min_solve_rate:
+            failed = True
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
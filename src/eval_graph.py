@@ -0,0 +1,184 @@
+# src/eval_graph.py
+"""
+Gràfic de l'avaluació al llarg de la partida (sota el tauler).
+
+GameEvaluator (en un QThread propi, amb el seu motor d'un fil) avalua les
+posicions de la línia principal en dues passades: primer totes a
+QUICK_DEPTH (el gràfic surt sencer de seguida) i després a REFINE_DEPTH.
+Fa una posició per event, així una partida nova (start) o l'aturada
+passen davant de la feina pendent, i no bloqueja mai la interfície. Els
+resultats es guarden a l'AnalysisCache compartida: tornar a obrir una
+partida, o les posicions que ja ha analitzat el panell del motor, no es
+recalculen.
+
+EvalGraph dibuixa la corba amb la puntuació comprimida (com la
+probabilitat de guanyar: ±EVAL_SCALE cp ja és gairebé el límit). Si hi ha
+més mitges jugades que píxels, es dibuixa el mínim i el màxim de cada
+columna (la corba no perd els pics i el cost no depèn de la llargada de la
+partida). Un clic situa el tauler en aquella mitja jugada.
+"""
+import logging
+import math
+import chess
+from PySide6.QtWidgets import QWidget, QSizePolicy
+from PySide6.QtGui import QPainter, QColor, QPen, QPolygonF
+from PySide6.QtCore import QObject, QPointF, Qt, QTimer, Signal, Slot
+from engine_manager import AnalysisCache
+
+log = logging.getLogger(__name__)
+
+QUICK_DEPTH = 8
+REFINE_DEPTH = 14
+MATE_SCORE = 10000 # cp equivalents a un mat (el signe diu qui guanya)
+EVAL_SCALE = 400.0 # cp: escala de la compressió de la corba
+
+
+def white_score(lines: list | None, board: chess.Board) -> int | None:
+    """Puntuació (cp, punt de vista de les blanques) d'un resultat de get_analysis."""
+    if lines:
+        if lines[0].get("Mate") is not None:
+            mate = lines[0]["Mate"]
+            return (MATE_SCORE - abs(mate)) * (1 if mate > 0 else -1)
+        return lines[0].get("Centipawn")
+    if board.is_checkmate(): # El motor no torna cap línia en posicions acabades
+        return -MATE_SCORE if board.turn == chess.WHITE else MATE_SCORE
+    if board.is_game_over():
+        return 0
+    return None
+
+
+class GameEvaluator(QObject):
+    """Worker que avalua les posicions d'una partida en segon pla."""
+    # (generació, ply, puntuació cp de les blanques, profunditat)
+    evaluated = Signal(int, int, int, int)
+    finished = Signal(int)
+
+    def __init__(self, engine, cache: AnalysisCache | None = None):
+        super().__init__()
+        self.engine = engine
+        self.cache = cache if cache is not None else AnalysisCache()
+        self._generation = 0
+        self._pending = [] # (ply, fen, depth) en l'ordre en què s'avaluaran
+
+    @Slot(int, list)
+    def start(self, generation: int, fens: list):
+        """Comença una partida nova (descarta la feina pendent de l'anterior)."""
+        self._generation = generation
+        self._pending = [(ply, fen, QUICK_DEPTH) for ply, fen in enumerate(fens)]
+        self._pending += [(ply, fen, REFINE_DEPTH) for ply, fen in enumerate(fens)]
+        self._pending.reverse() # pop() des del final
+        QTimer.singleShot(0, self._step)
+
+    @Slot()
+    def stop(self):
+        self._pending = []
+
+    @Slot()
+    def _step(self):
+        if not self._pending:
+            return
+        ply, fen, depth = self._pending.pop()
+        lines = self.cache.get(fen, depth, 1)
+        if lines is None:
+            lines = self.engine.get_analysis(fen, depth, 1)
+            if lines is not None:
+                self.cache.put(fen, depth, 1, lines)
+        score = white_score(lines, chess.Board(fen))
+        if score is not None:
+            self.evaluated.emit(self._generation, ply, score, depth)
+        if self._pending:
+            QTimer.singleShot(0, self._step)
+        else:
+            self.finished.emit(self._generation)
+
+
+class EvalGraph(QWidget):
+    """Corba d'avaluació d'una partida; ply_clicked(ply) en fer-hi clic."""
+    ply_clicked = Signal(int)
+
+    BACKGROUND = QColor("#2B2B2B")
+    WHITE_AREA = QColor("#E8E8E8")
+    LINE = QColor("#7388B6")
+    CURRENT = QColor("#E0A030")
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setMinimumHeight(60)
+        self.setMaximumHeight(90)
+        self.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Fixed)
+        self.setCursor(Qt.CursorShape.PointingHandCursor)
+        self._scores = [] # cp per ply (None: encara no avaluat)
+        self._current = None
+
+    def set_length(self, plies: int, keep_scores: bool = False):
+        """Partida de 'plies' posicions; amb keep_scores es mantenen les ja conegudes (jugades afegides)."""
+        if keep_scores:
+            self._scores = (self._scores + [None] * plies)[:plies]
+        else:
+            self._scores = [None] * plies
+        self.update()
+
+    def set_score(self, ply: int, score: int):
+        if 0 <= ply < len(self._scores):
+            self._scores[ply] = score
+            self.update()
+
+    def set_current_ply(self, ply: int | None):
+        if ply != self._current:
+            self._current = ply
+            self.update()
+
+    @staticmethod
+    def _y(score: float, height: int) -> float:
+        """0 (a dalt, guanyen les blanques) ... height (a baix); 0 cp al mig."""
+        squashed = 2.0 / (1.0 + math.exp(-score / EVAL_SCALE)) - 1.0
+        return (1.0 - squashed) * height / 2.0
+
+    def _columns(self, width: int) -> list:
+        """[(x, min, max)] amb les puntuacions conegudes, agrupades per columna de píxels si cal."""
+        count = len(self._scores)
+        if count <= 1:
+            return [(0.0, s, s) for s in self._scores if s is not None]
+        step = (width - 1) / (count - 1)
+        if count <= width:
+            return [(ply * step, s, s) for ply, s in enumerate(self._scores) if s is not None]
+        columns = {}
+        for ply, score in enumerate(self._scores):
+            if score is None:
+                continue
+            x = int(ply * step)
+            low, high = columns.get(x, (score, score))
+            columns[x] = (min(low, score), max(high, score))
+        return [(float(x), low, high) for x, (low, high) in sorted(columns.items())]
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        width, height = self.width(), self.height()
+        painter.fillRect(self.rect(), self.BACKGROUND)
+        columns = self._columns(width)
+        if columns:
+            # Àrea blanca sota la corba (com més n'hi ha, millor per les blanques) i la corba a sobre
+            curve = []
+            for x, low, high in columns:
+                curve.append(QPointF(x, self._y(high, height)))
+                if low != high:
+                    curve.append(QPointF(x, self._y(low, height)))
+            area = [QPointF(columns[0][0], height)] + curve + [QPointF(columns[-1][0], height)]
+            painter.setPen(Qt.PenStyle.NoPen)
+            painter.setBrush(self.WHITE_AREA)
+            painter.drawPolygon(QPolygonF(area))
+            painter.setPen(QPen(self.LINE, 1))
+            painter.drawPolyline(QPolygonF(curve))
+        painter.setPen(QPen(QColor("#808080"), 1, Qt.PenStyle.DotLine))
+        painter.drawLine(0, height // 2, width, height // 2)
+        if self._current is not None and len(self._scores) > 1:
+            x = self._current * (width - 1) / (len(self._scores) - 1)
+            painter.setPen(QPen(self.CURRENT, 2))
+            painter.drawLine(QPointF(x, 0), QPointF(x, height))
+        painter.end()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.MouseButton.LeftButton and len(self._scores) > 1:
+            ply = round(event.position().x() * (len(self._scores) - 1) / max(1, self.width() - 1))
+            self.ply_clicked.emit(max(0, min(ply, len(self._scores) - 1)))
+        super().mousePressEvent(event)
@@ -0,0 +1,370 @@
+# src/game_list.py
+"""
+Llista de partides de la BBDD (QTableView) per col·leccions de milions de partides.
+
+GameListModel no carrega mai tota la taula:
+- El nombre total de files es calcula un cop (COUNT) i es guarda fins que
+  canvia el filtre o es crida refresh().
+- La vista demana files per pàgines amb canFetchMore()/fetchMore(); rowCount()
+  creix a mesura que es fa scroll, però les dades de cada pàgina es llegeixen
+  només quan es pinten i es guarden en una cache LRU de MAX_CACHED_PAGES pàgines.
+  La memòria no depèn de quantes files s'hagin recorregut.
+- Les pàgines es llegeixen per "keyset" (WHERE (col, id) > (darrer valor, darrer id))
+  quan es coneix la pàgina anterior, i amb OFFSET si es salta directament al mig.
+- Només es pot ordenar per columnes amb índex (db_manager.SORTABLE_COLUMNS):
+  l'ORDER BY el resol SQLite amb l'índex, no en memòria.
+- Amb set_thumbnails(), el tooltip de cada fila és la miniatura de la
+  posició final (board_render.ThumbnailCache: només es dibuixa el primer
+  cop, després es llegeix del disc). data() no calcula ni dibuixa res: el
+  primer cop que es passa per una fila llegeix les jugades de tota la
+  pàgina (una consulta) i un fil reprodueix les partides i en dibuixa les
+  miniatures, primer la de la fila i després les veïnes. Mentrestant el
+  tooltip diu que s'està dibuixant; quan és a punt, la vista el refà.
+- set_search() filtra amb l'índex FTS5 i ordena per rellevància (bm25)
+  fins que l'usuari tria una altra columna. Si hi ha més de RANK_LIMIT
+  resultats s'ordenen per id: calcular bm25 per centenars de milers de
+  partides costaria segons i, amb tantes, la rellevància no aporta res.
+"""
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import chess
+from PySide6.QtCore import Qt, QAbstractTableModel, QModelIndex, Signal, Slot
+from PySide6.QtGui import QCursor
+from PySide6.QtWidgets import QTableView, QAbstractItemView, QHeaderView, QToolTip
+from db_manager import GameDatabase, SORTABLE_COLUMNS, decode_moves
+from instrumentation import timed
+
+log = logging.getLogger(__name__)
+
+# (columna de 'games', títol)
+COLUMNS = (
+    ("id", "Núm."),
+    ("white", "Blanques"),
+    ("elo_white", "Elo"),
+    ("black", "Negres"),
+    ("elo_black", "Elo"),
+    ("result", "Resultat"),
+    ("date", "Data"),
+    ("tournament", "Torneig"),
+    ("round_num", "Ronda"),
+    ("eco", "ECO"),
+    ("ply", "Ply"),
+)
+
+
+THUMBNAIL_PLACEHOLDER = "Dibuixant la posició final..."
+
+
+class GameListModel(QAbstractTableModel):
+    PAGE_SIZE = 256
+    MAX_CACHED_PAGES = 64 # ~16.000 files en memòria com a màxim
+    RANK_LIMIT = 20000 # Màxim de resultats per ordenar per rellevància
+    MAX_THUMBNAIL_PATHS = 4096 # Camins de miniatures recordats (id de partida -> fitxer)
+    thumbnail_ready = Signal(int) # id de la partida amb la miniatura a punt
+    _thumbnail_rendered = Signal(int, int, object) # generació, id, camí (des del fil de les miniatures)
+
+    def __init__(self, db: GameDatabase | None = None, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self._sort_column = "id"
+        self._descending = False
+        self._where = "" # Filtre SQL opcional (veure set_filter)
+        self._params = ()
+        self._fts_query = None # Consulta FTS5 de la cerca activa (veure set_search)
+        self.thumbnails = None # board_render.ThumbnailCache (opcional)
+        self._thumbnail_paths = OrderedDict() # id de partida -> camí de la miniatura o None (LRU)
+        self._thumbnail_requested = set() # Ids enviats al fil que encara no han tornat
+        self._thumbnail_generation = 0 # Canvia amb la BBDD o la cache: les feines anteriors no valen
+        self._thumbnail_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="thumbnails")
+        self._thumbnail_rendered.connect(self._on_thumbnail_rendered) # Del fil al de la interfície (en cua)
+        self._total = 0 # Files totals (cache del COUNT)
+        self._exposed = 0 # Files que la vista ja coneix (rowCount)
+        self._pages = OrderedDict() # número de pàgina -> llista de files (LRU)
+        self._page_keys = {} # número de pàgina -> (valor d'ordenació, id) de l'última fila
+        self._recount()
+
+    # --- Configuració ---
+    def set_database(self, db: GameDatabase | None):
+        self.db = db
+        self._reset_thumbnails()
+        self.refresh()
+
+    def set_thumbnails(self, thumbnails):
+        self.thumbnails = thumbnails
+        self._reset_thumbnails()
+
+    def _reset_thumbnails(self):
+        self._thumbnail_generation += 1
+        self._thumbnail_paths.clear()
+        self._thumbnail_requested.clear()
+
+    def set_filter(self, where: str = "", params=()):
+        """Restringeix les files amb una condició SQL sobre 'games' (ex: "white LIKE ?")."""
+        self._where, self._params = where, tuple(params)
+        self._fts_query = None
+        if self._sort_column == "rank":
+            self._sort_column, self._descending = "id", False
+        self.refresh()
+
+    def set_search(self, text: str):
+        """Cerca de text (jugadors, torneig, lloc, comentaris); text buit = totes."""
+        text = text.strip()
+        where, params = self.db.search_condition(text) if (self.db and text) else ("", ())
+        self._where, self._params = where, params
+        self._fts_query = params[0] if (where and self.db.has_fts) else None
+        if self._fts_query:
+            self._sort_column, self._descending = "rank", False
+        elif self._sort_column == "rank":
+            self._sort_column, self._descending = "id", False
+        self.beginResetModel()
+        self._recount()
+        if self._sort_column == "rank" and self._total > self.RANK_LIMIT:
+            log.debug("%d resultats: s'ordenen per id en lloc de rellevància", self._total)
+            self._sort_column = "id"
+        self.endResetModel()
+
+    def refresh(self):
+        """Torna a comptar i buida les caches (després d'importar, canviar filtre...)."""
+        self.beginResetModel()
+        self._recount()
+        self.endResetModel()
+
+    def _recount(self):
+        self._pages.clear()
+        self._page_keys.clear()
+        if self.db is None:
+            self._total = 0
+        elif self._fts_query: # Comptar directament a l'índex és molt més ràpid que amb IN (...)
+            self._total = self.db.conn.execute("SELECT COUNT(*) FROM games_fts WHERE games_fts MATCH ?",
+                                               (self._fts_query,)).fetchone()[0]
+        else:
+            where = f" WHERE {self._where}" if self._where else ""
+            self._total = self.db.conn.execute(f"SELECT COUNT(*) FROM games{where}", self._params).fetchone()[0]
+        self._exposed = min(self._total, self.PAGE_SIZE)
+
+    def total_count(self) -> int:
+        return self._total
+
+    def game_id(self, row: int) -> int | None:
+        values = self._row(row)
+        return values[0] if values else None
+
+    # --- Paginació ---
+    def canFetchMore(self, parent=QModelIndex()) -> bool:
+        return not parent.isValid() and self._exposed < self._total
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        count = min(self.PAGE_SIZE, self._total - self._exposed)
+        if count <= 0:
+            return
+        self.beginInsertRows(QModelIndex(), self._exposed, self._exposed + count - 1)
+        self._exposed += count
+        self.endInsertRows()
+
+    def _row(self, row: int):
+        page_number, offset = divmod(row, self.PAGE_SIZE)
+        page = self._pages.get(page_number)
+        if page is None:
+            page = self._load_page(page_number)
+        else:
+            self._pages.move_to_end(page_number)
+        return page[offset] if offset < len(page) else None
+
+    @timed("game_list.load_page")
+    def _load_page(self, page_number: int) -> list:
+        columns = ", ".join(f"games.{column}" for column, _ in COLUMNS)
+        direction = "DESC" if self._descending else "ASC"
+        conditions = [f"({self._where})"] if self._where else []
+        params = list(self._params)
+        if self._sort_column == "rank":
+            # Rellevància (bm25): la pàgina es talla dins l'índex i només se'n llegeixen aquestes files
+            sql = (f"SELECT {columns} FROM (SELECT rowid AS fts_id, rank AS fts_rank FROM games_fts "
+                   "WHERE games_fts MATCH ? ORDER BY rank LIMIT ? OFFSET ?) JOIN games ON games.id = fts_id "
+                   "ORDER BY fts_rank")
+            rows = [tuple(r) for r in self.db.conn.execute(
+                sql, (self._fts_query, self.PAGE_SIZE, page_number * self.PAGE_SIZE))]
+            return self._store_page(page_number, rows)
+        previous = self._page_keys.get(page_number - 1)
+        if self._fts_query and self._sort_column == "id":
+            # Per id, FTS5 ja retorna els rowid en ordre: no cal materialitzar el conjunt de resultats
+            operator = "<" if self._descending else ">"
+            keyset = f"AND rowid {operator} ? " if previous else ""
+            sql = (f"SELECT {columns} FROM (SELECT rowid AS fts_id FROM games_fts WHERE games_fts MATCH ? "
+                   f"{keyset}ORDER BY rowid {direction} LIMIT ? OFFSET ?) JOIN games ON games.id = fts_id "
+                   f"ORDER BY games.id {direction}")
+            params = [self._fts_query] + ([previous[1]] if previous else [])
+            offset = 0 if previous else page_number * self.PAGE_SIZE
+            rows = [tuple(r) for r in self.db.conn.execute(sql, (*params, self.PAGE_SIZE, offset))]
+            if rows:
+                self._page_keys[page_number] = (rows[-1][0], rows[-1][0])
+            return self._store_page(page_number, rows)
+        if self._sort_column == "id":
+            order = f"games.id {direction}"
+        else:
+            order = f"games.{self._sort_column} {direction}, games.id {direction}"
+        offset = 0
+        if previous is not None: # Keyset: continua després de l'última fila de la pàgina anterior
+            operator = "<" if self._descending else ">"
+            if self._sort_column == "id":
+                conditions.append(f"games.id {operator} ?")
+                params.append(previous[1])
+            else:
+                conditions.append(f"(games.{self._sort_column}, games.id) {operator} (?, ?)")
+                params.extend(previous)
+        else:
+            offset = page_number * self.PAGE_SIZE
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        sql = f"SELECT {columns} FROM games{where} ORDER BY {order} LIMIT ? OFFSET ?"
+        rows = [tuple(r) for r in self.db.conn.execute(sql, (*params, self.PAGE_SIZE, offset))]
+        if rows:
+            sort_index = next(i for i, (column, _) in enumerate(COLUMNS) if column == self._sort_column)
+            self._page_keys[page_number] = (rows[-1][sort_index], rows[-1][0])
+        return self._store_page(page_number, rows)
+
+    # --- Miniatures (tooltip) ---
+    def _thumbnail_tooltip(self, row: int):
+        values = self._row(row)
+        if values is None:
+            return None
+        game_id = values[0]
+        if game_id in self._thumbnail_paths:
+            self._thumbnail_paths.move_to_end(game_id)
+            path = self._thumbnail_paths[game_id]
+            return f'<img src="{path}">' if path else None
+        if game_id not in self._thumbnail_requested:
+            self._request_thumbnails(row)
+        return THUMBNAIL_PLACEHOLDER
+
+    def _request_thumbnails(self, row: int):
+        """Envia al fil la fila 'row' i les altres de la seva pàgina, per proximitat."""
+        page_number = row // self.PAGE_SIZE
+        first = page_number * self.PAGE_SIZE
+        rows = range(first, min(first + self.PAGE_SIZE, self._exposed))
+        ids = []
+        for other in sorted(rows, key=lambda r: abs(r - row)):
+            values = self._row(other)
+            if values and values[0] not in self._thumbnail_paths and values[0] not in self._thumbnail_requested:
+                ids.append(values[0])
+        if not ids:
+            return
+        placeholders = ",".join("?" * len(ids))
+        stored = {game_id: (fen, moves) for game_id, fen, moves in self.db.conn.execute(
+            f"SELECT id, fen, moves FROM games WHERE id IN ({placeholders})", ids)}
+        generation, thumbnails = self._thumbnail_generation, self.thumbnails
+        for game_id in ids:
+            if game_id in stored:
+                self._thumbnail_requested.add(game_id)
+                self._thumbnail_executor.submit(self._render_thumbnail, generation, thumbnails,
+                                                game_id, *stored[game_id])
+
+    def _render_thumbnail(self, generation: int, thumbnails, game_id: int, fen: str, moves: bytes):
+        """Al fil de les miniatures: posició final i fitxer PNG (de disc si ja hi és)."""
+        if generation != self._thumbnail_generation:
+            return
+        try:
+            board = chess.Board(fen)
+            for move in decode_moves(moves):
+                board.push(move)
+            path = thumbnails.path(board.fen())
+        except Exception:
+            log.exception("No s'ha pogut dibuixar la miniatura de la partida %d", game_id)
+            path = None
+        self._thumbnail_rendered.emit(generation, game_id, path)
+
+    @Slot(int, int, object)
+    def _on_thumbnail_rendered(self, generation: int, game_id: int, path):
+        if generation != self._thumbnail_generation:
+            return
+        self._thumbnail_requested.discard(game_id)
+        self._thumbnail_paths[game_id] = path
+        while len(self._thumbnail_paths) > self.MAX_THUMBNAIL_PATHS:
+            self._thumbnail_paths.popitem(last=False)
+        self.thumbnail_ready.emit(game_id)
+
+    def _store_page(self, page_number: int, rows: list) -> list:
+        self._pages[page_number] = rows
+        while len(self._pages) > self.MAX_CACHED_PAGES:
+            self._pages.popitem(last=False)
+        return rows
+
+    # --- Interfície QAbstractTableModel ---
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else self._exposed
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def data(self, index: QModelIndex, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.ItemDataRole.DisplayRole:
+            values = self._row(index.row())
+            if values is None:
+                return None
+            value = values[index.column()]
+            if COLUMNS[index.column()][0] in ("elo_white", "elo_black") and not value:
+                return ""
+            return value
+        if role == Qt.ItemDataRole.ToolTipRole and self.thumbnails is not None:
+            return self._thumbnail_tooltip(index.row())
+        if role == Qt.ItemDataRole.TextAlignmentRole and COLUMNS[index.column()][0] in ("id", "elo_white", "elo_black", "ply"):
+            return int(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
+        return None
+
+    def headerData(self, section: int, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return COLUMNS[section][1]
+        return None
+
+    def sort(self, column: int, order=Qt.SortOrder.AscendingOrder):
+        name = COLUMNS[column][0]
+        if name != "id" and name not in SORTABLE_COLUMNS:
+            log.debug("La columna %s no té índex: no s'hi ordena", name)
+            return
+        self._sort_column = name
+        self._descending = order == Qt.SortOrder.DescendingOrder
+        self.refresh()
+
+
+class GameListView(QTableView):
+    """Taula de partides amb files d'alçada fixa (el scroll no ha de mesurar cap fila)."""
+    game_activated = Signal(int) # id de la partida (doble clic / Enter)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+        self.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.setAlternatingRowColors(True)
+        self.setWordWrap(False)
+        vertical = self.verticalHeader()
+        vertical.setVisible(False)
+        vertical.setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        vertical.setDefaultSectionSize(self.fontMetrics().height() + 6)
+        self.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Interactive)
+        self.horizontalHeader().setStretchLastSection(True)
+        self.setSortingEnabled(True)
+        self.activated.connect(self._on_activated)
+
+    def setModel(self, model):
+        super().setModel(model)
+        model.thumbnail_ready.connect(self._on_thumbnail_ready)
+        # L'ordenació inicial de QTableView és per la columna 0 (id), que té índex
+        self.horizontalHeader().setSortIndicator(0, Qt.SortOrder.AscendingOrder)
+
+    def _on_activated(self, index: QModelIndex):
+        game_id = self.model().game_id(index.row())
+        if game_id is not None:
+            self.game_activated.emit(game_id)
+
+    @Slot(int)
+    def _on_thumbnail_ready(self, game_id: int):
+        """Si el tooltip de la fila encara mostra el text provisional, el canvia per la miniatura."""
+        if not QToolTip.isVisible():
+            return
+        index = self.indexAt(self.viewport().mapFromGlobal(QCursor.pos()))
+        if index.isValid() and self.model().game_id(index.row()) == game_id:
+            QToolTip.showText(QCursor.pos(), self.model().data(index, Qt.ItemDataRole.ToolTipRole), self.viewport())
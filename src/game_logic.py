@@ -1,7 +1,17 @@
 # core/game_logic.py
+import io
+import os
 import chess
 import chess.pgn
-from PySide6.QtCore import QObject, Signal
+import logging
+from PySide6.QtCore import QObject, Signal, QFileSystemWatcher, QTimer
+from instrumentation import timed
+from compact_tree import CompactGameTree, CompactTreeBuilder, NodeView
+from pgn_io import open_pgn, PgnTail
+from eco import Opening, default_table, iter_hashes
+from journal import MoveJournal
+
+log = logging.getLogger(__name__)
 
 class GameLogic(QObject):
     """
@@ -11,21 +21,41 @@ class GameLogic(QObject):
     board_changed = Signal() # Senyal emès quan el tauler canvia
     game_over = Signal(str)  # Senyal emès quan la partida acaba (amb el resultat)
     move_made = Signal(chess.Move, str) # Senyal emès després de fer un moviment (moviment, san)
+    game_loaded = Signal() # S'ha substituït la partida sencera (carregar PGN, seguiment...)
+    moves_appended = Signal(int, list) # Seguiment: jugades noves al final (ply de la primera, llista SAN)
+    followed_games_changed = Signal(list) # Seguiment: índexs de partides noves/modificades al fitxer
+
+    FOLLOW_DEBOUNCE_MS = 250 # Agrupa les escriptures seguides al fitxer seguit
+    FOLLOW_FULL_CHECK_EVERY = 10 # Cada quantes actualitzacions es verifica tot el fitxer
 
     def __init__(self):
         super().__init__()
         self.board = chess.Board()
-        self._game = chess.pgn.Game() # Per guardar la partida
+        # Per guardar la partida: arbre compacte (arrays) en lloc de chess.pgn.GameNode,
+        # es converteix a chess.pgn.Game només en exportar (veure compact_tree.py)
+        self._game = CompactGameTree()
         self._game.setup(self.board)
-        self._current_node = self._game # Node actual per replay PGN
+        self._current_node = self._game.root() # Node actual per replay PGN
+        # Mode seguiment d'un PGN en directe (veure follow_pgn)
+        self._follow_tail = None
+        self._follow_game_index = None
+        self._follow_watcher = None
+        self._follow_timer = None
+        self._follow_refreshes = 0
+        self._journal = None # Diari d'autodesat (veure attach_journal)
+        # Obertura de cada node de la partida actual (veure current_opening)
+        self._openings_tree = None
+        self._openings = {}
 
     def reset(self):
         """Reinicia el tauler a la posició inicial."""
         self.board.reset()
-        self._game = chess.pgn.Game()
+        self._game = CompactGameTree()
         self._game.setup(self.board)
-        self._current_node = self._game
-        print("Tauler reiniciat.")
+        self._current_node = self._game.root()
+        self._journal_snapshot()
+        log.info("Tauler reiniciat.")
+        self.game_loaded.emit()
         self.board_changed.emit()
 
     def get_legal_moves(self, square: chess.Square) -> list[chess.Move]:
@@ -46,21 +76,23 @@ class GameLogic(QObject):
             # Si és promoció però no s'ha especificat la peça, posa Reina per defecte
             # El controlador hauria d'interceptar això i demanar a l'usuari
             if is_promotion and move.promotion is None:
-                print("Avís: Promoció detectada, seleccionant Reina per defecte.")
+                log.warning("Promoció detectada, seleccionant Reina per defecte.")
                 move.promotion = chess.QUEEN
 
         if move in self.board.legal_moves:
             san = self.board.san(move) # Obté la notació abans de fer el push
             self.board.push(move)
             # Actualitza el joc PGN
-            self._current_node = self._current_node.add_variation(move)
-            print(f"Moviment realitzat: {san}")
+            parent = self._current_node
+            self._current_node = parent.add_variation(move)
+            self._journal_move(parent, self._current_node)
+            log.debug("Moviment realitzat: %s", san)
             self.move_made.emit(move, san) # Emet senyal amb el moviment i SAN
             self.check_game_over()
             self.board_changed.emit() # Notifica que el tauler ha canviat
             return True
         else:
-            print(f"Moviment il·legal: {move.uci()}")
+            log.debug("Moviment il·legal: %s", move)
             return False
 
     def check_game_over(self):
@@ -78,7 +110,7 @@ class GameLogic(QObject):
             result = f"Taules per regla (50 mov/repetició) ({self.board.result()})"
 
         if result:
-            print(f"Partida acabada: {result}")
+            log.info("Partida acabada: %s", result)
             self.game_over.emit(result)
 
     def undo_move(self) -> bool:
@@ -92,68 +124,334 @@ class GameLogic(QObject):
                      # Important: Elimina la variació que es va afegir
                     move_to_remove = self._current_node.move
                     parent_node = self._current_node.parent
+                    if self._journal is not None and self._journal.knows(self._current_node.index):
+                        self._journal.record_undo(self._current_node.index)
                     parent_node.remove_variation(move_to_remove)
                     self._current_node = parent_node
-                print("Moviment desfet.")
+                log.debug("Moviment desfet.")
                 self.check_game_over() # L'estat pot canviar
                 self.board_changed.emit()
                 return True
             except IndexError: # Pot passar si l'stack està buit inesperadament
-                print("Error: No es pot desfer el moviment.")
+                log.error("No es pot desfer el moviment.")
                 return False
         else:
-            print("No hi ha moviments per desfer.")
+            log.debug("No hi ha moviments per desfer.")
             return False
 
     # --- Mètodes per PGN (inicials) ---
+    @timed("pgn.load")
     def load_pgn(self, filename: str):
-        """Carrega el primer joc d'un fitxer PGN."""
+        """Carrega el primer joc d'un fitxer PGN (pot estar comprimit: .gz, .bz2, .xz, .zst)."""
         try:
-            with open(filename, 'r') as pgn_file:
-                game = chess.pgn.read_game(pgn_file)
+            with open_pgn(filename) as pgn_file:
+                game = chess.pgn.read_game(pgn_file, Visitor=CompactTreeBuilder)
                 if game:
-                    self._game = game
-                    self.board = self._game.board() # Comença al principi
-                    # Navega fins a la posició inicial si hi ha moviments
-                    for move in self._game.mainline_moves():
-                        self.board.push(move)
-                    # Situa el node actual al final de la línia principal
-                    self._current_node = self._game.end()
-                    # Opcionalment, podries anar al principi per replay:
-                    # self.board = self._game.board()
-                    # self._current_node = self._game
-                    print(f"PGN carregat: {filename}")
-                    self.board_changed.emit()
-                    # Emetre senyals per actualitzar la llista de moviments, etc.
+                    self._set_game(game)
+                    log.info("PGN carregat: %s", filename)
                 else:
-                    print(f"Error: No s'ha pogut llegir cap partida del PGN: {filename}")
+                    log.error("No s'ha pogut llegir cap partida del PGN: %s", filename)
         except FileNotFoundError:
-            print(f"Error: Fitxer PGN no trobat: {filename}")
+            log.error("Fitxer PGN no trobat: %s", filename)
         except Exception as e:
-            print(f"Error en carregar PGN: {e}")
+            log.exception("Error en carregar PGN: %s", e)
+
+    def load_game(self, game: chess.pgn.Game | CompactGameTree):
+        """Carrega una partida ja llegida (per exemple, de la BBDD)."""
+        self.stop_following()
+        if isinstance(game, chess.pgn.Game):
+            game = CompactGameTree.from_game(game)
+        self._set_game(game)
+
+    def _set_game(self, game: CompactGameTree):
+        """Substitueix la partida i situa el tauler al final de la línia principal."""
+        self._game = game
+        self.board = self._game.board() # Comença al principi
+        # Navega fins a la posició final si hi ha moviments
+        for move in self._game.mainline_moves():
+            self.board.push(move)
+        # Situa el node actual al final de la línia principal
+        self._current_node = self._game.end()
+        # Opcionalment, podries anar al principi per replay:
+        # self.board = self._game.board()
+        # self._current_node = self._game.root()
+        self._journal_snapshot()
+        self.game_loaded.emit()
+        self.board_changed.emit()
+
+    # --- Mode seguiment: PGN que es va actualitzant (retransmissions) ---
+    def follow_pgn(self, filename: str, game_index: int | None = None) -> bool:
+        """
+        Segueix un fitxer PGN que es va ampliant o reescrivint.
+        Mostra la partida 'game_index' (None = l'última del fitxer) i, quan el
+        fitxer canvia, només torna a llegir les partides noves o modificades.
+        Si a la partida seguida només s'hi han afegit jugades, s'enganxen a
+        l'arbre actual (senyal moves_appended) en lloc de recarregar-la.
+        """
+        self.stop_following()
+        tail = PgnTail(filename)
+        try:
+            tail.refresh()
+        except OSError as e:
+            log.error("No es pot seguir el PGN %s: %s", filename, e)
+            return False
+        if not len(tail):
+            log.error("No s'ha trobat cap partida per seguir a: %s", filename)
+            return False
+        self._follow_tail = tail
+        self._follow_game_index = game_index
+        self._follow_refreshes = 0
+        self._follow_timer = QTimer(self)
+        self._follow_timer.setSingleShot(True)
+        self._follow_timer.setInterval(self.FOLLOW_DEBOUNCE_MS)
+        self._follow_timer.timeout.connect(self._refresh_follow)
+        self._follow_watcher = QFileSystemWatcher([filename], self)
+        self._follow_watcher.fileChanged.connect(self._on_follow_file_changed)
+        self._load_followed_game()
+        log.info("Seguint PGN: %s (%d partides)", filename, len(tail))
+        return True
+
+    def stop_following(self):
+        """Deixa de seguir el fitxer (la partida carregada es manté)."""
+        if self._follow_watcher is not None:
+            self._follow_watcher.deleteLater()
+            self._follow_timer.stop()
+            self._follow_timer.deleteLater()
+        self._follow_tail = None
+        self._follow_watcher = None
+        self._follow_timer = None
+
+    def is_following(self) -> bool:
+        return self._follow_tail is not None
+
+    def followed_game_count(self) -> int:
+        return len(self._follow_tail) if self._follow_tail else 0
+
+    def set_followed_game(self, game_index: int | None):
+        """Canvia la partida del fitxer que es mostra (None = l'última)."""
+        if self._follow_tail is not None:
+            self._follow_game_index = game_index
+            self._load_followed_game()
+
+    def _followed_index(self) -> int:
+        if self._follow_game_index is None:
+            return len(self._follow_tail) - 1
+        return min(self._follow_game_index, len(self._follow_tail) - 1)
+
+    def _read_followed_game(self) -> CompactGameTree | None:
+        text = self._follow_tail.read_game_text(self._followed_index())
+        return chess.pgn.read_game(io.StringIO(text), Visitor=CompactTreeBuilder)
+
+    def _load_followed_game(self):
+        game = self._read_followed_game()
+        if game is not None:
+            self._set_game(game)
+
+    def _on_follow_file_changed(self, path: str):
+        # Si l'altre programa reemplaça el fitxer (rename), el watcher el perd: el tornem a afegir
+        if path not in self._follow_watcher.files() and os.path.exists(path):
+            self._follow_watcher.addPath(path)
+        self._follow_timer.start() # Debounce: espera que acabi d'escriure
+
+    def _refresh_follow(self):
+        if self._follow_tail is None:
+            return
+        if not os.path.exists(self._follow_tail.filename):
+            self._follow_timer.start() # Encara s'està reescrivint: torna-ho a provar
+            return
+        if self._follow_tail.filename not in self._follow_watcher.files():
+            self._follow_watcher.addPath(self._follow_tail.filename)
+        self._follow_refreshes += 1
+        full = self._follow_refreshes % self.FOLLOW_FULL_CHECK_EVERY == 0
+        previous_index = self._followed_index()
+        changed = self._follow_tail.refresh(full=full)
+        if not changed or not len(self._follow_tail):
+            return
+        self.followed_games_changed.emit(changed)
+        index = self._followed_index()
+        if index != previous_index:
+            self._load_followed_game() # Ha aparegut una partida nova i seguim l'última
+        elif index in changed:
+            self._update_followed_game()
 
+    def _update_followed_game(self):
+        """Aplica els canvis de la partida seguida de forma incremental si és possible."""
+        new_game = self._read_followed_game()
+        if new_game is None:
+            return
+        old_moves = list(self._game.mainline_moves())
+        new_nodes = []
+        node = new_game.root()
+        while not node.is_end():
+            node = node.variation(0)
+            new_nodes.append(node)
+        same_game = all(self._game.headers.get(tag) == new_game.headers.get(tag)
+                        for tag in ("White", "Black", "Round", "Event"))
+        if not same_game or len(new_nodes) < len(old_moves) or \
+                [n.move for n in new_nodes[:len(old_moves)]] != old_moves:
+            self._set_game(new_game) # Ha canviat una altra cosa: recarrega-la sencera
+            return
+        for tag, value in new_game.headers.items():
+            self._game.headers[tag] = value # Resultat, rellotges...
+        if len(new_nodes) == len(old_moves):
+            return
+        end = self._game.end()
+        was_at_end = self._current_node == end
+        board = self.board.copy() if was_at_end else end.board()
+        first_ply = board.ply()
+        sans = []
+        for new_node in new_nodes[len(old_moves):]:
+            sans.append(board.san(new_node.move))
+            board.push(new_node.move)
+            parent, end = end, end.add_variation(new_node.move, comment=new_node.comment, nags=new_node.nags)
+            self._journal_move(parent, end)
+        self.moves_appended.emit(first_ply, sans)
+        if was_at_end: # Si l'usuari mirava el final, l'acompanyem
+            self.board = board
+            self._current_node = end
+            self.board_changed.emit()
+
+    @timed("pgn.save")
     def save_pgn(self, filename: str):
-        """Guarda la partida actual en un fitxer PGN."""
+        """Guarda la partida actual en un fitxer PGN (es comprimeix segons l'extensió)."""
         try:
             # Afegir capçaleres estàndard (pots personalitzar-les)
             self._game.headers["Event"] = "Partida Casual"
             self._game.headers["Site"] = "Aplicació Escacs PySide6"
             # ... altres capçaleres ...
-            with open(filename, 'w') as pgn_file:
+            with open_pgn(filename, 'w') as pgn_file:
                 exporter = chess.pgn.FileExporter(pgn_file)
                 self._game.accept(exporter)
-            print(f"Partida guardada a: {filename}")
+            log.info("Partida guardada a: %s", filename)
+            self._journal_snapshot() # Compacta el diari: ja no cal reproduir-ne els esdeveniments
         except Exception as e:
-            print(f"Error en guardar PGN: {e}")
+            log.exception("Error en guardar PGN: %s", e)
+
+    # --- Diari d'autodesat (veure journal.py) ---
+    def attach_journal(self, journal: MoveJournal, restore: bool = True) -> bool:
+        """
+        Enregistra els canvis de la partida a 'journal'. Si 'restore', abans
+        recupera la partida que hi havia (sessió anterior o fallada).
+        Retorna cert si s'ha recuperat una partida amb jugades.
+        """
+        restored = journal.replay() if restore else None
+        self._journal = journal
+        if restored is None or len(restored[0]) <= 1:
+            self._journal_snapshot()
+            return False
+        tree, current = restored
+        self._set_game(tree) # Torna a compactar el diari
+        node = NodeView(tree, current)
+        self.board = node.board()
+        self._current_node = node
+        self.board_changed.emit()
+        log.info("Sessió recuperada del diari %s (%d jugades)", journal.path, len(tree) - 1)
+        return True
+
+    def close_journal(self, discard: bool = False):
+        """Compacta i tanca el diari (en sortir de l'aplicació); amb 'discard' l'esborra (pestanya tancada)."""
+        if self._journal is not None:
+            if discard:
+                self._journal.discard()
+            else:
+                self._journal_snapshot()
+                self._journal.close()
+            self._journal = None
+
+    def set_comment(self, text: str):
+        """Comentari de la posició actual (després de la jugada que hi porta)."""
+        self._current_node.comment = text
+        if self._journal is not None and self._journal.knows(self._current_node.index):
+            self._journal.record_comment(self._current_node.index, text)
+
+    def _journal_snapshot(self):
+        if self._journal is None:
+            return
+        try:
+            self._journal.start(self._game, self._current_node.index)
+        except OSError as e:
+            log.error("No s'ha pogut escriure el diari %s: %s", self._journal.path, e)
+
+    def _journal_move(self, parent, node):
+        if self._journal is None:
+            return
+        try:
+            if self._journal.knows(parent.index):
+                self._journal.record_move(parent.index, node.index, node.move)
+                if node.comment:
+                    self._journal.record_comment(node.index, node.comment)
+            else: # El pare no és al diari (no hauria de passar): es refà la instantània
+                self._journal_snapshot()
+        except OSError as e:
+            log.error("No s'ha pogut escriure el diari %s: %s", self._journal.path, e)
+
+    # --- Obertura (ECO) de la posició actual ---
+    def current_opening(self) -> Opening | None:
+        """
+        Obertura de la posició actual: la de la taula ECO si la posició hi és,
+        si no la de la posició anterior del camí. Es guarda per node (els índexs
+        de l'arbre no es reutilitzen), així que anar jugada a jugada només fa
+        una consulta O(1) a la taula per ply.
+        """
+        if self._openings_tree is not self._game:
+            self._openings_tree, self._openings = self._game, {0: None} # 0 = arrel
+        node = self._current_node
+        if node.index in self._openings:
+            return self._openings[node.index]
+        table = default_table()
+        parent = node.parent
+        if parent.index in self._openings: # Cas habitual: s'acaba de fer o avançar una jugada
+            opening = self._openings[parent.index]
+            if self.board.ply() <= table.max_ply:
+                opening = table.lookup(self.board) or opening
+            self._openings[node.index] = opening
+            return opening
+        # Salt (go_to_ply, partida nova...): es recorre el camí des de l'últim node conegut
+        path = []
+        while node.index not in self._openings:
+            path.append(node)
+            node = node.parent
+        path.reverse()
+        opening = self._openings[node.index]
+        for child, value in zip(path, iter_hashes(node.board(), [child.move for child in path])):
+            opening = table.positions.get(value, opening)
+            self._openings[child.index] = opening
+        return opening
+
+    def mainline_fens(self) -> list[str]:
+        """FEN de cada posició de la línia principal (la inicial inclosa): índex = ply relatiu."""
+        board = self._game.board()
+        fens = [board.fen()]
+        for move in self._game.mainline_moves():
+            board.push(move)
+            fens.append(board.fen())
+        return fens
+
+    def current_ply(self) -> int:
+        """Mitges jugades des de la posició inicial de la partida fins al node actual (com go_to_ply)."""
+        return self._current_node.ply() - self._game.board().ply()
 
     # --- Mètodes per Replay (inicials) ---
     def go_to_start(self):
         """Va a la posició inicial de la partida carregada."""
         if self._game:
             self.board = self._game.board()
-            self._current_node = self._game
+            self._current_node = self._game.root()
             self.board_changed.emit()
 
+    def go_to_ply(self, ply: int):
+        """Va a la posició després de 'ply' mitges jugades de la línia principal."""
+        node = self._game.root()
+        board = self._game.board()
+        for _ in range(ply):
+            if node.is_end():
+                break
+            node = node.variation(0)
+            board.push(node.move)
+        self.board = board
+        self._current_node = node
+        self.board_changed.emit()
+
     def go_to_end(self):
         """Va a la posició final de la partida carregada."""
         if self._game:
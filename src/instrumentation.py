@@ -0,0 +1,221 @@
+# src/instrumentation.py
+"""
+Instrumentació opcional dels camins calents (tauler, clics, motor, PGN).
+
+Per defecte està DESACTIVADA i el cost és una sola comprovació de booleà per
+crida. S'activa amb la variable d'entorn GEMINI_CHESS_PROFILE=1 o des del
+menú de depuració. Si GEMINI_CHESS_PROFILE_DUMP apunta a un fitxer, en tancar
+l'aplicació s'hi bolquen les mètriques (.json o text Prometheus).
+
+Ús:
+    from instrumentation import metrics, timed
+
+    @timed("game_logic.make_move")
+    def make_move(...): ...
+
+    with metrics.timer("pgn.load"):
+        ...
+    metrics.set_gauge("engine.nps", nps)
+"""
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+
+# Límits dels buckets dels histogrames, en mil·lisegons (escala aproximadament logarítmica)
+DEFAULT_BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100,
+                      250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class Histogram:
+    """Histograma de latències amb buckets fixos (acumula, no guarda mostres)."""
+    __slots__ = ("bounds", "counts", "count", "total", "min", "max")
+
+    def __init__(self, bounds: tuple = DEFAULT_BUCKETS_MS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1) # L'últim és +Inf
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float | None:
+        """Aproximació del quantil q (0..1) pel límit superior del bucket."""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.total, 4),
+            "min": self.min,
+            "max": self.max,
+            "mean": round(self.total / self.count, 4) if self.count else None,
+            "p50": self.quantile(0.50),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip([str(b) for b in self.bounds] + ["+Inf"], self.counts)),
+        }
+
+
+class Metrics:
+    """
+    Registre de mètriques: histogrames de latència, comptadors i valors (gauges).
+    Segur entre fils (el worker del motor hi escriu des del seu QThread).
+    """
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._histograms: dict[str, Histogram] = {}
+        self._counters: dict[str, int] = {}
+        self._gauges: dict[str, float] = {}
+
+    def observe(self, name: str, value_ms: float):
+        """Afegeix una mostra (en ms) a l'histograma 'name'."""
+        if not self.enabled:
+            return
+        with self._lock:
+            hist = self._histograms.get(name)
+            if hist is None:
+                hist = self._histograms[name] = Histogram()
+            hist.observe(value_ms)
+
+    def inc(self, name: str, amount: int = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def set_gauge(self, name: str, value: float):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[name] = value
+
+    def timer(self, name: str):
+        """Context manager que mesura el bloc i ho registra a 'name'."""
+        return _Timer(self, name)
+
+    def timed(self, name: str):
+        """Decorador: mesura cada crida a la funció (si la instrumentació és activa)."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(name, (time.perf_counter() - start) * 1000.0)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._gauges.clear()
+
+    # --- Exportació ---
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "histograms_ms": {k: h.to_dict() for k, h in sorted(self._histograms.items())},
+                "counters": dict(sorted(self._counters.items())),
+                "gauges": dict(sorted(self._gauges.items())),
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, prefix: str = "gemini_chess") -> str:
+        """Format d'exposició de text de Prometheus (latències en segons)."""
+        snap = self.snapshot()
+        out = []
+        for name, h in snap["histograms_ms"].items():
+            metric = f"{prefix}_{_prom_name(name)}_seconds"
+            out.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, n in h["buckets"].items():
+                cumulative += n
+                le = bound if bound == "+Inf" else repr(float(bound) / 1000.0)
+                out.append(f'{metric}_bucket{{le="{le}"}} {cumulative}')
+            out.append(f"{metric}_sum {h['sum'] / 1000.0}")
+            out.append(f"{metric}_count {h['count']}")
+        for name, value in snap["counters"].items():
+            metric = f"{prefix}_{_prom_name(name)}_total"
+            out.append(f"# TYPE {metric} counter")
+            out.append(f"{metric} {value}")
+        for name, value in snap["gauges"].items():
+            metric = f"{prefix}_{_prom_name(name)}"
+            out.append(f"# TYPE {metric} gauge")
+            out.append(f"{metric} {value}")
+        return "\n".join(out) + "\n"
+
+    def dump(self, filename: str):
+        """Desa les mètriques: JSON si el fitxer acaba en .json, sinó text Prometheus."""
+        text = self.to_json() if filename.lower().endswith(".json") else self.to_prometheus()
+        with open(filename, 'w') as f:
+            f.write(text)
+
+    def summary_text(self) -> str:
+        """Resum llegible per al panell de depuració."""
+        snap = self.snapshot()
+        lines = [f"{'mètrica':<32}{'n':>7}{'mitjana':>10}{'p95':>9}{'màx':>9}  (ms)"]
+        for name, h in snap["histograms_ms"].items():
+            lines.append(f"{name:<32}{h['count']:>7}{h['mean'] or 0:>10.2f}"
+                         f"{h['p95'] or 0:>9.2f}{h['max'] or 0:>9.2f}")
+        if snap["gauges"]:
+            lines.append("")
+            lines.extend(f"{name:<32}{value:>12g}" for name, value in snap["gauges"].items())
+        if snap["counters"]:
+            lines.append("")
+            lines.extend(f"{name:<32}{value:>12}" for name, value in snap["counters"].items())
+        return "\n".join(lines)
+
+
+class _Timer:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics: Metrics, name: str):
+        self.metrics = metrics
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        if self.metrics.enabled:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.metrics.enabled and self.start:
+            self.metrics.observe(self.name, (time.perf_counter() - self.start) * 1000.0)
+        return False
+
+
+def _prom_name(name: str) -> str:
+    return "".join(c if c.isalnum() else "_" for c in name)
+
+
+# Registre global de l'aplicació
+metrics = Metrics(enabled=os.environ.get("GEMINI_CHESS_PROFILE", "") not in ("", "0"))
+timed = metrics.timed
@@ -0,0 +1,244 @@
+# src/journal.py
+"""
+Diari (journal) de la partida en curs: autodesat i recuperació de sessió.
+
+En lloc de reescriure tot el PGN a cada canvi, cada esdeveniment (jugada,
+desfer, comentari) s'afegeix com una línia JSON al final del fitxer:
+
+    {"e": "base", ...}                 instantània de l'arbre (sempre la primera línia)
+    {"e": "move", "p": 3, "m": "e2e4"} jugada nova des del node 3 del diari
+    {"e": "undo", "n": 7}              s'ha esborrat el node 7 (i el seu subarbre)
+    {"e": "comment", "n": 7, "t": ""}  comentari del node 7
+
+Cost per jugada O(1): una línia i un write(). El flush es fa a cada
+esdeveniment (sobreviu a una fallada del programa) i l'fsync per lots de
+SYNC_EVERY esdeveniments o SYNC_INTERVAL segons (una fallada del sistema
+pot perdre, com a màxim, l'últim lot).
+
+start() compacta: reescriu el fitxer (temporal + os.replace, atòmic) amb
+una sola línia "base". Es fa en carregar una partida, en desar-la i en
+tancar. Els nodes del diari es numeren en l'ordre de la instantània i
+després en ordre de creació; el mapa índex de l'arbre -> node del diari
+permet referenciar-los sense guardar camins.
+
+replay() reconstrueix la partida; una última línia tallada (fallada a
+mig escriure) s'ignora.
+
+El diari és de l'usuari (app_paths.data_dir), no del repositori. Cada
+pestanya de cada instància de l'aplicació en fa servir un de propi
+(for_instance): session.journal, session-2.journal... protegit amb un
+QLockFile mentre està obert. En obrir l'aplicació, recover_all() torna els
+diaris amb partida que no té cap altra instància (de la sessió anterior o
+d'un procés que ha petat): una pestanya per cada un. Tancar una pestanya
+esborra el seu diari (discard).
+"""
+import json
+import logging
+import os
+import time
+from collections import deque
+import chess
+import chess.pgn
+from PySide6.QtCore import QLockFile
+from compact_tree import CompactGameTree, NodeView
+from app_paths import data_dir
+
+log = logging.getLogger(__name__)
+
+JOURNAL_NAME = "session.journal"
+MAX_INSTANCES = 16 # Diaris per instàncies obertes alhora
+SYNC_EVERY = 16
+SYNC_INTERVAL = 1.0 # segons
+
+
+class MoveJournal:
+    """Diari append-only d'una partida (CompactGameTree)."""
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = None # QLockFile (veure for_instance)
+        self._file = None
+        self._ids = {} # índex de l'arbre -> node del diari
+        self._next_id = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    @staticmethod
+    def _candidates(path: str | None):
+        path = path or os.environ.get("GEMINI_CHESS_JOURNAL") or os.path.join(data_dir(), JOURNAL_NAME)
+        root, extension = os.path.splitext(path)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        for number in range(1, MAX_INSTANCES + 1):
+            yield path if number == 1 else f"{root}-{number}{extension}"
+
+    @classmethod
+    def _locked(cls, candidate: str) -> "MoveJournal | None":
+        lock = QLockFile(candidate + ".lock")
+        lock.setStaleLockTime(0) # Només és vell si el procés que el té ja no existeix
+        if not lock.tryLock(0):
+            return None
+        journal = cls(candidate)
+        journal._lock = lock
+        return journal
+
+    @classmethod
+    def recover_all(cls, path: str | None = None) -> list["MoveJournal"]:
+        """Diaris lliures (cap altra instància els té) amb alguna jugada, ja bloquejats."""
+        journals = []
+        for candidate in cls._candidates(path):
+            if not os.path.exists(candidate):
+                continue
+            journal = cls._locked(candidate)
+            if journal is None:
+                continue
+            restored = journal.replay()
+            if restored is not None and len(restored[0]) > 1:
+                journals.append(journal)
+            else: # Buit: el farà servir qualsevol pestanya nova
+                journal.close()
+        return journals
+
+    @classmethod
+    def for_instance(cls, path: str | None = None) -> "MoveJournal | None":
+        """
+        Diari per una pestanya: 'path' (per defecte GEMINI_CHESS_JOURNAL o
+        session.journal al directori de dades de l'usuari) o, si una altra
+        pestanya o instància el té obert, el primer lliure de path-2, path-3...
+        None si n'hi ha MAX_INSTANCES d'ocupats.
+        """
+        for candidate in cls._candidates(path):
+            journal = cls._locked(candidate)
+            if journal is not None:
+                return journal
+        log.warning("Tots els diaris de sessió estan oberts (per altres pestanyes o instàncies)")
+        return None
+
+    # --- Escriptura ---
+    def start(self, tree: CompactGameTree, current: int = 0):
+        """Compacta: el diari passa a ser només la instantània de 'tree'."""
+        self._ids = {0: 0}
+        nodes, comments, starting_comments, nags = [], {}, {}, {}
+        queue = deque([0])
+        while queue: # Pares abans que fills i germans en ordre: add_node els tornarà a posar igual
+            index = queue.popleft()
+            node = NodeView(tree, index)
+            journal_id = self._ids[index]
+            if node.comment:
+                comments[journal_id] = node.comment
+            if node.starting_comment:
+                starting_comments[journal_id] = node.starting_comment
+            if tree._nags.get(index):
+                nags[journal_id] = sorted(tree._nags[index])
+            for child in tree.children(index):
+                self._ids[child] = len(self._ids)
+                nodes.append((journal_id, tree.move_at(child).uci()))
+                queue.append(child)
+        self._next_id = len(self._ids)
+        record = {"e": "base", "headers": dict(tree.headers), "nodes": nodes, "comments": comments,
+                  "starting_comments": starting_comments, "nags": nags, "current": self._ids.get(current, 0)}
+        self._close_file()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temporary = self.path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def knows(self, index: int) -> bool:
+        return index in self._ids
+
+    def record_move(self, parent: int, index: int, move: chess.Move):
+        journal_id = self._next_id
+        self._next_id += 1
+        self._append({"e": "move", "p": self._ids[parent], "m": move.uci()})
+        self._ids[index] = journal_id
+
+    def record_undo(self, index: int):
+        self._append({"e": "undo", "n": self._ids.pop(index)})
+
+    def record_comment(self, index: int, text: str):
+        self._append({"e": "comment", "n": self._ids[index], "t": text})
+
+    def _append(self, record: dict):
+        if self._file is None:
+            return
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush() # Al sistema operatiu: sobreviu a una fallada del programa
+        self._unsynced += 1
+        if self._unsynced >= SYNC_EVERY or time.monotonic() - self._last_sync >= SYNC_INTERVAL:
+            self.sync()
+
+    def sync(self):
+        """fsync dels esdeveniments pendents (fins aquí, a prova de fallades del sistema)."""
+        if self._file is not None and self._unsynced:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+            self._last_sync = time.monotonic()
+
+    def _close_file(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        """Tanca el fitxer i deixa el diari lliure per una altra instància."""
+        self._close_file()
+        if self._lock is not None:
+            self._lock.unlock()
+            self._lock = None
+
+    def discard(self):
+        """Tanca i esborra el diari (la pestanya s'ha tancat: no s'ha de recuperar)."""
+        self._close_file()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.close()
+
+    # --- Lectura ---
+    def replay(self) -> tuple[CompactGameTree, int] | None:
+        """(partida, índex del node actual) desats al diari, o None si no n'hi ha."""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                lines = f.read().split("\n")
+        except FileNotFoundError:
+            return None
+        tree, current, index_of = None, 0, {}
+        for number, line in enumerate(lines, 1):
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                log.warning("Diari %s: línia %d incompleta, s'ignora la resta", self.path, number)
+                break
+            kind = record.get("e")
+            if kind == "base":
+                tree = CompactGameTree(chess.pgn.Headers(record["headers"]))
+                index_of = {0: 0}
+                for parent, uci in record["nodes"]:
+                    index_of[len(index_of)] = tree.add_node(index_of[parent], chess.Move.from_uci(uci))
+                for journal_id, text in record["comments"].items():
+                    NodeView(tree, index_of[int(journal_id)]).comment = text
+                for journal_id, text in record["starting_comments"].items():
+                    NodeView(tree, index_of[int(journal_id)]).starting_comment = text
+                for journal_id, values in record["nags"].items():
+                    tree._nags[index_of[int(journal_id)]] = set(values)
+                next_id = len(index_of)
+                current = index_of.get(record["current"], 0)
+            elif tree is None:
+                break
+            elif kind == "move":
+                current = tree.add_node(index_of[record["p"]], chess.Move.from_uci(record["m"]))
+                index_of[next_id] = current
+                next_id += 1
+            elif kind == "undo":
+                removed = index_of.pop(record["n"])
+                current = tree._parent[removed]
+                tree.remove_node(removed)
+            elif kind == "comment":
+                NodeView(tree, index_of[record["n"]]).comment = record["t"]
+        return (tree, current) if tree is not None else None
@@ -0,0 +1,92 @@
+# src/log_setup.py
+"""
+Configuració del registre (logging) de l'aplicació.
+
+Cada mòdul fa servir el seu logger (logging.getLogger(__name__)) amb format
+mandrós ("%s"), així que si el nivell no està actiu la crida no formata res.
+Tota l'escriptura (consola i fitxer) la fa un QueueListener en un fil propi:
+els camins calents només posen el registre a una cua.
+
+Variables d'entorn:
+    GEMINI_CHESS_LOG_LEVEL  Nivell global (per defecte WARNING)
+    GEMINI_CHESS_LOG        Nivells per mòdul, ex: "engine_manager=DEBUG,main=INFO"
+    GEMINI_CHESS_LOG_FILE   Fitxer on també s'escriu el registre (rotatiu)
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+CONSOLE_FORMAT = "%(levelname)-7s %(name)s: %(message)s"
+
+_listener = None
+
+
+def parse_module_levels(spec: str) -> dict[str, int]:
+    """Converteix "mod=NIVELL,mod2=NIVELL" en un diccionari {mòdul: nivell}."""
+    levels = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, level = item.split("=", 1)
+        level_value = logging.getLevelName(level.strip().upper())
+        if isinstance(level_value, int):
+            levels[name.strip()] = level_value
+    return levels
+
+
+def setup_logging(level: str | int | None = None,
+                  module_levels: dict[str, int] | None = None,
+                  log_file: str | None = None) -> None:
+    """
+    Configura el logger arrel amb un QueueHandler i arrenca el QueueListener
+    que escriu a consola i, opcionalment, a fitxer. Es pot cridar més d'un cop.
+    """
+    global _listener
+    if level is None:
+        level = os.environ.get("GEMINI_CHESS_LOG_LEVEL", "WARNING")
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+        if not isinstance(level, int):
+            level = logging.WARNING
+    if module_levels is None:
+        module_levels = parse_module_levels(os.environ.get("GEMINI_CHESS_LOG", ""))
+    if log_file is None:
+        log_file = os.environ.get("GEMINI_CHESS_LOG_FILE")
+
+    shutdown_logging() # Si ja hi havia un listener, l'atura abans de reconfigurar
+
+    handlers = []
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+    handlers.append(console)
+    if log_file:
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=5 * 1024 * 1024, backupCount=3, encoding="utf-8")
+        file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        handlers.append(file_handler)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+    for name, module_level in module_levels.items():
+        logging.getLogger(name).setLevel(module_level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """Buida la cua i atura el fil d'escriptura."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
@@ -1,23 +1,43 @@
 # main_window.py
 import sys
 import os # <<-- Necessari per construir camins (paths)
+import logging
 import chess # <<-- Necessari per la lògica del joc
+from typing import NamedTuple
+from collections import OrderedDict
 
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QFileDialog,
-    QPushButton, QTextEdit, QLabel, QSplitter, QSizePolicy, QMessageBox # Afegit QMessageBox per a errors
+    QPushButton, QTextEdit, QLabel, QSplitter, QSizePolicy, QMessageBox, QLineEdit, QTabBar # Afegit QMessageBox per a errors
 )
-from PySide6.QtGui import QIcon, QColor, QPainter, QAction
+from PySide6.QtGui import QIcon, QColor, QPainter, QAction, QTextCursor, QKeySequence
 from PySide6.QtCore import (Qt, QSize, Slot, QThread, Signal, QObject,
-                            QMetaObject, Q_ARG)
+                            QMetaObject, Q_ARG, QTimer)
 
 from helpers import *
 from chessboard_widget import ChessboardWidget, SQUARE_SIZE
-from engine_manager import ChessEngine
+from engine_manager import ChessEngine, AnalysisCache, create_engine, DEFAULT_ANALYSIS_SERVER
+from engine_profiles import EngineProfiles
+from instrumentation import metrics, timed
+from metrics_dock import MetricsDock
+from log_setup import setup_logging
+from pgn_io import PGN_FILE_FILTER
+from game_logic import GameLogic
+from game_list import GameListModel, GameListView
+from db_manager import GameDatabase, DEFAULT_DB
+from pgn_importer import PgnImporter
+from position_search import PositionIndex, PositionQuery
+from similarity import SimilarityIndex, update_indexes
+from journal import MoveJournal
+from eval_graph import EvalGraph, GameEvaluator
+from board_render import BoardRenderer, ThumbnailCache, THUMBNAIL_SQUARE
+from sounds import MoveSounds, sound_for_san
+
+log = logging.getLogger("main") # Nom fix: executat com a script seria "__main__"
 
 path_to_stockfish = "../engines/stockfish-ubuntu-x86-64-sse41-popcnt" # <<-- Actualitza el camí al teu Stockfish
 
-# per control·lar el DEBUG i les sortides print
+# per control·lar el DEBUG de recursos (la resta de sortides van pel logging, veure log_setup.py)
 debug = "cap"
 
 # Defineix els colors fora de les funcions per reutilitzar-los fàcilment
@@ -60,46 +80,263 @@ if debug == "peces":
 
 # main.py (després de les importacions, abans de MainWindow)
 
+EVAL_GRAPH_THREADS = 1 # Motor del gràfic d'avaluació (es descompten del perfil interactiu)
+
+
 class StockfishWorker(QObject):
     """
     Objecte Worker que s'executarà en un fil separat per a l'anàlisi de Stockfish.
+    Mentre l'usuari pensa, aprofita el temps mort per preanalitzar (ponder) la
+    posició després de la millor jugada i la resposta esperada (PV[0], PV[1]) i,
+    després, les posicions després de les altres jugades candidates. Si la
+    partida arriba a una d'aquestes posicions, el resultat surt de la memòria
+    cau a l'instant.
     """
-    # Senyal emès quan l'anàlisi està llesta. Passa un diccionari o None.
-    analysis_ready = Signal(object) # 'object' pot ser dict o None
+    # Senyal emès quan l'anàlisi està llesta. Passa l'índex del motor i una llista o None.
+    analysis_ready = Signal(int, object) # 'object' pot ser list o None
 
-    def __init__(self, engine: ChessEngine):
+    PONDERED_KEYS = 256 # Posicions preanalitzades que es recorden per comptar els encerts
+
+    def __init__(self, engine: ChessEngine, cache: AnalysisCache | None = None, index: int = 0):
         super().__init__()
         self.engine = engine
+        self.index = index # Posició del motor a MainWindow.engine_slots
+        self.cache = cache if cache is not None else AnalysisCache()
         self._is_running = True
         # Pots configurar valors per defecte aquí si vols
         self.default_depth = 15
         self.default_multipv = 1 # Comença mostrant només la millor línia
+        # --- Ponder / anàlisi especulativa ---
+        self.ponder_enabled = True
+        self.ponder_replies = 3 # Jugades candidates a preanalitzar
+        self.ponder_scan_depth = 8 # Profunditat de la cerca ràpida de candidates
+        self._ponder_queue = [] # (tipus, FEN) pendents: "analyse" la posició o "scan" per trobar més candidates
+        self._ponder_params = (self.default_depth, self.default_multipv)
+        self._pondered = OrderedDict() # Claus de les posicions que ha preanalitzat aquest worker
+        self._paused = False # Mentre es calibra el motor: els nuclis han d'estar lliures
 
     # Modifica la signatura per acceptar multipv i usar els mètodes correctes
     @Slot(str, int, int) # Rep fen, depth, num_lines
+    @timed("worker.run_analysis")
     def run_analysis(self, fen: str, depth: int | None, num_lines: int | None):
         """Mètode principal que executa el càlcul en el fil del worker."""
-        if not self._is_running:
+        if not self._is_running or self._paused:
              return
 
         current_depth = depth if depth is not None else self.default_depth
         current_multipv = num_lines if num_lines is not None else self.default_multipv
 
-        print(f"Worker: Analitzant FEN {fen} amb depth={current_depth}, MultiPV={current_multipv}")
+        # Arriba una posició real: l'especulació pendent ja no serveix
+        self._ponder_queue.clear()
 
-        # Crida al NOU mètode de l'engine
-        analysis_result = self.engine.get_analysis(fen, current_depth, current_multipv)
+        analysis_result = self.cache.get(fen, current_depth, current_multipv)
+        if analysis_result is not None:
+            if self._pondered.pop(AnalysisCache.position_key(fen), None) is not None:
+                # Equivalent al 'ponderhit': l'havíem calculada mentre l'usuari pensava
+                metrics.inc("worker.ponder_hits")
+                log.debug("Worker: Posició ja analitzada (ponder hit) %s", fen)
+            else:
+                metrics.inc("worker.cache_hits")
+        else:
+            log.debug("Worker: Analitzant FEN %s amb depth=%d, MultiPV=%d", fen, current_depth, current_multipv)
+            # Crida al NOU mètode de l'engine
+            analysis_result = self.engine.get_analysis(fen, current_depth, current_multipv)
+            if analysis_result is not None:
+                self.cache.put(fen, current_depth, current_multipv, analysis_result)
 
         # Emet el senyal AMB el resultat (llista de diccionaris o None)
-        self.analysis_ready.emit(analysis_result)
+        self.analysis_ready.emit(self.index, analysis_result)
+
+        if analysis_result and self.ponder_enabled:
+            self._schedule_ponder(fen, analysis_result, current_depth, current_multipv)
+
+    def _schedule_ponder(self, fen: str, analysis_result: list, depth: int, num_lines: int):
+        """
+        Prepara la cua de posicions a preanalitzar: primer la de després de la
+        millor jugada i la resposta esperada (PV[0], PV[1]), després les de
+        després de cada jugada candidata. Si hi ha menys candidates que
+        ponder_replies, al final hi va una cerca ràpida per trobar-ne més
+        (un pas més de la cua, no bloqueja cap petició real).
+        """
+        board = chess.Board(fen)
+        self._ponder_queue = []
+        pv = analysis_result[0].get('PV') or []
+        if len(pv) >= 2:
+            try:
+                board.push(board.parse_uci(pv[0]))
+                board.push(board.parse_uci(pv[1]))
+            except ValueError:
+                pass
+            else:
+                if not board.is_game_over():
+                    self._ponder_queue.append(("analyse", board.fen()))
+            board = chess.Board(fen)
+        candidates = [line.get('Move') for line in analysis_result if line.get('Move')]
+        self._queue_candidates(board, candidates[:self.ponder_replies])
+        if len(candidates) < self.ponder_replies:
+            self._ponder_queue.append(("scan", fen))
+        self._ponder_params = (depth, num_lines)
+        if self._ponder_queue:
+            # Un pas per event: una petició real espera com a màxim una cerca
+            QTimer.singleShot(0, self._ponder_step)
+
+    def _queue_candidates(self, board: chess.Board, moves: list):
+        """Afegeix a la cua les posicions després de cada jugada (UCI) que no hi siguin ja."""
+        queued = {fen for kind, fen in self._ponder_queue}
+        for move_uci in moves:
+            try:
+                move = chess.Move.from_uci(move_uci)
+            except ValueError:
+                continue
+            if move not in board.legal_moves:
+                continue
+            board.push(move)
+            if not board.is_game_over() and board.fen() not in queued:
+                self._ponder_queue.append(("analyse", board.fen()))
+            board.pop()
+
+    @Slot()
+    def _ponder_step(self):
+        """Fa un pas de la cua (una cerca) i torna a programar-se."""
+        if not self._is_running or not self._ponder_queue:
+            return
+        depth, num_lines = self._ponder_params
+        kind, fen = self._ponder_queue.pop(0)
+        if kind == "scan":
+            quick = self.engine.get_analysis(fen, self.ponder_scan_depth, self.ponder_replies) or []
+            self._queue_candidates(chess.Board(fen), [line.get('Move') for line in quick if line.get('Move')])
+        elif self.cache.get(fen, depth, num_lines) is None:
+            result = self.engine.get_analysis(fen, depth, num_lines)
+            if result is not None:
+                self.cache.put(fen, depth, num_lines, result)
+                self._pondered[AnalysisCache.position_key(fen)] = True
+                while len(self._pondered) > self.PONDERED_KEYS:
+                    self._pondered.popitem(last=False)
+        if self._ponder_queue:
+            QTimer.singleShot(0, self._ponder_step)
+
+    @Slot(bool)
+    def set_paused(self, paused: bool):
+        """En pausa no analitza ni preanalitza res (les peticions es descarten)."""
+        self._paused = paused
+        if paused:
+            self._ponder_queue.clear()
+
+    @Slot(int, object)
+    def set_engine_parameters(self, index: int, params: dict):
+        """Canvia Threads, Hash... entre dues cerques (s'executa al fil del worker)."""
+        if index == self.index:
+            self.engine.set_parameters(params)
 
+    @Slot()
     def stop(self):
         """Indica al worker que s'aturi."""
         self._is_running = False
+        self._ponder_queue.clear()
+
+
+class EngineSlot(NamedTuple):
+    """Un motor d'anàlisi del panell, amb el seu worker i el seu fil."""
+    name: str
+    engine: object # ChessEngine o UCIMotor
+    worker: StockfishWorker
+    thread: QThread
+
+
+class GameTab:
+    """
+    Estat d'una pestanya: la seva partida (GameLogic) i la BBDD oberta amb la
+    cerca. El tauler, els motors i la memòria cau d'anàlisi són de la finestra
+    i només treballen per la pestanya activa: les altres no tenen cap ítem a
+    l'escena ni demanen anàlisi, només guarden l'estat de la partida.
+    """
+    def __init__(self, game_logic: GameLogic):
+        self.game_logic = game_logic
+        self.database = None # GameDatabase d'aquesta pestanya
+        self.position_index = None
+        self.similarity_index = None
+        self.position_hits = {} # id de partida -> ply de la posició trobada
+        self.thumbnails = None # ThumbnailCache de la BBDD
+        self.search_text = ""
+
+    def title(self) -> str:
+        game = self.game_logic._game
+        white, black = game.headers.get("White", "?"), game.headers.get("Black", "?")
+        if len(game) > 1 and (white, black) != ("?", "?"):
+            return f"{white} - {black}"
+        if self.database is not None:
+            return os.path.basename(self.database.path)
+        return "Partida nova"
+
+
+class CalibrationWorker(QObject):
+    """EngineProfiles.calibrate() en un fil: mesura els nps durant uns quants segons."""
+    progress = Signal(int, int) # mesures fetes, total
+    finished = Signal(object, str) # {fils: nps} (None si ha fallat), error
+
+    def __init__(self, profiles: EngineProfiles, engine_path: str):
+        super().__init__()
+        self.profiles = profiles
+        self.engine_path = engine_path
+
+    @Slot()
+    def run(self):
+        try:
+            results = self.profiles.calibrate(self.engine_path, self.progress.emit)
+        except Exception as e:
+            log.exception("Error calibrant el motor")
+            self.finished.emit(None, str(e))
+            return
+        self.finished.emit(results, "")
+
+
+class SearchIndexWorker(QObject):
+    """
+    Afegeix les partides noves d'una BBDD als índexs de cerca de posicions en
+    un fil propi (amb una connexió pròpia a la BBDD): en una BBDD gran pot
+    trigar minuts i la interfície ha de continuar responent.
+    """
+    progress = Signal(int, int) # partides indexades, partides noves
+    finished = Signal(object, object, str) # PositionIndex, SimilarityIndex (None si ha fallat), error
+
+    def __init__(self, db_path: str, positions: PositionIndex | None = None, similarity: SimilarityIndex | None = None):
+        super().__init__()
+        self.db_path = db_path
+        self.positions = positions
+        self.similarity = similarity
+        self._cancelled = False
+
+    def cancel(self):
+        """Para després del lot en curs (el que s'ha fet queda desat)."""
+        self._cancelled = True
+
+    def _progress(self, done: int, total: int):
+        if self._cancelled:
+            raise InterruptedError("Indexació cancel·lada")
+        self.progress.emit(done, total)
+
+    @Slot()
+    def run(self):
+        try:
+            with GameDatabase(self.db_path) as db:
+                positions, similarity = update_indexes(db, self.positions, self.similarity, self._progress)
+        except (RuntimeError, InterruptedError) as e: # Sense NumPy, o tancant l'aplicació
+            self.finished.emit(None, None, str(e))
+            return
+        except Exception as e:
+            log.exception("Error indexant les posicions de %s", self.db_path)
+            self.finished.emit(None, None, str(e))
+            return
+        self.finished.emit(positions, similarity, "")
 
 
 # --- Main Application Window ---
 class MainWindow(QMainWindow):
+    # Paràmetres nous per un motor (índex, dict): connectat als workers (s'apliquen al seu fil, entre cerques)
+    engine_parameters_changed = Signal(int, object)
+    # Nova partida pel gràfic d'avaluació (generació, FENs de la línia principal): connectat al GameEvaluator
+    eval_graph_requested = Signal(int, list)
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Aplicació d'Escacs (PySide6)")
@@ -129,8 +366,11 @@ class MainWindow(QMainWindow):
          # --- Configuració Stockfish ---
         self.path_to_stockfish = os.path.join(BASE_DIR, "..", "assets", "engines", "stockfish-ubuntu-x86-64-sse41-popcnt") # AJUSTA CAMÍ
         self.stockfish_active = False # Comença desactivat
+        self.engine_profiles = EngineProfiles() # Threads i Hash segons la màquina (profiles.json al directori de configuració)
         try:
-            self.engine = ChessEngine(self.path_to_stockfish)
+            # Amb GEMINI_CHESS_ANALYSIS_SERVER el motor principal és el del servidor d'anàlisi compartit
+            self.engine = create_engine(self.path_to_stockfish, self.engine_profiles.options("interactive"),
+                                        server=DEFAULT_ANALYSIS_SERVER)
         except FileNotFoundError:
             QMessageBox.critical(self, "Error Stockfish",
                                  f"No s'ha trobat el motor Stockfish a:\n{self.path_to_stockfish}\n"
@@ -143,38 +383,168 @@ class MainWindow(QMainWindow):
         # <<-- Lògica del Joc (Estat) -->>
         self.board = chess.Board()  # Instància del tauler de python-chess
         self.selected_square = None # Per guardar la casella seleccionada
+        # Partida i BBDD de la pestanya activa: en canviar de pestanya es desen al seu GameTab (veure _activate_tab)
+        self.current_tab = None
+        self.game_logic = None # Partida carregada (PGN, seguiment en directe)
+        self.database = None # GameDatabase oberta (menú Obrir BBDD)
+        self.position_index = None # Índex de posicions de la BBDD (es crea en la primera cerca)
+        self._position_hits = {} # id de partida -> ply de la posició trobada
+        self.similarity_index = None # Claus de peons i LSH sobre l'índex de posicions
+        self._index_job = None # (fil, SearchIndexWorker, pestanya, BBDD) de la indexació en curs
+        self._calibration_job = None # (fil, CalibrationWorker) mentre es calibra el motor
+        self._pending_search = None # (mode, FEN) de la cerca que espera l'índex
 
         # --- Configuració del Threading per Stockfish ---
         self.stockfish_thread = None
         self.stockfish_worker = None
+        self.analysis_cache = AnalysisCache() # Compartida per l'anàlisi i el ponder
+        self.engine_slots = [] # Motors que analitzen alhora; el 0 és self.engine
+        self._engine_texts = {} # índex del motor -> text de la seva última anàlisi
+        # Gràfic d'avaluació: un altre motor (d'un fil) que l'omple en segon pla (veure _setup_eval_graph)
+        self.eval_thread = None
+        self.eval_worker = None
+        self._eval_generation = 0
         if self.engine: # Només crea el fil si el motor s'ha inicialitzat bé
              self._setup_stockfish_thread()
+             for config in self.engine_profiles.engines():
+                 self._start_extra_engine(config)
+             self._apply_engine_budgets()
         
 
+        # Sons de les jugades: es carreguen quan la finestra ja es veu
+        self.sounds = MoveSounds(parent=self)
+        QTimer.singleShot(0, self.sounds.preload)
+
         self._setup_ui()
-        self._update_board_display() # Dibuixa l'estat inicial
-        self._update_pgn_display() # Mostra info inicial del PGN
+        if self.engine:
+             self._setup_eval_graph()
+        # Autodesat: cada pestanya té el seu diari; en obrir es recuperen totes les partides de la sessió anterior
+        recovered = MoveJournal.recover_all()
+        for journal in recovered:
+            self._add_tab(journal)
+        if recovered:
+            self.tab_bar.setCurrentIndex(0)
+            self.statusBar().showMessage("S'ha recuperat la partida de la sessió anterior" if len(recovered) == 1 else
+                                         f"S'han recuperat {len(recovered)} partides de la sessió anterior", 5000)
+        else:
+            self.new_tab() # Connecta la partida i dibuixa l'estat inicial
         self._update_engine_display_status() # Mostra estat inicial motor
 
 
     def _setup_stockfish_thread(self):
          """Configura el fil i el worker per a l'anàlisi de Stockfish."""
-         self.stockfish_thread = QThread()
-         self.stockfish_worker = StockfishWorker(self.engine)
-         self.stockfish_worker.moveToThread(self.stockfish_thread)
+         slot = self._start_engine_slot("Stockfish", self.engine, self.analysis_cache)
+         self.stockfish_thread, self.stockfish_worker = slot.thread, slot.worker
+         log.info("Fil de Stockfish iniciat.")
+
+    def _start_engine_slot(self, name: str, engine, cache: AnalysisCache) -> EngineSlot:
+         """Un fil i un worker propis per cada motor: cap cerca bloqueja les altres ni la interfície."""
+         thread = QThread()
+         worker = StockfishWorker(engine, cache, index=len(self.engine_slots))
+         worker.moveToThread(thread)
+         worker.analysis_ready.connect(self._display_stockfish_result)
+         self.engine_parameters_changed.connect(worker.set_engine_parameters)
+         # Comença el fil (estarà esperant senyals per executar run_analysis)
+         thread.start()
+         slot = EngineSlot(name, engine, worker, thread)
+         self.engine_slots.append(slot)
+         return slot
+
+    def _start_extra_engine(self, config: dict) -> bool:
+         """Motor addicional de la configuració ({"name", "path", "options"}); cada un té la seva memòria cau."""
+         try:
+              engine = create_engine(config["path"], config.get("options") or None)
+         except Exception as e:
+              log.warning("No s'ha pogut iniciar el motor %s (%s): %s", config.get("name"), config.get("path"), e)
+              return False
+         slot = self._start_engine_slot(config["name"], engine, AnalysisCache())
+         slot.worker.ponder_enabled = False # El ponder és per l'anàlisi principal: no treu CPU als altres
+         return True
+
+    def _setup_eval_graph(self):
+         """Motor i fil del gràfic d'avaluació; comparteix la memòria cau amb l'anàlisi."""
+         try:
+              engine = create_engine(self.path_to_stockfish, {"Threads": EVAL_GRAPH_THREADS, "Hash": 64},
+                                     server=DEFAULT_ANALYSIS_SERVER)
+         except Exception as e:
+              log.warning("Sense motor pel gràfic d'avaluació: %s", e)
+              return
+         self.eval_thread = QThread()
+         self.eval_worker = GameEvaluator(engine, self.analysis_cache)
+         self.eval_worker.moveToThread(self.eval_thread)
+         self.eval_worker.evaluated.connect(self._on_ply_evaluated)
+         self.eval_graph_requested.connect(self.eval_worker.start)
+         self.eval_thread.start()
+         self._apply_engine_budgets() # Els seus fils es descompten dels de l'anàlisi
+
+    @Slot()
+    def _refresh_eval_graph(self, keep_scores: bool = False):
+         """Torna a avaluar la línia principal (les posicions ja avaluades surten de la memòria cau)."""
+         if self.eval_worker is None or not self.action_eval_graph.isChecked():
+              return
+         fens = self.game_logic.mainline_fens()
+         self._eval_generation += 1
+         self.eval_graph.set_length(len(fens), keep_scores)
+         self.eval_graph.set_current_ply(self.game_logic.current_ply())
+         self.eval_graph_requested.emit(self._eval_generation, fens)
+
+    @Slot(int, int, int, int)
+    def _on_ply_evaluated(self, generation: int, ply: int, score: int, depth: int):
+         if generation == self._eval_generation: # Els d'una partida anterior ja no serveixen
+              self.eval_graph.set_score(ply, score)
+
+    @Slot(bool)
+    def toggle_eval_graph(self, checked: bool):
+         self.eval_graph.setVisible(checked)
+         if checked:
+              self._refresh_eval_graph()
+         elif self.eval_worker is not None:
+              self._eval_generation += 1
+              QMetaObject.invokeMethod(self.eval_worker, "stop", Qt.QueuedConnection)
+         if self.eval_worker is not None: # Amb el gràfic aturat, l'anàlisi recupera el seu fil
+              self._apply_engine_budgets()
+
+    def _apply_engine_budgets(self):
+         """
+         Reparteix els fils i el Hash del perfil interactiu entre els motors (sense sobresubscriure nuclis):
+         el motor del gràfic d'avaluació treballa alhora que l'anàlisi i els seus fils hi compten.
+         """
+         reserved = EVAL_GRAPH_THREADS if self.eval_worker is not None and self.action_eval_graph.isChecked() else 0
+         for index, params in enumerate(self.engine_profiles.budgets(len(self.engine_slots), reserved)):
+              self.engine_parameters_changed.emit(index, params)
 
-         self.stockfish_worker.analysis_ready.connect(self._display_stockfish_result)
+    def _stop_engine_slot(self, slot: EngineSlot):
+         self._stop_worker_thread(slot.name, slot.worker, slot.thread)
 
-         # Comença el fil (estarà esperant senyals per executar run_analysis)
-         self.stockfish_thread.start()
-         print("Fil de Stockfish iniciat.")
+    @staticmethod
+    def _stop_worker_thread(name: str, worker: QObject, thread: QThread):
+         """
+         Atura el fil d'un motor i espera que acabi de veritat: fins llavors
+         el worker pot estar llegint del motor i no es pot tancar (close()).
+         """
+         QMetaObject.invokeMethod(worker, "stop", Qt.QueuedConnection) # Al fil del worker, entre dues cerques
+         thread.quit() # Demana al bucle d'events del fil que acabi
+         if not thread.wait(1000):
+              log.info("Esperant que el motor %s acabi la cerca en curs...", name)
+              thread.wait()
 
         
     def _setup_ui(self):
         # --- Widget Central i Layout Principal ---
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
-        main_layout = QHBoxLayout(central_widget) # Layout principal horitzontal
+        main_layout = QVBoxLayout(central_widget) # Pestanyes a dalt, panells a sota
+
+        # --- Pestanyes de partides (cada una amb el seu GameTab a tabData) ---
+        self.tab_bar = QTabBar()
+        self.tab_bar.setTabsClosable(True)
+        self.tab_bar.setMovable(True)
+        self.tab_bar.setDocumentMode(True)
+        self.tab_bar.setExpanding(False)
+        self.tab_bar.setElideMode(Qt.TextElideMode.ElideRight)
+        self.tab_bar.currentChanged.connect(self._activate_tab)
+        self.tab_bar.tabCloseRequested.connect(self.close_tab)
+        main_layout.addWidget(self.tab_bar)
 
         # --- Splitter per dividir panells ---
         splitter = QSplitter(Qt.Orientation.Horizontal) # Explicitament Horitzontal
@@ -226,6 +596,11 @@ class MainWindow(QMainWindow):
 
         left_layout.addLayout(self.button_bar_layout, 0) # 0 = no expandir verticalment
 
+        # -- Gràfic d'avaluació de la partida (un clic hi va a la jugada) --
+        self.eval_graph = EvalGraph()
+        self.eval_graph.ply_clicked.connect(lambda ply: self.game_logic.go_to_ply(ply))
+        left_layout.addWidget(self.eval_graph, 0)
+
         splitter.addWidget(left_panel)
 
         # --- Panell Dret (PGN, Info, etc.) ---
@@ -235,11 +610,31 @@ class MainWindow(QMainWindow):
 
         self.pgn_label = QLabel("PGN Notation:")
         right_layout.addWidget(self.pgn_label)
+        self.opening_label = QLabel("") # Obertura (ECO) de la posició actual
+        self.opening_label.setWordWrap(True)
+        right_layout.addWidget(self.opening_label)
         self.pgn_display = QTextEdit()
         self.pgn_display.setReadOnly(True)
         self.pgn_display.setPlaceholderText("La notació PGN apareixerà aquí...")
         right_layout.addWidget(self.pgn_display, 1)
 
+        self.games_label = QLabel("Partides:")
+        right_layout.addWidget(self.games_label)
+        self.game_search = QLineEdit()
+        self.game_search.setPlaceholderText("Cerca: jugador, torneig, lloc o comentaris (ex: white:carlsen)")
+        self.game_search.setClearButtonEnabled(True)
+        right_layout.addWidget(self.game_search)
+        self._search_timer = QTimer(self) # Espera que l'usuari pari d'escriure
+        self._search_timer.setSingleShot(True)
+        self._search_timer.setInterval(200)
+        self._search_timer.timeout.connect(self._run_game_search)
+        self.game_search.textChanged.connect(self._search_timer.start)
+        self.game_list_model = GameListModel(parent=self)
+        self.game_list_view = GameListView()
+        self.game_list_view.setModel(self.game_list_model)
+        self.game_list_view.game_activated.connect(self.load_game_from_db)
+        right_layout.addWidget(self.game_list_view, 1)
+
         self.engine_label = QLabel("Stockfish Info:")
         right_layout.addWidget(self.engine_label)
         self.engine_info_display = QTextEdit()
@@ -254,6 +649,11 @@ class MainWindow(QMainWindow):
         initial_board_width_approx = SQUARE_SIZE * 8 + 40 # Amplada tauler + petits marges
         splitter.setSizes([initial_board_width_approx, 350]) # Ajusta mides inicials si cal
 
+        # --- Panell de mètriques (ocult fins que s'activa des del menú) ---
+        self.metrics_dock = MetricsDock(self)
+        self.addDockWidget(Qt.DockWidgetArea.BottomDockWidgetArea, self.metrics_dock)
+        self.metrics_dock.setVisible(metrics.enabled)
+
         # --- Barra de Menú i Estat ---
         self._create_menu()
         self.statusBar().showMessage("A punt")
@@ -274,7 +674,7 @@ class MainWindow(QMainWindow):
                 button.setIconSize(QSize(32, 32))
             else:
                 button.setText(tooltip.split()[0])
-                print(f"Avís: No s'ha trobat icona a '{icon_path}' per '{tooltip}'")
+                log.warning("No s'ha trobat icona a '%s' per '%s'", icon_path, tooltip)
         else:
              button.setText(tooltip.split()[0])
 
@@ -284,7 +684,7 @@ class MainWindow(QMainWindow):
         if hasattr(self, slot_func_name):
             button.clicked.connect(getattr(self, slot_func_name))
         else:
-            print(f"Avís: El mètode (slot) '{slot_func_name}' no existeix.")
+            log.warning("El mètode (slot) '%s' no existeix.", slot_func_name)
 
         return button
 
@@ -294,25 +694,62 @@ class MainWindow(QMainWindow):
         menu_bar = self.menuBar()
         file_menu = menu_bar.addMenu("&Fitxer")
 
+        new_tab_action = QAction("&Nova pestanya", self)
+        new_tab_action.setShortcut(QKeySequence.StandardKey.AddTab)
+        new_tab_action.setStatusTip("Obrir una partida nova en una altra pestanya")
+        new_tab_action.triggered.connect(self.new_tab)
+        file_menu.addAction(new_tab_action)
+
+        close_tab_action = QAction("&Tancar la pestanya", self)
+        close_tab_action.setShortcut(QKeySequence.StandardKey.Close)
+        close_tab_action.triggered.connect(lambda: self.close_tab(self.tab_bar.currentIndex()))
+        file_menu.addAction(close_tab_action)
+        file_menu.addSeparator()
+
         icon_open = QIcon(os.path.join(ICONS_DIR, "folder.png"))
         open_action = QAction(icon_open if not icon_open.isNull() else "&Obrir PGN...", self)
         open_action.setStatusTip("Obrir un fitxer PGN")
         open_action.triggered.connect(self.open_pgn_file)
         file_menu.addAction(open_action)
 
+        open_tab_action = QAction("Obrir PGN en una pestanya &nova...", self)
+        open_tab_action.setStatusTip("Obrir un fitxer PGN sense tancar la partida actual")
+        open_tab_action.triggered.connect(self.open_pgn_in_new_tab)
+        file_menu.addAction(open_tab_action)
+
+        follow_action = QAction("&Seguir PGN en directe...", self)
+        follow_action.setStatusTip("Obrir un PGN que es va actualitzant (retransmissió) i seguir-ne l'última partida")
+        follow_action.triggered.connect(self.follow_pgn_file)
+        file_menu.addAction(follow_action)
+
+        self.action_stop_follow = QAction("&Deixar de seguir", self)
+        self.action_stop_follow.setEnabled(False)
+        self.action_stop_follow.triggered.connect(self.stop_following_pgn)
+        file_menu.addAction(self.action_stop_follow)
+
         icon_save = QIcon(os.path.join(ICONS_DIR, "save.png"))
         save_action = QAction(icon_save if not icon_save.isNull() else "&Desar PGN...", self)
         save_action.setStatusTip("Desar la partida actual com a fitxer PGN")
-        # save_action.triggered.connect(self.save_pgn_file) # Implementa aquesta funció si cal
+        save_action.triggered.connect(self.save_pgn_file)
         file_menu.addAction(save_action)
         file_menu.addSeparator() # Separador
 
         icon_bd = QIcon(os.path.join(ICONS_DIR, "bbdd.png"))
         open_bbdd = QAction(icon_open if not icon_open.isNull() else "&Obrir BBDD..", self)
         open_bbdd.setStatusTip("Obrir un fitxer de BBDD")
-        # open_bbdd.triggered.connect(open_bbdd)
+        open_bbdd.triggered.connect(self.open_bbdd_file)
         file_menu.addAction(open_bbdd)
 
+        open_bbdd_tab = QAction("Obrir BBDD en una pestanya nova...", self)
+        open_bbdd_tab.setStatusTip("Obrir una altra BBDD al costat de l'actual")
+        open_bbdd_tab.triggered.connect(self.open_bbdd_in_new_tab)
+        file_menu.addAction(open_bbdd_tab)
+
+        import_pgn = QAction("&Importar PGN a la BBDD...", self)
+        import_pgn.setStatusTip("Afegir les partides d'un PGN a la BBDD oberta (només les noves si ja s'havia importat)")
+        import_pgn.triggered.connect(self.import_pgn_to_bbdd)
+        file_menu.addAction(import_pgn)
+
         icon_saveBD = QIcon(os.path.join(ICONS_DIR, "save.png"))
         save_bbdd = QAction(icon_save if not icon_save.isNull() else "&Desar BBDD...", self)
         save_bbdd.setStatusTip("Desar la partida actual en una BBDD")
@@ -339,6 +776,25 @@ class MainWindow(QMainWindow):
         # <<-- CONNECTA AL TOGGLE CORRECTE -->>
         self.action_stockfish_toggle.triggered.connect(self.toggle_engine_analysis)
         moduls_menu.addAction(self.action_stockfish_toggle)
+        self.action_eval_graph = QAction("&Gràfic d'avaluació", self)
+        self.action_eval_graph.setCheckable(True)
+        self.action_eval_graph.setChecked(True)
+        self.action_eval_graph.setStatusTip("Avaluar totes les jugades de la partida en segon pla i mostrar-ne el gràfic")
+        self.action_eval_graph.triggered.connect(self.toggle_eval_graph)
+        moduls_menu.addAction(self.action_eval_graph)
+        action_add_engine = QAction("&Afegir motor d'anàlisi...", self)
+        action_add_engine.setStatusTip("Analitzar amb un altre motor UCI (o un altre Stockfish) alhora")
+        action_add_engine.triggered.connect(self.add_analysis_engine)
+        moduls_menu.addAction(action_add_engine)
+        action_remove_engines = QAction("&Treure els motors addicionals", self)
+        action_remove_engines.triggered.connect(self.remove_analysis_engines)
+        moduls_menu.addAction(action_remove_engines)
+        action_calibrate = QAction("&Calibrar el motor...", self)
+        action_calibrate.setStatusTip("Mesurar els nps amb diferents fils i ajustar Threads/Hash a aquesta màquina")
+        action_calibrate.triggered.connect(self.calibrate_engine)
+        moduls_menu.addAction(action_calibrate)
+        # Canvien els perfils del motor: no es poden fer servir mentre es calibra
+        self._engine_config_actions = (action_add_engine, action_remove_engines, action_calibrate)
         # Desactiva el menú si el motor no s'ha carregat
         if not self.engine:
              moduls_menu.setEnabled(False)
@@ -374,6 +830,14 @@ class MainWindow(QMainWindow):
 
         conf_menu.addSeparator() # Separador
 
+        self.action_sounds = QAction("&Sons", self)
+        self.action_sounds.setCheckable(True)
+        self.action_sounds.setChecked(self.sounds.enabled)
+        self.action_sounds.setEnabled(self.sounds.available)
+        self.action_sounds.setStatusTip("Sons de les jugades, escacs i final de partida")
+        self.action_sounds.triggered.connect(self.sounds.set_enabled)
+        conf_menu.addAction(self.action_sounds)
+
         # -- Submenú per Estils de Peces --
         pieces_menu = conf_menu.addMenu("Estil de &Peces")
         # Crear accions dinàmicament basat en els directoris trobats
@@ -435,6 +899,32 @@ class MainWindow(QMainWindow):
              )
              pieces_menu.addAction(action_usual)
 
+        # -- Menú de cerca de posicions a la BBDD --
+        search_menu = menu_bar.addMenu("&Cerca")
+        for text, tip, mode in (
+            ("Mateix &material", "Partides que passen pel mateix material que el tauler", "material"),
+            ("Mateixa &estructura de peons", "Partides amb els peons a les mateixes caselles (sigui quin sigui el material)", "pawns"),
+            ("Posicions &semblants", "Partides amb una disposició de peces gairebé igual a la del tauler", "similar"),
+            ("&Posició exacta", "Partides que passen per la posició del tauler", "exact"),
+        ):
+            action = QAction(text, self)
+            action.setStatusTip(tip)
+            action.triggered.connect(lambda checked=False, m=mode: self.search_board_position(m))
+            search_menu.addAction(action)
+        search_menu.addSeparator()
+        action_all = QAction("Mostra &totes les partides", self)
+        action_all.triggered.connect(self.clear_game_filter)
+        search_menu.addAction(action_all)
+
+        # -- Menú de depuració: mètriques de rendiment (opt-in) --
+        debug_menu = menu_bar.addMenu("&Depuració")
+        self.action_metrics = QAction("&Mètriques de rendiment", self)
+        self.action_metrics.setCheckable(True)
+        self.action_metrics.setChecked(metrics.enabled)
+        self.action_metrics.setStatusTip("Activar la instrumentació i mostrar el panell de mètriques")
+        self.action_metrics.triggered.connect(self.toggle_metrics)
+        debug_menu.addAction(self.action_metrics)
+
 
           
         
@@ -454,32 +944,42 @@ class MainWindow(QMainWindow):
 
         # <<-- DESPRÉS d'actualitzar el tauler, si Stockfish està actiu, demana anàlisi -->>
         if self.stockfish_active and self.stockfish_worker and self.stockfish_thread and self.stockfish_thread.isRunning():
-             print("Moviment fet, demanant anàlisi a Stockfish...")
+             log.debug("Moviment fet, demanant anàlisi a Stockfish...")
              # Neteja la pantalla mentre s'espera
              self.engine_info_display.setPlaceholderText("Stockfish analitzant...")
              self.engine_info_display.clear()
-             # Crida a run_analysis via senyal/slot implícit o MetaObjectConnection
-             # (passant el FEN actual) per executar-ho al fil del worker.
              # Ajusta depth i movetime com vulguis
              analysis_depth = 15
              # analysis_time = 1500 # ms
-             # Use QMetaObject.invokeMethod for thread-safe call to worker slot
-             QMetaObject.invokeMethod(self.stockfish_worker, "run_analysis", Qt.QueuedConnection,
-                                   Q_ARG(str, self.board.fen()),
-                                   Q_ARG(int, analysis_depth),
-                                   Q_ARG(int, self.current_multipv)) # <<-- Passa MultiPV
+             self._request_engine_analysis(analysis_depth)
+
+    def _request_engine_analysis(self, depth: int):
+        """Demana l'anàlisi de la posició actual a tots els motors (cadascun al fil del seu worker)."""
+        self._engine_texts.clear()
+        for slot in self.engine_slots:
+            # Use QMetaObject.invokeMethod for thread-safe call to worker slot
+            QMetaObject.invokeMethod(slot.worker, "run_analysis", Qt.QueuedConnection,
+                                     Q_ARG(str, self.board.fen()),
+                                     Q_ARG(int, depth),
+                                     Q_ARG(int, self.current_multipv)) # <<-- Passa MultiPV
+
+    @Slot(bool)
+    def toggle_metrics(self, checked: bool):
+        """Activa/desactiva la instrumentació i mostra el panell de mètriques."""
+        metrics.enabled = checked
+        self.metrics_dock.setVisible(checked)
+        self.statusBar().showMessage(f"Mètriques {'activades' if checked else 'desactivades'}", 2000)
 
     @Slot(bool) # El triggered d'una acció checkable passa l'estat (True/False)
     def toggle_engine_analysis(self, checked: bool):
          """Activa o desactiva l'anàlisi de Stockfish."""
          if not self.engine:
-             print("Intent d'activar Stockfish, però el motor no està carregat.")
+             log.warning("Intent d'activar Stockfish, però el motor no està carregat.")
              self.action_stockfish_toggle.setChecked(False) # Mantén-lo desactivat
              return
 
          self.stockfish_active = checked # Actualitza l'estat intern
-         if debug == "stockfish":
-             print(f"Stockfish Actiu: {self.stockfish_active}")
+         log.debug("Stockfish Actiu: %s", self.stockfish_active)
          self.statusBar().showMessage(f"Anàlisi Stockfish {'Activada' if self.stockfish_active else 'Desactivada'}", 2000)
 
          self._update_engine_display_status() # Actualitza la pantalla
@@ -489,16 +989,103 @@ class MainWindow(QMainWindow):
              self._trigger_stockfish_update_if_needed()
 
 
+    @Slot()
+    def add_analysis_engine(self):
+        """Afegeix un motor al panell; els fils i el Hash es tornen a repartir entre tots."""
+        path, _ = QFileDialog.getOpenFileName(self, "Motor UCI", os.path.dirname(self.path_to_stockfish))
+        if not path:
+            return
+        names = {slot.name for slot in self.engine_slots}
+        name = base = os.path.basename(path)
+        number = 2
+        while name in names: # El mateix executable dues vegades (p. ex. amb opcions diferents al fitxer)
+            name = f"{base} ({number})"
+            number += 1
+        config = {"name": name, "path": path, "options": {}}
+        if not self._start_extra_engine(config):
+            QMessageBox.warning(self, "Motor", f"No s'ha pogut iniciar el motor:\n{path}")
+            return
+        self.engine_profiles.add_engine(name, path)
+        self._apply_engine_budgets()
+        self.statusBar().showMessage(f"Motor afegit: {name} ({len(self.engine_slots)} motors)", 3000)
+        self._trigger_stockfish_update_if_needed()
+
+    @Slot()
+    def remove_analysis_engines(self):
+        """Deixa només el motor principal (que torna a tenir tots els fils)."""
+        for slot in self.engine_slots[1:]:
+            self.engine_parameters_changed.disconnect(slot.worker.set_engine_parameters)
+            self._stop_engine_slot(slot)
+            slot.engine.close()
+        del self.engine_slots[1:]
+        self._engine_texts.clear()
+        self.engine_profiles.clear_engines()
+        self._apply_engine_budgets()
+        self._trigger_stockfish_update_if_needed()
+
+    @Slot()
+    def calibrate_engine(self):
+        """
+        Benchmark curt del motor amb 1, 2, 4... fils en un fil a part; aplica el
+        perfil interactiu resultant. Mentre dura, els motors de l'anàlisi i el
+        gràfic d'avaluació estan en pausa: si no, es mesurarien nuclis ocupats.
+        """
+        if self._calibration_job is not None:
+            return
+        self._set_engines_paused(True)
+        for action in self._engine_config_actions:
+            action.setEnabled(False)
+        thread = QThread()
+        worker = CalibrationWorker(self.engine_profiles, self.path_to_stockfish)
+        worker.moveToThread(thread)
+        worker.progress.connect(self._on_calibration_progress)
+        worker.finished.connect(self._on_calibration_finished)
+        thread.started.connect(worker.run)
+        self._calibration_job = (thread, worker)
+        thread.start()
+        self.statusBar().showMessage("Calibrant el motor...")
+
+    def _set_engines_paused(self, paused: bool):
+        for slot in self.engine_slots:
+            QMetaObject.invokeMethod(slot.worker, "set_paused", Qt.QueuedConnection, Q_ARG(bool, paused))
+        if self.eval_worker is None:
+            return
+        if paused:
+            self._eval_generation += 1
+            QMetaObject.invokeMethod(self.eval_worker, "stop", Qt.QueuedConnection)
+        else:
+            self._refresh_eval_graph(keep_scores=True)
+
+    @Slot(int, int)
+    def _on_calibration_progress(self, done: int, total: int):
+        self.statusBar().showMessage(f"Calibrant el motor ({done}/{total})...")
+
+    @Slot(object, str)
+    def _on_calibration_finished(self, results, error: str):
+        thread, worker = self._calibration_job
+        self._calibration_job = None
+        thread.quit()
+        thread.wait()
+        for action in self._engine_config_actions:
+            action.setEnabled(True)
+        self._set_engines_paused(False)
+        if results is None:
+            self.statusBar().clearMessage()
+            QMessageBox.critical(self, "Error Stockfish", f"No s'ha pogut calibrar el motor: {error}")
+        else:
+            options = self.engine_profiles.options("interactive")
+            self._apply_engine_budgets()
+            measured = ", ".join(f"{threads}: {nps // 1000} knps" for threads, nps in results.items())
+            self.statusBar().showMessage(f"Motor: {options['Threads']} fils, {options['Hash']} MB ({measured})", 8000)
+        self._trigger_stockfish_update_if_needed()
+
     def _trigger_stockfish_update_if_needed(self):
         """Helper per llançar anàlisi si està actiu i el fil funciona."""
         if self.stockfish_active and self.stockfish_worker and self.stockfish_thread and self.stockfish_thread.isRunning():
             self.engine_info_display.setPlaceholderText("Stockfish analitzant...")
             self.engine_info_display.clear()
             analysis_depth = 15 # Configurable
-            QMetaObject.invokeMethod(self.stockfish_worker, "run_analysis", Qt.QueuedConnection,
-                                   Q_ARG(str, self.board.fen()),
-                                   Q_ARG(int, analysis_depth),
-                                   Q_ARG(int, self.current_multipv)) # <<-- Passa MultiPV
+            self._request_engine_analysis(analysis_depth)
 
     def _update_engine_display_status(self):
          """Actualitza el text del display del motor segons l'estat actiu/inactiu."""
@@ -514,10 +1101,10 @@ class MainWindow(QMainWindow):
                   self.engine_info_display.setPlaceholderText("Esperant moviment per analitzar...")
 
 
-    @Slot(object) # Rep el diccionari (o None) des del worker
-    def _display_stockfish_result(self, analysis_results: list | None):
-         """Actualitza la UI amb el resultat rebut del fil de Stockfish."""
-         if not self.stockfish_active: # Comprova per si s'ha desactivat mentre calculava
+    @Slot(int, object) # Rep l'índex del motor i la llista (o None) des del worker
+    def _display_stockfish_result(self, index: int, analysis_results: list | None):
+         """Actualitza la UI amb el resultat rebut del fil d'un motor."""
+         if not self.stockfish_active or index >= len(self.engine_slots): # Desactivat (o motor tret) mentre calculava
              return
 
          """
@@ -556,16 +1143,14 @@ class MainWindow(QMainWindow):
          
          if analysis_results is None:
              # Error durant l'anàlisi
-             self.engine_info_display.setPlainText("Error durant l'anàlisi de Stockfish.")
-             self.engine_info_display.setPlaceholderText("")
+             self._show_engine_text(index, "Error durant l'anàlisi del motor.")
              return
 
          if not analysis_results:
               # No s'ha trobat cap línia (potser mat o posició rara)
-              self.engine_info_display.setPlainText("Stockfish no ha trobat cap moviment/línia principal.")
+              self._show_engine_text(index, "El motor no ha trobat cap moviment/línia principal.")
               # Podries intentar mostrar només l'avaluació si està disponible per separat
               # evaluation = self.engine.get_evaluation(self.board.fen()) # Necessitaria mètode addicional
-              self.engine_info_display.setPlaceholderText("")
               return
 
 
@@ -579,8 +1164,7 @@ class MainWindow(QMainWindow):
              centipawn_eval = line_info.get('Centipawn')
              mate_eval = line_info.get('Mate')
              
-             # de moment no va
-             # pv_uci_list = line_info.get('PV', []) # Llista de moviments UCI de la variant
+             pv_uci_list = line_info.get('PV', []) # Llista de moviments UCI de la variant
 
              # 1. Formata l'avaluació
              if mate_eval is not None:
@@ -604,28 +1188,94 @@ class MainWindow(QMainWindow):
                        best_move_san = self.board.san(move)
                   except ValueError:
                        # Pot passar si el moviment és invàlid per alguna raó o format estrany
-                       print(f"Avís: No s'ha pogut parsejar UCI '{move_uci}' a SAN.")
+                       log.warning("No s'ha pogut parsejar UCI '%s' a SAN.", move_uci)
                        best_move_san = move_uci # Mostra UCI
-             # PV no disponible
-             # 3. Formata la PV (la mostrem en UCI per simplicitat)
-             # pv_str = " ".join(pv_uci_list)
+             # 3. Formata la PV en SAN (les primeres jugades: cada motor en mostra una línia)
+             pv_str = self._pv_san(pv_uci_list[:8])
 
              # 4. Construeix la línia de text
-             # line_text = f"{i+1}. ({eval_str}) {best_move_san} PV: {pv_str}"
              # Millor format (més semblant a GUIs típiques):
-             # line_text = f"{eval_str.rjust(6)} Depth: {requested_depth} -> {best_move_san}  [{pv_str}]"
              line_text = f"{eval_str.rjust(6)} Depth: {requested_depth} -> {best_move_san}"
+             if pv_str:
+                 line_text += f"  [{pv_str}]"
 
              formatted_output.append(line_text)
 
          # Uneix totes les línies formatades i mostra-les
-         final_text = "\n".join(formatted_output)
-         self.engine_info_display.setPlainText(final_text)
+         self._show_engine_text(index, "\n".join(formatted_output))
+
+    def _pv_san(self, pv_uci_list: list) -> str:
+         board = self.board.copy(stack=False)
+         sans = []
+         for move_uci in pv_uci_list:
+              try:
+                   move = board.parse_uci(move_uci)
+              except ValueError: # PV d'una posició anterior o jugada estranya: es talla aquí
+                   break
+              sans.append(board.san(move))
+              board.push(move)
+         return " ".join(sans)
+
+    def _show_engine_text(self, index: int, text: str):
+         """Mostra el resultat de cada motor, un bloc per motor si n'hi ha més d'un."""
+         self._engine_texts[index] = text
+         if len(self.engine_slots) > 1:
+              text = "\n".join(f"{slot.name}:\n{self._engine_texts[i]}"
+                               for i, slot in enumerate(self.engine_slots) if i in self._engine_texts)
+         self.engine_info_display.setPlainText(text)
          self.engine_info_display.setPlaceholderText("")
              
         
+    @Slot()
+    def _on_game_board_changed(self):
+        """La partida de game_logic ha canviat de posició: sincronitza el tauler mostrat."""
+        self.board = self.game_logic.board.copy()
+        self.selected_square = None
+        self.chessboard_widget._clear_highlights()
+        self._update_board_display()
+        opening = self.game_logic.current_opening()
+        self.opening_label.setText(f"{opening.eco} {opening.name}" if opening else "")
+        self.eval_graph.set_current_ply(self.game_logic.current_ply())
+
+    @Slot(int, list)
+    def _on_moves_appended(self, first_ply: int, sans: list):
+        """Seguiment en directe: afegeix només les jugades noves al quadre PGN."""
+        if self.pgn_display.property("showing_game") is not True:
+            self._update_pgn_display()
+            return
+        self.pgn_display.moveCursor(QTextCursor.MoveOperation.End)
+        self.pgn_display.insertPlainText(self._format_san_moves(first_ply, sans))
+        self.pgn_display.ensureCursorVisible()
+
+    @staticmethod
+    def _format_san_moves(first_ply: int, sans: list) -> str:
+        parts = []
+        for offset, san in enumerate(sans):
+            ply = first_ply + offset
+            if ply % 2 == 0:
+                parts.append(f"{ply // 2 + 1}. {san}")
+            elif offset == 0:
+                parts.append(f"{ply // 2 + 1}... {san}")
+            else:
+                parts.append(san)
+        return " " + " ".join(parts)
+
+    @Slot()
     def _update_pgn_display(self):
         """Actualitza el quadre de text PGN."""
+        game = self.game_logic._game
+        if len(game) > 1: # Hi ha una partida carregada amb jugades
+            headers = game.headers
+            title = f"{headers.get('White', '?')} - {headers.get('Black', '?')}  ({headers.get('Result', '*')})"
+            board = game.board()
+            sans = []
+            for move in game.mainline_moves():
+                sans.append(board.san(move))
+                board.push(move)
+            self.pgn_display.setPlainText(title + "\n" + self._format_san_moves(game.board().ply(), sans).lstrip())
+            self.pgn_display.setProperty("showing_game", True)
+            return
+        self.pgn_display.setProperty("showing_game", False)
         # Necessitarem construir el PGN des de l'historial del joc
         # Exemple bàsic (caldria game logic per això):
         # game = chess.pgn.Game.from_board(self.board) # Això no guarda historial correctament
@@ -636,6 +1286,7 @@ class MainWindow(QMainWindow):
         
     # --- Slot per gestionar els clics al tauler ---
     @Slot(chess.Square)
+    @timed("ui.handle_square_click")
     def handle_square_click(self, clicked_square: chess.Square):
         """Gestiona la interacció quan es fa clic a una casella."""
         # print(f"Clic a la casella: {chess.square_name(clicked_square)}")
@@ -650,12 +1301,14 @@ class MainWindow(QMainWindow):
                 self.selected_square = clicked_square
                 legal_moves = [m for m in self.board.legal_moves if m.from_square == self.selected_square]
                 self.chessboard_widget.highlight_legal_moves(self.selected_square, legal_moves)
-                print(f"Peça seleccionada a {chess.square_name(clicked_square)}. Moviments legals: {[self.board.san(m) for m in legal_moves]}")
+                if log.isEnabledFor(logging.DEBUG): # Evita calcular el SAN de cada jugada si no es registra
+                    log.debug("Peça seleccionada a %s. Moviments legals: %s",
+                              chess.square_name(clicked_square), [self.board.san(m) for m in legal_moves])
             else:
                 # Clic a casella buida o peça rival: neteja selecció visual i lògica
                 self.chessboard_widget._clear_highlights()
                 self.selected_square = None
-                print("Clic a casella buida o peça rival. Deseleccionat.")
+                log.debug("Clic a casella buida o peça rival. Deseleccionat.")
 
         else:
             # --- Segon clic: Intentar moviment ---
@@ -665,10 +1318,10 @@ class MainWindow(QMainWindow):
 
             if move in self.board.legal_moves:
                 move_san = self.board.san(move) # Notació algebraica estàndard
-                self.board.push(move) # Fes el moviment al tauler lògic
-                print(f"Moviment realitzat: {move_san}")
+                # La jugada es fa a game_logic (arbre de la partida i diari); board_changed refresca el tauler
+                self.game_logic.make_move(move)
+                log.debug("Moviment realitzat: %s", move_san)
                 self.statusBar().showMessage(f"Moviment: {move_san}", 2000) # Mostra per 2 segons
-                self._update_board_display() # Actualitza la representació gràfica
                 self._update_pgn_display()   # Actualitza el PGN (simplificat ara)
                 
             else:
@@ -679,84 +1332,228 @@ class MainWindow(QMainWindow):
                     self.selected_square = clicked_square
                     legal_moves = [m for m in self.board.legal_moves if m.from_square == self.selected_square]
                     self.chessboard_widget.highlight_legal_moves(self.selected_square, legal_moves)
-                    print(f"Selecció canviada a {chess.square_name(clicked_square)}. Moviments: {[self.board.san(m) for m in legal_moves]}")
+                    if log.isEnabledFor(logging.DEBUG):
+                        log.debug("Selecció canviada a %s. Moviments: %s",
+                                  chess.square_name(clicked_square), [self.board.san(m) for m in legal_moves])
                 else:
                     # Clic a una casella que no és moviment legal ni canvi de selecció: deselecciona
                     self.chessboard_widget._clear_highlights()
                     self.selected_square = None
-                    print(f"Moviment {chess.square_name(move.from_square)}{chess.square_name(move.to_square)} és il·legal o clic invàlid. Deseleccionat.")
+                    log.debug("Moviment %s és il·legal o clic invàlid. Deseleccionat.", move)
                     self.statusBar().showMessage("Moviment il·legal", 2000)
 
     def closeEvent(self, event):
          """Atura el fil de Stockfish en tancar l'aplicació."""
-         print("Tancant aplicació...")
-         if self.stockfish_thread and self.stockfish_thread.isRunning():
-              print("Aturant el fil de Stockfish...")
-              if self.stockfish_worker:
-                   self.stockfish_worker.stop() # Indica al worker que pari (si té bucles llargs)
-              self.stockfish_thread.quit() # Demana al bucle d'events del fil que acabi
-              if not self.stockfish_thread.wait(1000): # Espera màxim 1 segon
-                    print("Avís: El fil de Stockfish no ha acabat correctament.")
-              else:
-                    print("Fil de Stockfish aturat.")
+         log.info("Tancant aplicació...")
+         if self._calibration_job is not None: # Les mesures acaben soles (uns segons); no es desen a mitges
+              self._calibration_job[0].quit()
+              self._calibration_job[0].wait()
+         if self._index_job is not None: # La feina feta ja és a disc; la resta, a la propera
+              thread, worker = self._index_job[:2]
+              worker.cancel()
+              thread.quit()
+              thread.wait()
+         self._store_tab_state()
+         for index in range(self.tab_bar.count()): # El diari es compacta: la partida es recupera en tornar a obrir
+              self._release_tab(self.tab_bar.tabData(index))
+         self.game_list_model.set_thumbnails(None) # Les miniatures encara a la cua ja no es dibuixen
+         for slot in self.engine_slots:
+              if slot.thread.isRunning():
+                   log.debug("Aturant el fil del motor %s...", slot.name)
+                   self._stop_engine_slot(slot)
+              slot.engine.close() # Els UCIMotor tenen un fil propi que no deixaria sortir del programa
+         if self.eval_thread is not None:
+              self._stop_worker_thread("del gràfic d'avaluació", self.eval_worker, self.eval_thread)
+              self.eval_worker.engine.close()
+         # Bolca les mètriques si s'ha demanat per variable d'entorn
+         dump_path = os.environ.get("GEMINI_CHESS_PROFILE_DUMP")
+         if metrics.enabled and dump_path:
+              metrics.dump(dump_path)
          event.accept() # Accepta l'event de tancament
     
+    # --- Pestanyes ---
+    @Slot()
+    def new_tab(self) -> GameTab:
+        """Pestanya amb una partida nova; passa a ser l'activa."""
+        return self._add_tab()
+
+    def _add_tab(self, journal: MoveJournal | None = None) -> GameTab:
+        """
+        Pestanya activa nova amb un diari d'autodesat: 'journal' (recuperat de
+        la sessió anterior, se'n restaura la partida) o el primer lliure.
+        """
+        tab = GameTab(GameLogic())
+        tab.game_logic.game_loaded.connect(lambda: self._update_tab_title(tab))
+        self.tab_bar.blockSignals(True) # addTab ja emet currentChanged, encara sense tabData
+        index = self.tab_bar.addTab(tab.title())
+        self.tab_bar.setTabData(index, tab)
+        self.tab_bar.setCurrentIndex(index)
+        self.tab_bar.blockSignals(False)
+        self._activate_tab(index)
+        restore = journal is not None
+        journal = journal or MoveJournal.for_instance()
+        if journal is not None and tab.game_logic.attach_journal(journal, restore=restore):
+            self._update_pgn_display()
+            self._refresh_eval_graph()
+        self._update_tab_title(tab)
+        return tab
+
+    @Slot(int)
+    def close_tab(self, index: int):
+        if self.tab_bar.count() <= 1:
+            self.statusBar().showMessage("No es pot tancar l'última pestanya", 2000)
+            return
+        tab = self.tab_bar.tabData(index)
+        if tab is self.current_tab:
+            self._store_tab_state()
+            self._connect_game_logic(tab.game_logic, False)
+            self.current_tab = None # _activate_tab no l'ha de tornar a desar
+        self.tab_bar.removeTab(index)
+        tab.game_logic.close_journal(discard=True) # Una pestanya tancada no s'ha de recuperar
+        self._release_tab(tab)
+        if self.current_tab is None:
+            self._activate_tab(self.tab_bar.currentIndex())
+
+    def _release_tab(self, tab: GameTab):
+        tab.game_logic.stop_following()
+        tab.game_logic.close_journal()
+        if tab.database is not None:
+            tab.database.close()
+
+    @Slot(int)
+    def _activate_tab(self, index: int):
+        """Passa el tauler, els motors i la llista de partides a la pestanya 'index'."""
+        tab = self.tab_bar.tabData(index)
+        if tab is None or tab is self.current_tab:
+            return
+        if self.current_tab is not None:
+            self._store_tab_state()
+            self._connect_game_logic(self.current_tab.game_logic, False)
+        self.current_tab = tab
+        self.game_logic = tab.game_logic
+        self.database = tab.database
+        self.position_index = tab.position_index
+        self.similarity_index = tab.similarity_index
+        self._position_hits = tab.position_hits
+        self._connect_game_logic(self.game_logic, True)
+        # Llista de partides de la pestanya (amb la seva cerca)
+        self.game_search.blockSignals(True)
+        self.game_search.setText(tab.search_text)
+        self.game_search.blockSignals(False)
+        self.game_list_model.set_thumbnails(tab.thumbnails)
+        self.game_list_model.set_database(self.database)
+        if self.database is not None and self._position_hits:
+            self.game_list_model.set_filter(self.database.set_result_ids(self._position_hits))
+        elif self.database is not None and tab.search_text:
+            self.game_list_model.set_search(tab.search_text)
+        self._update_games_label()
+        self.action_stop_follow.setEnabled(self.game_logic.is_following())
+        # Tauler, anàlisi i gràfic: les posicions ja vistes surten de la memòria cau compartida
+        self._on_game_board_changed()
+        self._update_pgn_display()
+        self._refresh_eval_graph()
+
+    def _store_tab_state(self):
+        """Desa a la pestanya activa l'estat que la finestra en té (BBDD, índexs, cerca)."""
+        tab = self.current_tab
+        if tab is None:
+            return
+        tab.database = self.database
+        tab.position_index = self.position_index
+        tab.similarity_index = self.similarity_index
+        tab.position_hits = self._position_hits
+        tab.thumbnails = self.game_list_model.thumbnails
+        tab.search_text = self.game_search.text()
+
+    def _connect_game_logic(self, game_logic: GameLogic, connect: bool):
+        """Només la partida de la pestanya activa actualitza el tauler, el PGN i el gràfic."""
+        for signal, slot in ((game_logic.board_changed, self._on_game_board_changed),
+                             (game_logic.game_loaded, self._update_pgn_display),
+                             (game_logic.moves_appended, self._on_moves_appended),
+                             (game_logic.game_loaded, self._refresh_eval_graph),
+                             (game_logic.moves_appended, self._extend_eval_graph),
+                             (game_logic.move_made, self._extend_eval_graph),
+                             (game_logic.move_made, self._play_move_sound),
+                             (game_logic.moves_appended, self._play_appended_sound),
+                             (game_logic.game_over, self._play_game_over_sound)):
+            if connect:
+                signal.connect(slot)
+            else:
+                signal.disconnect(slot)
+
+    def _extend_eval_graph(self, *args):
+        """Jugades noves: les puntuacions que ja hi havia es mantenen."""
+        self._refresh_eval_graph(keep_scores=True)
+
+    def _play_move_sound(self, move: chess.Move, san: str):
+        self.sounds.play(sound_for_san(san))
+
+    def _play_appended_sound(self, first_ply: int, sans: list):
+        if sans: # Seguiment en directe: sona l'última jugada arribada
+            self.sounds.play(sound_for_san(sans[-1]))
+
+    def _play_game_over_sound(self, result: str):
+        self.sounds.play("end")
+
+    def _update_tab_title(self, tab: GameTab):
+        if tab is self.current_tab:
+            self._store_tab_state()
+        for index in range(self.tab_bar.count()):
+            if self.tab_bar.tabData(index) is tab:
+                title = tab.title()
+                self.tab_bar.setTabText(index, title)
+                self.tab_bar.setTabToolTip(index, title)
+                return
+
     @Slot()
     def go_to_start(self):
-        print("Slot: Anar al principi")
+        log.debug("Slot: Anar al principi")
         self.statusBar().showMessage("Anant al principi...")
-        while self.board.move_stack: # Retrocedeix fins l'inici
-            self.board.pop()
-        self.update_board_display()
-        self._update_pgn_display()
+        self.game_logic.go_to_start()
 
     @Slot()
     def go_to_previous_move(self):
-        print("Slot: Moviment anterior")
+        log.debug("Slot: Moviment anterior")
         self.statusBar().showMessage("Moviment anterior...")
-        if self.board.move_stack:
-             self.board.pop() # Desfés l'últim moviment
-             self.update_board_display()
-             self._update_pgn_display()
+        if self.game_logic._current_node.parent is not None:
+             self.game_logic.previous_move() # Les jugades queden a l'arbre: es poden refer
         else:
              self.statusBar().showMessage("Ja s'està al principi", 1500)
 
 
     @Slot()
     def go_to_next_move(self):
-        # Això només té sentit si has carregat una partida i estàs navegant per ella
-        # O si has desfet moviments i vols refer-los (necessita un historial de "redo")
-        # Per ara, el deixem sense funcionalitat específica en mode de joc normal
-        print("Slot: Moviment següent (funcionalitat per implementar si es navega per partida existent)")
-        self.statusBar().showMessage("Moviment següent (no implementat per joc en curs)", 2000)
+        log.debug("Slot: Moviment següent")
+        board, node = self.board, self.game_logic._current_node
+        self.game_logic.next_move() # Línia principal des de la posició actual
+        if self.game_logic._current_node is not node: # Repàs de la partida: el so de la jugada (s'ajunten si es va ràpid)
+            self.sounds.play(sound_for_san(board.san(self.game_logic._current_node.move)))
 
 
     @Slot()
     def go_to_end(self):
-        # Similar a 'next', útil per navegació de partides carregades
-        print("Slot: Anar al final (funcionalitat per implementar si es navega per partida existent)")
-        self.statusBar().showMessage("Anar al final (no implementat per joc en curs)", 2000)
+        log.debug("Slot: Anar al final")
+        self.game_logic.go_to_end()
 
     @Slot()
     def reset_board(self):
-        print("Slot: Reiniciar tauler")
-        self.board.reset() # Reinicia el tauler lògic
+        log.debug("Slot: Reiniciar tauler")
+        self.game_logic.reset() # Partida nova (emet game_loaded i board_changed)
+        self.sounds.play("start")
         self.statusBar().showMessage("Tauler Reiniciat", 2000)
-        self._update_board_display()
-        self._update_pgn_display()
 
     @Slot()
     def flip_board(self):
         # Aquesta funció hauria d'estar idealment DINS de ChessboardWidget,
         # ja que afecta només la VISTA, no la lògica del joc (self.board).
-        print("Slot: Girar tauler (passant a ChessboardWidget)")
+        log.debug("Slot: Girar tauler (passant a ChessboardWidget)")
         self.statusBar().showMessage("Girant el tauler...")
         # Hauries d'implementar un mètode flip() dins de ChessboardWidget
         # if hasattr(self.chessboard_widget, 'flip'):
         #      self.chessboard_widget.flip()
         # else:
         #      print("La funció flip() no està implementada al ChessboardWidget.")
-        print("AVÍS: Funció flip() pendent d'implementar a ChessboardWidget")
+        log.warning("Funció flip() pendent d'implementar a ChessboardWidget")
 
    
     @Slot()
@@ -765,7 +1562,7 @@ class MainWindow(QMainWindow):
         # ... (codi igual que abans) ...
         self.selected_square = None # Reseteja selecció en carregar
         self.chessboard_widget._clear_highlights()
-        filename, _ = QFileDialog.getOpenFileName(self, "Carregar Partida PGN", "", "Fitxers PGN (*.pgn);;Tots els fitxers (*)")
+        filename, _ = QFileDialog.getOpenFileName(self, "Carregar Partida PGN", "", PGN_FILE_FILTER)
         if filename:
             self.game_logic.load_pgn(filename)
 
@@ -785,9 +1582,235 @@ class MainWindow(QMainWindow):
             # except Exception as e:
             #     QMessageBox.critical(self, "Error Obrint PGN", f"Hi ha hagut un error: {e}")
 
+    @Slot()
+    def open_pgn_in_new_tab(self):
+        filename, _ = QFileDialog.getOpenFileName(self, "Carregar Partida PGN", "", PGN_FILE_FILTER)
+        if filename:
+            self.new_tab()
+            self.game_logic.load_pgn(filename)
+
+    @Slot()
+    def save_pgn_file(self):
+        filename, _ = QFileDialog.getSaveFileName(self, "Desar Partida PGN", "", PGN_FILE_FILTER)
+        if filename:
+            self.game_logic.save_pgn(filename)
+            self.statusBar().showMessage(f"Partida desada a {os.path.basename(filename)}", 3000)
+
+    @Slot()
+    def follow_pgn_file(self):
+        filename, _ = QFileDialog.getOpenFileName(self, "Seguir PGN en directe", "", PGN_FILE_FILTER)
+        if filename and self.game_logic.follow_pgn(filename):
+            self.action_stop_follow.setEnabled(True)
+            self.statusBar().showMessage(f"Seguint {os.path.basename(filename)} "
+                                         f"({self.game_logic.followed_game_count()} partides)")
+        elif filename:
+            QMessageBox.warning(self, "Error PGN", "No s'ha pogut llegir cap partida del fitxer.")
+
+    @Slot()
+    def stop_following_pgn(self):
+        self.game_logic.stop_following()
+        self.action_stop_follow.setEnabled(False)
+        self.statusBar().showMessage("Seguiment aturat", 2000)
+
     @Slot()
     def open_bbdd_file(self):
         self.statusBar().showMessage("Obrint BBDD...")
+        filename, _ = QFileDialog.getOpenFileName(self, "Obrir BBDD", os.path.dirname(DEFAULT_DB),
+                                                  "BBDD SQLite (*.db *.sqlite);;Tots els fitxers (*)")
+        if filename:
+            self._open_database(filename)
+
+    @Slot()
+    def open_bbdd_in_new_tab(self):
+        filename, _ = QFileDialog.getOpenFileName(self, "Obrir BBDD", os.path.dirname(DEFAULT_DB),
+                                                  "BBDD SQLite (*.db *.sqlite);;Tots els fitxers (*)")
+        if filename:
+            self.new_tab()
+            self._open_database(filename)
+
+    def _open_database(self, filename: str):
+        try:
+            database = GameDatabase(filename)
+        except Exception as e:
+            QMessageBox.critical(self, "Error BBDD", f"No s'ha pogut obrir la BBDD:\n{e}")
+            return
+        if self.database is not None:
+            self.database.close()
+        self.database = database
+        self.position_index = None
+        self.similarity_index = None
+        self._position_hits = {}
+        self.game_list_model.set_database(database)
+        try: # Miniatures de la posició final al tooltip de la llista, desades al costat de la BBDD
+            renderer = BoardRenderer(self.chessboard_widget.resources_dir, THUMBNAIL_SQUARE)
+            self.game_list_model.set_thumbnails(ThumbnailCache(os.path.abspath(filename) + ".thumbs", renderer))
+        except OSError as e:
+            log.warning("Sense miniatures de partides: %s", e)
+            self.game_list_model.set_thumbnails(None)
+        self._update_games_label()
+        self._update_tab_title(self.current_tab)
+        self.statusBar().showMessage(f"BBDD oberta: {os.path.basename(filename)}", 3000)
+
+    @Slot()
+    def import_pgn_to_bbdd(self):
+        if self.database is None:
+            self.open_bbdd_file()
+            if self.database is None:
+                return
+        filename, _ = QFileDialog.getOpenFileName(self, "Importar PGN", "", PGN_FILE_FILTER)
+        if not filename:
+            return
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            summary = PgnImporter(self.database).import_file(filename)
+        except Exception as e:
+            log.exception("Error important %s", filename)
+            QMessageBox.critical(self, "Error Importació", f"Hi ha hagut un error: {e}")
+            return
+        finally:
+            QApplication.restoreOverrideCursor()
+        self.game_list_model.refresh()
+        self._update_games_label()
+        duplicates = f", {summary['duplicates']} duplicades saltades" if summary["duplicates"] else ""
+        self.statusBar().showMessage(f"Importades {summary['added']} partides noves{duplicates} "
+                                     f"({summary['seconds']:.1f} s)", 5000)
+        if summary["mode"] != "unchanged": # Les claus de cerca es calculen en importar (en segon pla), no a la primera cerca
+            self._start_index_update()
+
+    @Slot()
+    @timed("ui.game_search")
+    def _run_game_search(self):
+        if self.database is None:
+            return
+        self._position_hits = {}
+        self.game_list_model.set_search(self.game_search.text())
+        self._update_games_label()
+
+    def _update_games_label(self):
+        self.games_label.setText(f"Partides ({self.game_list_model.total_count()}):")
+
+    @Slot(int)
+    def load_game_from_db(self, game_id: int):
+        game = self.database.get_game(game_id) if self.database else None
+        if game is not None:
+            ply = self._position_hits.get(game_id) # Ve d'una cerca de posició: mostra la posició trobada
+            if QApplication.keyboardModifiers() & Qt.KeyboardModifier.ControlModifier:
+                self.new_tab() # Ctrl + doble clic: la partida s'obre en una pestanya nova
+            self.game_logic.load_game(game)
+            if ply is not None:
+                self.game_logic.go_to_ply(ply)
+
+    def _search_indexes_ready(self) -> bool:
+        """Cert si els índexs de la BBDD ja tenen totes les partides (es pot cercar sense esperar)."""
+        if self.position_index is None or self.position_index.outdated:
+            return False
+        last_id = self.database.conn.execute("SELECT MAX(id) FROM games").fetchone()[0] or 0
+        return last_id <= self.position_index.meta["last_game_id"]
+
+    def _start_index_update(self):
+        """Actualitza els índexs de la BBDD de la pestanya activa en un fil (un sol fil alhora)."""
+        if self._index_job is not None:
+            return
+        thread = QThread()
+        worker = SearchIndexWorker(self.database.path, self.position_index, self.similarity_index)
+        worker.moveToThread(thread)
+        worker.progress.connect(self._on_index_progress)
+        worker.finished.connect(self._on_index_finished)
+        thread.started.connect(worker.run)
+        self._index_job = (thread, worker, self.current_tab, self.database)
+        thread.start()
+        self.statusBar().showMessage("Indexant les posicions de la BBDD...")
+
+    @Slot(int, int)
+    def _on_index_progress(self, done: int, total: int):
+        self.statusBar().showMessage(f"Indexant les posicions de la BBDD: {done}/{total} partides...")
+
+    @Slot(object, object, str)
+    def _on_index_finished(self, positions, similarity, error: str):
+        thread, worker, tab, database = self._index_job
+        self._index_job = None
+        thread.quit()
+        thread.wait()
+        pending, self._pending_search = self._pending_search, None
+        if tab is self.current_tab:
+            self._store_tab_state()
+        if positions is None:
+            self.statusBar().clearMessage()
+            if pending is not None:
+                QMessageBox.warning(self, "Cerca", error)
+            else:
+                log.info("No s'actualitzen els índexs de posicions: %s", error)
+            return
+        if tab.database is not database: # La pestanya ha canviat de BBDD (o s'ha tancat) mentre s'indexava
+            return
+        tab.position_index, tab.similarity_index = positions, similarity
+        if tab is self.current_tab:
+            self.position_index, self.similarity_index = positions, similarity
+        self.statusBar().showMessage(f"Índex de posicions: {len(positions)} posicions", 3000)
+        if pending is not None and tab is self.current_tab:
+            mode, fen = pending
+            self._run_position_search(mode, chess.Board(fen))
+
+    def search_board_position(self, mode: str):
+        if self.database is None:
+            QMessageBox.information(self, "Cerca", "Cal obrir una BBDD primer.")
+            return
+        if self._index_job is not None: # L'índex s'està fent servir (i modificant) al fil
+            if self._index_job[2] is self.current_tab and self._index_job[3] is self.database:
+                self._pending_search = (mode, self.board.fen())
+            else:
+                self.statusBar().showMessage("S'està indexant una altra BBDD; torna-ho a provar després", 4000)
+            return
+        try:
+            ready = self._search_indexes_ready()
+        except RuntimeError as e: # Sense NumPy
+            QMessageBox.warning(self, "Cerca", str(e))
+            return
+        if not ready: # La cerca es fa quan l'índex estigui al dia (la interfície no s'atura)
+            self._pending_search = (mode, self.board.fen())
+            self._start_index_update()
+            return
+        self._run_position_search(mode, self.board)
+
+    def _run_position_search(self, mode: str, board: chess.Board):
+        with metrics.timer("ui.position_search"):
+            hits = {}
+            truncated = False
+            if mode == "pawns":
+                pawn_hits, truncated = self.similarity_index.same_pawn_structure(board)
+                for game_id, ply in pawn_hits:
+                    hits[game_id] = ply
+            elif mode == "similar": # Ordenades per semblança: la millor posició de cada partida
+                similar_hits, truncated = self.similarity_index.similar_positions(board)
+                for game_id, ply, _ in similar_hits:
+                    hits[game_id] = ply
+            else:
+                query = PositionQuery.from_board(board, material=True, pawns=mode == "exact",
+                                                 pieces=mode == "exact")
+                if mode == "exact":
+                    query.side_to_move = board.turn
+                for game_id, ply in self.position_index.search(query):
+                    hits.setdefault(game_id, ply) # Primera vegada que hi passa
+        self._show_position_hits(hits, truncated)
+
+    def _show_position_hits(self, hits: dict, truncated: bool = False):
+        self._position_hits = hits
+        self.game_search.blockSignals(True)
+        self.game_search.clear()
+        self.game_search.blockSignals(False)
+        self.game_list_model.set_filter(self.database.set_result_ids(hits))
+        self._update_games_label()
+        if truncated: # Estructura o disposició molt freqüent: no es mostren totes les partides
+            self.statusBar().showMessage(f"{len(hits)} partides trobades (posició molt freqüent a la BBDD: "
+                                         "la cerca només n'ha mirat una part)", 8000)
+        else:
+            self.statusBar().showMessage(f"{len(hits)} partides trobades", 5000)
+
+    @Slot()
+    def clear_game_filter(self):
+        self._position_hits = {}
+        self.game_list_model.set_filter()
+        self._update_games_label()
           
     @Slot()
     def save_bbdd(self):
@@ -830,6 +1853,12 @@ class MainWindow(QMainWindow):
         if success:
             # SI el directori és vàlid i s'ha canviat, LLAVORS actualitza la pantalla
             self._update_board_display()
+            self._store_tab_state()
+            for index in range(self.tab_bar.count()): # Miniatures de les BBDD de totes les pestanyes
+                thumbnails = self.tab_bar.tabData(index).thumbnails
+                if thumbnails is not None:
+                    thumbnails.set_pieces(piece_dir_path)
+            self.game_list_model.set_thumbnails(self.game_list_model.thumbnails) # Oblida els camins de l'estil anterior
         else:
             # Si set_piece_set retorna False (directori invàlid)
             self.statusBar().showMessage(f"Error: No s'ha pogut canviar a l'estil {style_name}. Verifica la carpeta.", 3000)
@@ -841,6 +1870,7 @@ class MainWindow(QMainWindow):
 
 # --- Punt d'entrada de l'aplicació ---
 if __name__ == '__main__':
+    setup_logging() # Nivells i fitxer segons les variables d'entorn GEMINI_CHESS_LOG*
     app = QApplication(sys.argv)
 
     # Comprova que existeixen els directoris abans de continuar
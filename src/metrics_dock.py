@@ -0,0 +1,69 @@
+# src/metrics_dock.py
+from PySide6.QtWidgets import (QDockWidget, QWidget, QVBoxLayout, QHBoxLayout,
+                               QPlainTextEdit, QPushButton, QFileDialog)
+from PySide6.QtGui import QFont
+from PySide6.QtCore import Qt, QTimer, Slot
+from instrumentation import metrics
+
+
+class MetricsDock(QDockWidget):
+    """
+    Panell de depuració amb el resum de les mètriques de rendiment.
+    Es refresca cada segon mentre és visible i permet desar-les en JSON
+    o en format de text Prometheus.
+    """
+    def __init__(self, parent=None):
+        super().__init__("Mètriques de rendiment", parent)
+        self.setAllowedAreas(Qt.DockWidgetArea.BottomDockWidgetArea | Qt.DockWidgetArea.RightDockWidgetArea)
+
+        container = QWidget()
+        layout = QVBoxLayout(container)
+        layout.setContentsMargins(4, 4, 4, 4)
+
+        self.text = QPlainTextEdit()
+        self.text.setReadOnly(True)
+        self.text.setFont(QFont("Monospace", 9))
+        layout.addWidget(self.text, 1)
+
+        buttons = QHBoxLayout()
+        button_reset = QPushButton("Reinicia")
+        button_reset.clicked.connect(self.reset_metrics)
+        buttons.addWidget(button_reset)
+        button_save = QPushButton("Desa...")
+        button_save.clicked.connect(self.save_metrics)
+        buttons.addWidget(button_save)
+        buttons.addStretch(1)
+        layout.addLayout(buttons)
+        self.setWidget(container)
+
+        self._timer = QTimer(self)
+        self._timer.setInterval(1000)
+        self._timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        self.refresh()
+        self._timer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self._timer.stop() # No cal refrescar si no es veu
+        super().hideEvent(event)
+
+    @Slot()
+    def refresh(self):
+        if not metrics.enabled:
+            self.text.setPlainText("Instrumentació desactivada.")
+            return
+        self.text.setPlainText(metrics.summary_text())
+
+    @Slot()
+    def reset_metrics(self):
+        metrics.reset()
+        self.refresh()
+
+    @Slot()
+    def save_metrics(self):
+        filename, _ = QFileDialog.getSaveFileName(self, "Desar mètriques", "metrics.json",
+                                                  "JSON (*.json);;Prometheus (*.prom *.txt)")
+        if filename:
+            metrics.dump(filename)
@@ -0,0 +1,271 @@
+# src/pgn_importer.py
+"""
+Importació de fitxers PGN (comprimits o no) a la BBDD SQLite.
+
+Els arxius PGN grans normalment només creixen (s'hi afegeixen partides al
+final). Per cada fitxer es guarda una empremta a 'pgn_sources':
+
+    size, mtime, inode     estat del fitxer a l'última importació
+    last_offset            inici de l'última partida importada
+    end_offset             bytes (descomprimits) llegits
+    head_hash / tail_hash  hash del primer bloc i dels HASH_WINDOW bytes abans de end_offset
+    checkpoints            inicis de trama (fitxers comprimits) per fer seek sense descomprimir tot
+
+En reimportar, si el fitxer no ha canviat no es fa res; si només ha crescut
+i els hashes coincideixen, només es parseja des de last_offset (l'última
+partida es torna a importar per si estava a mitges). Si el prefix ha
+canviat, es fa una importació completa. Tot va dins una única transacció:
+o queden les partides i l'empremta nova, o no queda res.
+
+Les capçaleres ECO i Opening es (re)calculen per posició amb la taula
+d'eco.py: moltes partides no en tenen o les tenen malament.
+
+A més de la fila de 'games', cada partida s'afegeix a l'índex FTS5 de la BBDD
+(jugadors, torneig, lloc i comentaris de la línia principal) per la cerca.
+
+Les partides que ja són a la BBDD (mateix hash canònic, veure dedup.py) es
+detecten en la mateixa passada: es salten ('skip', per defecte), se'n
+completen les capçaleres que falten a l'original ('merge') o s'importen
+igualment ('keep'). Opcionalment s'escriu un informe TSV dels duplicats.
+
+Ús des de línia d'ordres (per exemple, cada nit):
+    python pgn_importer.py arxiu.pgn.gz [--db chess.db] [--full] [--duplicates merge] [--report dups.tsv]
+
+En acabar, el CLI també afegeix les partides noves als índexs de cerca de
+posicions (position_search, similarity), si hi ha NumPy: la primera cerca
+a la interfície no els ha de construir (--no-index per saltar-ho).
+"""
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import sys
+import time
+import chess
+import chess.pgn
+from db_manager import GameDatabase, DEFAULT_DB, game_row, merge_updates
+from dedup import DuplicateIndex
+from eco import classify_headers
+from instrumentation import metrics
+from pgn_io import open_pgn_binary, iter_games, CompressedReader
+
+log = logging.getLogger(__name__)
+
+HASH_WINDOW = 64 * 1024 # Bytes del final de l'última importació que es comproven
+HEAD_WINDOW = 4096
+BATCH_SIZE = 1000 # Files per executemany
+DUPLICATE_MODES = ("skip", "merge", "keep")
+
+
+class MainlineVisitor(chess.pgn.BaseVisitor):
+    """Visitor lleuger: capçaleres, jugades i comentaris de la línia principal (salta variants)."""
+    def begin_game(self):
+        self.headers = chess.pgn.Headers()
+        self.moves = []
+        self.comments = []
+
+    def begin_headers(self):
+        return self.headers
+
+    def visit_header(self, tagname: str, tagvalue: str):
+        self.headers[tagname] = tagvalue
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def visit_move(self, board: chess.Board, move: chess.Move):
+        self.moves.append(move)
+
+    def visit_comment(self, comment: str):
+        self.comments.append(comment)
+
+    def visit_result(self, result: str):
+        if self.headers.get("Result", "*") == "*": # Resultat només al final de les jugades
+            self.headers["Result"] = result
+
+    def handle_error(self, error: Exception):
+        log.warning("Error de sintaxi PGN (s'ignora la resta de la partida): %s", error)
+
+    def result(self):
+        return self.headers, self.moves, " ".join(self.comments)
+
+
+def _hash_range(stream, start: int, end: int) -> bytes:
+    stream.seek(start)
+    return hashlib.blake2b(stream.read(end - start), digest_size=16).digest()
+
+
+def _checkpoints(stream) -> list:
+    raw = getattr(stream, "raw", None)
+    return raw.frame_checkpoints() if isinstance(raw, CompressedReader) else []
+
+
+class PgnImporter:
+    """Importa fitxers PGN a una GameDatabase, de forma incremental si es pot."""
+    def __init__(self, db: GameDatabase, batch_size: int = BATCH_SIZE):
+        self.db = db
+        self.batch_size = batch_size
+
+    def _prefix_unchanged(self, stream, source: dict, stat) -> bool:
+        """Cert si el fitxer només ha crescut des de l'última importació."""
+        if stat.st_size < source["size"] or (source["inode"] and stat.st_ino != source["inode"]):
+            return False
+        raw = getattr(stream, "raw", None)
+        if isinstance(raw, CompressedReader) and source["checkpoints"]:
+            raw.add_frame_checkpoints(json.loads(source["checkpoints"]))
+        end = source["end_offset"]
+        if _hash_range(stream, 0, min(HEAD_WINDOW, end)) != source["head_hash"]:
+            return False
+        return _hash_range(stream, max(0, end - HASH_WINDOW), end) == source["tail_hash"]
+
+    def import_file(self, filename: str, full: bool = False, progress=None,
+                    duplicates: str = "skip", report=None) -> dict:
+        """
+        Importa 'filename'. Retorna un resum: mode ('unchanged', 'incremental'
+        o 'full'), partides afegides, esborrades (importació completa d'un fitxer
+        que ja hi era), duplicades, completades ('merge'), partides totals del
+        fitxer i segons.
+        'progress(n)' es crida cada batch amb les partides processades.
+        'duplicates' és 'skip', 'merge' o 'keep'; si hi ha 'report' (fitxer de
+        text obert), s'hi escriu una línia per duplicat: offset, acció, original
+        ("id:N" o "offset:N" si és del mateix fitxer), blanques, negres, resultat.
+        """
+        if duplicates not in DUPLICATE_MODES:
+            raise ValueError(f"Mode de duplicats desconegut: {duplicates}")
+        started = time.perf_counter()
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        source = self.db.get_source(path)
+        summary = {"mode": "full", "added": 0, "removed": 0, "duplicates": 0, "merged": 0,
+                   "total": 0, "seconds": 0.0}
+        if source and not full and stat.st_size == source["size"] and stat.st_mtime == source["mtime"]:
+            summary.update(mode="unchanged", total=source["game_count"])
+            return summary
+
+        with open_pgn_binary(path) as stream, self.db.conn:
+            start = 0
+            if source and not full and self._prefix_unchanged(stream, source, stat):
+                summary["mode"] = "incremental"
+                start = source["last_offset"]
+            elif source:
+                log.info("El prefix de %s ha canviat: importació completa", path)
+            source_id = self.db.save_source(path) if source is None else source["id"]
+            removed = self.db.delete_source_games(source_id, start)
+            known = DuplicateIndex(self.db) if duplicates != "keep" else None
+            last_offset = start
+            reinserted = 0 # Partides esborrades (offset == start) que es tornen a inserir
+            batch = []
+            for offset, data in iter_games(stream, start):
+                parsed = chess.pgn.read_game(io.StringIO(data.decode("utf-8", errors="replace")),
+                                             Visitor=MainlineVisitor)
+                if parsed is None:
+                    continue
+                headers, moves, comments = parsed
+                classify_headers(headers, moves)
+                row = game_row(headers, moves, self.db.user_id, source_id, offset, comments)
+                last_offset = offset
+                if known is not None:
+                    original = known.find(row)
+                    if original is not None:
+                        self._duplicate(row, original, duplicates, summary, report)
+                        continue
+                    known.add(row)
+                batch.append(row)
+                if offset == start and summary["mode"] == "incremental":
+                    reinserted += 1
+                if len(batch) >= self.batch_size:
+                    summary["added"] += self.db.insert_games(batch)
+                    batch = []
+                    if known is not None:
+                        known.flushed()
+                    if progress:
+                        progress(summary["added"])
+            if batch:
+                summary["added"] += self.db.insert_games(batch)
+            end = stream.tell()
+            if summary["mode"] == "incremental":
+                # L'última partida reimportada no és nova; si ara s'ha saltat (duplicada, il·legible), sí que s'ha tret
+                reinserted = min(reinserted, removed)
+                summary["added"] -= reinserted
+                summary["removed"] = removed - reinserted
+            else:
+                summary["removed"] = removed
+            summary["total"] = self.db.count_games(source_id)
+            self.db.save_source(
+                path, size=stat.st_size, mtime=stat.st_mtime, inode=stat.st_ino,
+                last_offset=last_offset, end_offset=end,
+                head_hash=_hash_range(stream, 0, min(HEAD_WINDOW, end)),
+                tail_hash=_hash_range(stream, max(0, end - HASH_WINDOW), end),
+                checkpoints=json.dumps(_checkpoints(stream)), game_count=summary["total"])
+        summary["seconds"] = time.perf_counter() - started
+        metrics.observe(f"import.{summary['mode']}", summary["seconds"] * 1000)
+        if summary["duplicates"]:
+            metrics.inc("import.duplicates", summary["duplicates"])
+        log.info("Importat %s (%s): %d partides noves, %d duplicades, %d en total, %.2f s",
+                 path, summary["mode"], summary["added"], summary["duplicates"], summary["total"],
+                 summary["seconds"])
+        return summary
+
+    def _duplicate(self, row: dict, original, mode: str, summary: dict, report):
+        """'row' repeteix 'original' (id de la BBDD o fila pendent d'inserir): la salta o la fusiona."""
+        summary["duplicates"] += 1
+        action = "skip"
+        if mode == "merge":
+            if isinstance(original, dict):
+                updates = merge_updates(original, row)
+                original.update(updates)
+                merged = bool(updates)
+            else:
+                merged = self.db.merge_game(original, row)
+            if merged:
+                summary["merged"] += 1
+                action = "merge"
+        if report is not None:
+            where = f"offset:{original['source_offset']}" if isinstance(original, dict) else f"id:{original}"
+            report.write("\t".join((str(row["source_offset"]), action, where, row["white"], row["black"], row["result"])) + "\n")
+
+
+def _update_search_indexes(db: GameDatabase):
+    try:
+        from similarity import update_indexes
+        started = time.perf_counter()
+        positions, _ = update_indexes(db, progress=lambda done, total: log.info("Indexant posicions: %d/%d partides",
+                                                                              done, total))
+    except RuntimeError as e: # Sense NumPy
+        log.info("No s'actualitzen els índexs de posicions: %s", e)
+        return
+    print(f"Índex de posicions: {len(positions)} posicions ({time.perf_counter() - started:.1f} s)")
+
+
+def main(argv=None) -> int:
+    from log_setup import setup_logging
+    parser = argparse.ArgumentParser(description="Importa fitxers PGN a la BBDD (incremental)")
+    parser.add_argument("files", nargs="+", help="Fitxers PGN (.pgn, .gz, .bz2, .xz, .zst)")
+    parser.add_argument("--db", default=DEFAULT_DB, help="Fitxer SQLite (per defecte %(default)s)")
+    parser.add_argument("--full", action="store_true", help="Força la importació completa")
+    parser.add_argument("--duplicates", choices=DUPLICATE_MODES, default="skip",
+                        help="Què fer amb les partides que ja són a la BBDD (per defecte %(default)s)")
+    parser.add_argument("--report", help="Fitxer TSV on escriure els duplicats trobats")
+    parser.add_argument("--no-index", action="store_true", help="No actualitzar els índexs de cerca de posicions")
+    args = parser.parse_args(argv)
+    setup_logging("INFO")
+    report = open(args.report, "w", encoding="utf-8") if args.report else None
+    try:
+        with GameDatabase(args.db) as db:
+            importer = PgnImporter(db)
+            for filename in args.files:
+                summary = importer.import_file(filename, full=args.full, duplicates=args.duplicates, report=report)
+                print(f"{filename}: {summary['mode']}, +{summary['added']} ({summary['total']} partides, "
+                      f"{summary['duplicates']} duplicades, {summary['seconds']:.2f} s)")
+            if not args.no_index:
+                _update_search_indexes(db)
+    finally:
+        if report is not None:
+            report.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,456 @@
+# src/pgn_io.py
+"""
+Lectura i escriptura de fitxers PGN, comprimits o no.
+
+- open_pgn(): obre un PGN en mode text; detecta la compressió pels bytes
+  màgics (lectura) o per l'extensió (escriptura). Suporta .gz, .bz2, .xz i,
+  si hi ha el paquet 'zstandard', .zst. La descompressió és en streaming amb
+  lectures grans, així la memòria és constant sigui quina sigui la mida.
+- CompressedReader: lector binari d'un fitxer comprimit que permet seek().
+  Mentre llegeix guarda punts de control (checkpoints): inicis de trama
+  (membres gzip, streams bz2/xz, trames zstd) i, per gzip, còpies de l'estat
+  del descompressor cada 'checkpoint_interval' bytes. Un seek() només ha de
+  descomprimir des del checkpoint anterior, no des del principi del fitxer.
+- scan_games(): troba l'offset (en bytes descomprimits) de cada partida.
+- iter_games(): el mateix, però retornant també el text de cada partida.
+- PgnIndex: índex d'offsets per accedir a la partida N directament.
+- PgnTail: seguiment incremental d'un PGN que creix (o es reescriu).
+"""
+import bisect
+import bz2
+import hashlib
+import io
+import json
+import logging
+import lzma
+import os
+import zlib
+from array import array
+import chess.pgn
+
+try:
+    import zstandard
+except ImportError: # Opcional: només cal per fitxers .zst
+    zstandard = None
+
+log = logging.getLogger(__name__)
+
+READ_BUFFER = 1024 * 1024 # Mida de lectura / buffer (1 MB)
+CHECKPOINT_INTERVAL = 32 * 1024 * 1024 # Cada quants bytes descomprimits es guarda un checkpoint
+
+MAGIC_NUMBERS = (
+    (b"\x1f\x8b", "gz"),
+    (b"BZh", "bz2"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"\x28\xb5\x2f\xfd", "zst"),
+)
+EXTENSIONS = {".gz": "gz", ".gzip": "gz", ".bz2": "bz2", ".xz": "xz", ".lzma": "xz", ".zst": "zst", ".zstd": "zst"}
+PGN_FILE_FILTER = "Fitxers PGN (*.pgn *.pgn.gz *.pgn.bz2 *.pgn.xz *.pgn.zst);;Tots els fitxers (*)"
+
+
+def compression_from_extension(filename: str) -> str | None:
+    return EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+
+
+def detect_compression(filename: str) -> str | None:
+    """Retorna 'gz', 'bz2', 'xz', 'zst' o None (text pla) segons els bytes màgics."""
+    try:
+        with open(filename, 'rb') as f:
+            head = f.read(6)
+    except FileNotFoundError:
+        return compression_from_extension(filename)
+    for magic, kind in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return kind
+    return None
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise RuntimeError("Cal el paquet 'zstandard' per fitxers .zst (pip install zstandard)")
+
+
+def _new_decompressor(kind: str):
+    """Descompressor incremental (tots tenen decompress(), eof i unused_data)."""
+    if kind == "gz":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS) # Format gzip (un membre)
+    if kind == "bz2":
+        return bz2.BZ2Decompressor()
+    if kind == "xz":
+        return lzma.LZMADecompressor()
+    if kind == "zst":
+        _require_zstandard()
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError(f"Compressió desconeguda: {kind}")
+
+
+class CompressedReader(io.RawIOBase):
+    """
+    Lector binari d'un fitxer comprimit, amb seek() basat en checkpoints.
+    Les posicions (tell/seek) són en bytes DESCOMPRIMITS.
+    """
+    def __init__(self, filename: str, kind: str | None = None,
+                 checkpoint_interval: int = CHECKPOINT_INTERVAL):
+        super().__init__()
+        self.filename = filename
+        self.kind = kind or detect_compression(filename)
+        if self.kind is None:
+            raise ValueError(f"El fitxer no està comprimit: {filename}")
+        self.checkpoint_interval = checkpoint_interval
+        self._raw = open(filename, 'rb', buffering=0)
+        # Checkpoints: llistes paral·leles ordenades per posició descomprimida
+        self._cp_out = [0] # posició descomprimida
+        self._cp_in = [0] # posició comprimida
+        self._cp_state = [None] # còpia del descompressor (None = inici de trama)
+        self._restart(0, 0, None)
+
+    def _restart(self, out_pos: int, in_pos: int, state):
+        self._raw.seek(in_pos)
+        self._in_pos = in_pos
+        self._out_pos = out_pos # Posició del primer byte de self._pending
+        self._decoder = state.copy() if state is not None else _new_decompressor(self.kind)
+        self._pending = b""
+        self._pending_offset = 0
+        self._eof = False
+        self._next_snapshot = out_pos + self.checkpoint_interval
+
+    def _add_checkpoint(self, out_pos: int, in_pos: int, state):
+        i = bisect.bisect_left(self._cp_out, out_pos)
+        if i < len(self._cp_out) and self._cp_out[i] == out_pos:
+            return
+        self._cp_out.insert(i, out_pos)
+        self._cp_in.insert(i, in_pos)
+        self._cp_state.insert(i, state)
+
+    def _fill(self) -> bool:
+        """
+        Descomprimeix el següent bloc a self._pending (només es crida quan
+        s'ha consumit l'anterior). Retorna False a final de fitxer.
+        """
+        produced_at = self.tell()
+        while True:
+            if self._decoder.eof:
+                leftover = self._decoder.unused_data
+                if not leftover:
+                    leftover = self._raw.read(READ_BUFFER)
+                    self._in_pos += len(leftover)
+                if not leftover.strip(b"\x00"): # Final (o farciment de zeros)
+                    self._eof = True
+                    return False
+                # Inici d'una nova trama/membre: és un checkpoint natural
+                self._add_checkpoint(produced_at, self._in_pos - len(leftover), None)
+                self._decoder = _new_decompressor(self.kind)
+                data = self._decoder.decompress(leftover)
+            else:
+                chunk = self._raw.read(READ_BUFFER)
+                if not chunk:
+                    self._eof = True
+                    return False
+                self._in_pos += len(chunk)
+                data = self._decoder.decompress(chunk)
+            if data:
+                self._pending = data
+                self._pending_offset = 0
+                self._out_pos = produced_at
+                produced_at += len(data)
+                # Snapshot de l'estat (només zlib ho permet) per poder-hi saltar després
+                if produced_at >= self._next_snapshot and hasattr(self._decoder, "copy") and not self._decoder.eof:
+                    self._add_checkpoint(produced_at, self._in_pos, self._decoder.copy())
+                    self._next_snapshot = produced_at + self.checkpoint_interval
+                return True
+
+    # --- Interfície io.RawIOBase ---
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._out_pos + self._pending_offset
+
+    def readinto(self, buffer) -> int:
+        if self._pending_offset >= len(self._pending):
+            if self._eof or not self._fill():
+                return 0
+        available = len(self._pending) - self._pending_offset
+        n = min(len(buffer), available)
+        buffer[:n] = self._pending[self._pending_offset:self._pending_offset + n]
+        self._pending_offset += n
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.tell()
+        elif whence == io.SEEK_END:
+            raise io.UnsupportedOperation("SEEK_END no suportat en fitxers comprimits")
+        current = self.tell()
+        if offset < current or offset - current > self.checkpoint_interval:
+            i = bisect.bisect_right(self._cp_out, offset) - 1
+            if offset < current or self._cp_out[i] > current:
+                self._restart(self._cp_out[i], self._cp_in[i], self._cp_state[i])
+        # Avança descomprimint i descartant fins a l'offset
+        while self.tell() < offset:
+            if self._pending_offset >= len(self._pending):
+                if self._eof or not self._fill():
+                    break
+                continue
+            skip = min(offset - self.tell(), len(self._pending) - self._pending_offset)
+            self._pending_offset += skip
+        return self.tell()
+
+    def frame_checkpoints(self) -> list[tuple[int, int]]:
+        """Checkpoints persistibles (inicis de trama): [(offset_descomprimit, offset_comprimit)]."""
+        return [(o, i) for o, i, s in zip(self._cp_out, self._cp_in, self._cp_state) if s is None]
+
+    def add_frame_checkpoints(self, checkpoints):
+        for out_pos, in_pos in checkpoints:
+            self._add_checkpoint(out_pos, in_pos, None)
+
+    def close(self):
+        if not self.closed:
+            self._raw.close()
+        super().close()
+
+
+def open_pgn_binary(filename: str):
+    """Obre un PGN (comprimit o no) en mode binari amb buffer gran i seek()."""
+    kind = detect_compression(filename)
+    if kind is None:
+        return open(filename, 'rb', buffering=READ_BUFFER)
+    return io.BufferedReader(CompressedReader(filename, kind), buffer_size=READ_BUFFER)
+
+
+def open_pgn(filename: str, mode: str = 'r', encoding: str = 'utf-8', errors: str = 'replace'):
+    """
+    Obre un PGN en mode text ('r', 'w' o 'a'), comprimit o no.
+    En lectura la compressió es detecta pel contingut; en escriptura, per l'extensió.
+    En mode 'a' sobre un fitxer comprimit s'afegeix una trama/membre nou (format vàlid).
+    """
+    mode = mode.replace('t', '')
+    if mode == 'r':
+        return io.TextIOWrapper(open_pgn_binary(filename), encoding=encoding, errors=errors)
+    if mode not in ('w', 'a'):
+        raise ValueError(f"Mode no suportat: {mode}")
+    kind = compression_from_extension(filename)
+    if kind is None:
+        return open(filename, mode, encoding=encoding, buffering=READ_BUFFER)
+    if kind == "gz":
+        import gzip
+        return gzip.open(filename, mode + 't', encoding=encoding)
+    if kind == "bz2":
+        return bz2.open(filename, mode + 't', encoding=encoding)
+    if kind == "xz":
+        return lzma.open(filename, mode + 't', encoding=encoding)
+    _require_zstandard()
+    return zstandard.open(filename, mode + 't', encoding=encoding)
+
+
+def scan_games(stream, start: int = 0):
+    """
+    Generador dels offsets (bytes descomprimits) on comença cada partida.
+    'stream' és un fitxer binari (open_pgn_binary). Una partida comença a la
+    primera línia de capçalera ('[') que ve després del text de jugades.
+    """
+    stream.seek(start)
+    position = start
+    in_headers = False
+    for line in stream:
+        if line.startswith(b"["):
+            if not in_headers:
+                in_headers = True
+                yield position
+        elif line.strip() and not line.startswith((b"%", b";")):
+            in_headers = False
+        position += len(line)
+
+
+def iter_games(stream, start: int = 0):
+    """
+    Com scan_games(), però genera (offset, bytes) amb el text de cada partida.
+    Serveix per importar sense haver de tornar a fer seek per cada partida.
+    """
+    stream.seek(start)
+    position = start
+    game_start = None
+    lines = []
+    in_headers = False
+    for line in stream:
+        if line.startswith(b"["):
+            if not in_headers:
+                in_headers = True
+                if game_start is not None:
+                    yield game_start, b"".join(lines)
+                game_start = position
+                lines = []
+        elif line.strip() and not line.startswith((b"%", b";")):
+            in_headers = False
+        if game_start is not None:
+            lines.append(line)
+        position += len(line)
+    if game_start is not None:
+        yield game_start, b"".join(lines)
+
+
+class PgnIndex:
+    """
+    Índex d'offsets de partides d'un fitxer PGN (comprimit o no).
+    build() llegeix el fitxer un cop en streaming; després read_game(i)
+    salta directament a la partida via seek (checkpoints si és comprimit).
+    L'índex es pot desar al costat del fitxer (save/load) per no refer-lo.
+    """
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.offsets = array('Q')
+        self.file_size = 0
+        self.file_mtime = 0.0
+        self._stream = None
+
+    def _open(self):
+        if self._stream is None:
+            self._stream = open_pgn_binary(self.filename)
+        return self._stream
+
+    @classmethod
+    def build(cls, filename: str) -> "PgnIndex":
+        index = cls(filename)
+        stat = os.stat(filename)
+        index.file_size, index.file_mtime = stat.st_size, stat.st_mtime
+        index.offsets.extend(scan_games(index._open()))
+        log.info("Índex PGN: %d partides a %s", len(index.offsets), filename)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def read_game_text(self, i: int) -> str:
+        stream = self._open()
+        stream.seek(self.offsets[i])
+        if i + 1 < len(self.offsets):
+            data = stream.read(self.offsets[i + 1] - self.offsets[i])
+        else:
+            data = stream.read()
+        return data.decode('utf-8', errors='replace')
+
+    def read_game(self, i: int, Visitor=chess.pgn.GameBuilder):
+        return chess.pgn.read_game(io.StringIO(self.read_game_text(i)), Visitor=Visitor)
+
+    def read_headers(self, i: int) -> chess.pgn.Headers | None:
+        return chess.pgn.read_headers(io.StringIO(self.read_game_text(i)))
+
+    def is_current(self) -> bool:
+        """Cert si el fitxer no ha canviat des que es va construir l'índex."""
+        stat = os.stat(self.filename)
+        return stat.st_size == self.file_size and stat.st_mtime == self.file_mtime
+
+    # --- Persistència (fitxer .idx al costat del PGN) ---
+    def save(self, path: str | None = None):
+        path = path or self.filename + ".idx"
+        stream = self._open()
+        raw = getattr(stream, "raw", None)
+        meta = {
+            "size": self.file_size,
+            "mtime": self.file_mtime,
+            "count": len(self.offsets),
+            "checkpoints": raw.frame_checkpoints() if isinstance(raw, CompressedReader) else [],
+        }
+        with open(path, 'wb') as f:
+            f.write(json.dumps(meta).encode() + b"\n")
+            self.offsets.tofile(f)
+
+    @classmethod
+    def load(cls, filename: str, path: str | None = None) -> "PgnIndex | None":
+        """Carrega l'índex desat; None si no existeix o el PGN ha canviat."""
+        path = path or filename + ".idx"
+        if not os.path.exists(path):
+            return None
+        index = cls(filename)
+        with open(path, 'rb') as f:
+            meta = json.loads(f.readline())
+            index.offsets.fromfile(f, meta["count"])
+        index.file_size, index.file_mtime = meta["size"], meta["mtime"]
+        if not index.is_current():
+            return None
+        raw = getattr(index._open(), "raw", None)
+        if isinstance(raw, CompressedReader):
+            raw.add_frame_checkpoints(meta["checkpoints"])
+        return index
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+
+class PgnTail:
+    """
+    Seguiment incremental d'un fitxer PGN que va creixent (retransmissions).
+    refresh() només torna a escanejar des de l'inici de l'última partida
+    coneguda si el fitxer només ha crescut (mateix inode, mida més gran i els
+    bytes abans de l'última partida iguals); si s'ha reescrit, o si es demana
+    full=True, reescaneja tot però compara un resum (hash) de cada partida per
+    dir quines han canviat. Així només cal tornar a parsejar les partides noves
+    o modificades.
+    """
+    ANCHOR_SIZE = 4096 # Bytes abans de l'última partida que han de quedar iguals
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.offsets = [] # Inici de cada partida (bytes descomprimits)
+        self.digests = [] # Hash del text de cada partida
+        self.end = 0 # Final de les dades llegides (bytes descomprimits)
+        self.file_size = -1
+        self.file_mtime = 0.0
+        self.file_inode = None
+        self._anchor = b""
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def _anchor_digest(self, stream, offset: int) -> bytes:
+        start = max(0, offset - self.ANCHOR_SIZE)
+        stream.seek(start)
+        return hashlib.blake2b(stream.read(offset - start), digest_size=16).digest()
+
+    def refresh(self, full: bool = False) -> list[int]:
+        """Actualitza l'estat i retorna els índexs de partides noves o modificades."""
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError: # Pot passar mentre l'altre programa el reescriu
+            return []
+        if not full and stat.st_size == self.file_size and stat.st_mtime == self.file_mtime:
+            return []
+        with open_pgn_binary(self.filename) as stream:
+            first = 0
+            if not full and self.offsets and stat.st_ino == self.file_inode and stat.st_size >= self.file_size \
+                    and self._anchor_digest(stream, self.offsets[-1]) == self._anchor:
+                first = len(self.offsets) - 1 # Només ha crescut: des de l'última partida
+            offsets = self.offsets[:first] + list(scan_games(stream, self.offsets[first] if first else 0))
+            digests = self.digests[:first]
+            changed = []
+            stream.seek(offsets[first] if len(offsets) > first else 0)
+            for i in range(first, len(offsets)):
+                if i + 1 < len(offsets):
+                    data = stream.read(offsets[i + 1] - offsets[i])
+                else:
+                    data = stream.read()
+                digest = hashlib.blake2b(data, digest_size=16).digest()
+                digests.append(digest)
+                if i >= len(self.digests) or self.digests[i] != digest:
+                    changed.append(i)
+            self.end = stream.tell()
+            self._anchor = self._anchor_digest(stream, offsets[-1]) if offsets else b""
+        if len(offsets) < len(self.offsets): # El fitxer ara té menys partides
+            changed.extend(range(len(offsets), len(self.offsets)))
+        self.offsets, self.digests = offsets, digests
+        self.file_size, self.file_mtime, self.file_inode = stat.st_size, stat.st_mtime, stat.st_ino
+        return changed
+
+    def read_game_text(self, i: int) -> str:
+        with open_pgn_binary(self.filename) as stream:
+            stream.seek(self.offsets[i])
+            if i + 1 < len(self.offsets):
+                data = stream.read(self.offsets[i + 1] - self.offsets[i])
+            else:
+                data = stream.read()
+        return data.decode('utf-8', errors='replace')
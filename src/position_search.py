@@ -0,0 +1,417 @@
+# src/position_search.py
+"""
+Cerca de posicions per material, peces a caselles i estructura de peons.
+
+Per cada posició (cada ply de la línia principal de cada partida de la BBDD)
+es guarden columnes binàries en un directori al costat de la BBDD
+(<bbdd>.positions/), que es llegeixen amb np.memmap. Cada bitboard és un
+fitxer a part: una condició sobre els peons blancs només llegeix bb_wp.bin.
+
+    bb_wp.bin ...   uint64        ocupació d'una peça i color (bb_wp, bb_wn... bb_bk): 12 fitxers
+    material.bin    uint64        signatura de material (veure material_signature)
+    games.bin       uint32        índex de la partida dins game_*.bin
+    plies.bin       uint16        ply de la posició
+    turn.bin        uint8         1 si mouen les blanques (les partides des d'un FEN poden començar amb les negres)
+
+per cada partida:
+
+    game_ids.bin    int64         id a la taula 'games'
+    game_starts.bin uint64        primera posició de la partida
+
+i una entrada per cada signatura de material diferent de cada partida:
+
+    material_keys.bin  uint64     signatura
+    material_games.bin uint32     índex de la partida
+
+Les entrades de material estan ordenades per (signatura, partida) dins de
+cada tram ("material_runs" a meta.json: un per lot indexat; quan n'hi ha
+més de MAX_MATERIAL_RUNS es fusionen). Una cerca amb material primer busca
+les partides que hi arriben (np.searchsorted a cada tram) i, si no són
+massa, només llegeix les posicions d'aquestes (indexació per arrays sobre
+el memmap). Les condicions són màscares NumPy sobre blocs de CHUNK_ROWS
+posicions: les dades no passen mai per objectes chess.Board.
+
+L'índex és incremental: update() només afegeix les partides amb id més gran
+que l'última indexada. Les partides esborrades de la BBDD (reimportacions)
+poden quedar a l'índex: cal filtrar els resultats contra 'games' o fer rebuild.
+Un índex d'una versió anterior (INDEX_VERSION a meta.json) es reconstrueix
+sencer a la primera update(). Cada reconstrucció té un identificador nou
+('build' a meta.json) que els índexs derivats (similarity.py) comproven.
+
+La construcció recorre les jugades en Python (desenes de milers de
+posicions per segon): la interfície la fa en un fil (veure main.py) i
+pgn_importer.py la fa en acabar d'importar.
+"""
+import json
+import logging
+import os
+import time
+import chess
+
+try:
+    import numpy as np
+except ImportError: # Opcional: sense NumPy no hi ha cerca de posicions
+    np = None
+
+from db_manager import GameDatabase, decode_moves
+from instrumentation import metrics
+
+log = logging.getLogger(__name__)
+
+INDEX_VERSION = 3 # 2: columna turn; 3: signatures de material per partida (en lloc del filtre de Bloom)
+MAX_MATERIAL_RUNS = 8
+CHUNK_ROWS = 1 << 22 # Posicions per bloc de filtratge (32 MB per columna uint64)
+BITBOARD_COLUMNS = [f"bb_{'wb'[color == chess.BLACK]}{chess.piece_symbol(piece_type)}"
+                    for color in (chess.WHITE, chess.BLACK) for piece_type in chess.PIECE_TYPES]
+COLUMN_FILES = {
+    **{name: "uint64" for name in BITBOARD_COLUMNS},
+    "material": "uint64",
+    "games": "uint32",
+    "plies": "uint16",
+    "turn": "uint8",
+    "game_ids": "int64",
+    "game_starts": "uint64",
+    "material_keys": "uint64",
+    "material_games": "uint32",
+}
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("Cal el paquet 'numpy' per la cerca de posicions (pip install numpy)")
+
+
+def piece_column(piece: chess.Piece) -> str:
+    """Nom de la columna de bitboard d'una peça (ex: bb_wp, bb_bk)."""
+    return BITBOARD_COLUMNS[(0 if piece.color == chess.WHITE else 6) + piece.piece_type - 1]
+
+
+def material_signature(counts_white, counts_black) -> int:
+    """
+    Empaqueta el nombre de P, N, B, R, Q de cada color en 4 bits per peça
+    (blanques als bits 0-19, negres als 20-39). El rei no hi compta.
+    """
+    signature = 0
+    for shift, counts in ((0, counts_white), (20, counts_black)):
+        for i, count in enumerate(counts):
+            signature |= min(count, 15) << (shift + 4 * i)
+    return signature
+
+
+def board_signature(board: chess.Board) -> int:
+    counts = [[(board.pieces_mask(piece_type, color)).bit_count() for piece_type in chess.PIECE_TYPES[:5]]
+              for color in (chess.WHITE, chess.BLACK)]
+    return material_signature(*counts)
+
+
+def parse_material(text: str) -> int:
+    """
+    "KRP vs KR", "RP-R" o "R+P v R" -> signatura. Blanques primer. Les lletres
+    repetides compten (ex: "RPP vs R"); els reis són opcionals.
+    """
+    separators = (" vs ", " v ", "-", "/")
+    lowered = f" {text.strip().lower()} "
+    for separator in separators:
+        if separator in lowered:
+            white_text, black_text = lowered.split(separator, 1)
+            break
+    else:
+        raise ValueError(f"Material no vàlid (cal 'blanques vs negres'): {text}")
+    counts = []
+    for side in (white_text, black_text):
+        side_counts = [0] * 5
+        for symbol in side.replace("+", "").replace(" ", ""):
+            if symbol == "k":
+                continue
+            if symbol not in "pnbrq":
+                raise ValueError(f"Peça desconeguda '{symbol}' a: {text}")
+            side_counts["pnbrq".index(symbol)] += 1
+        counts.append(side_counts)
+    return material_signature(*counts)
+
+
+class PositionQuery:
+    """
+    Condicions d'una cerca (totes s'han de complir):
+    - material: signatura exacta (parse_material o board_signature)
+    - pieces: {casella: chess.Piece} que han de ser-hi
+    - pawns: (bitboard de peons blancs, bitboard de peons negres) exactes
+    - side_to_move: chess.WHITE / chess.BLACK / None
+    """
+    def __init__(self, material: int | str | None = None, pieces: dict | None = None,
+                 pawns: tuple[int, int] | None = None, side_to_move: bool | None = None):
+        self.material = parse_material(material) if isinstance(material, str) else material
+        self.pieces = pieces or {}
+        self.pawns = pawns
+        self.side_to_move = side_to_move
+
+    @classmethod
+    def from_board(cls, board: chess.Board, material: bool = True, pieces: bool = False, pawns: bool = False):
+        """Consulta a partir d'un tauler (per exemple, el del ChessboardWidget)."""
+        return cls(material=board_signature(board) if material else None,
+                   pieces=board.piece_map() if pieces else None,
+                   pawns=(int(board.pawns & board.occupied_co[chess.WHITE]),
+                          int(board.pawns & board.occupied_co[chess.BLACK])) if pawns else None)
+
+    def is_empty(self) -> bool:
+        return self.material is None and not self.pieces and self.pawns is None and self.side_to_move is None
+
+
+class PositionIndex:
+    """Índex de posicions en columnes memmap (veure el docstring del mòdul)."""
+    def __init__(self, directory: str):
+        _require_numpy()
+        self.directory = directory
+        self.meta = self._empty_meta()
+        meta_path = os.path.join(directory, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+        self._maps = {}
+
+    @staticmethod
+    def _empty_meta() -> dict:
+        # 'build' canvia a cada reconstrucció: els índexs derivats (similarity) saben que s'han de refer
+        return {"positions": 0, "games": 0, "last_game_id": 0, "material_entries": 0, "material_runs": [],
+                "version": INDEX_VERSION, "build": f"{time.time_ns():x}"}
+
+    @property
+    def outdated(self) -> bool:
+        """Índex d'una versió anterior: update() el reconstruirà."""
+        return self.meta.get("version", 1) != INDEX_VERSION
+
+    @classmethod
+    def for_database(cls, db: GameDatabase) -> "PositionIndex":
+        return cls(os.path.abspath(db.path) + ".positions")
+
+    def __len__(self) -> int:
+        return self.meta["positions"]
+
+    def _count(self, name: str) -> int:
+        """Files d'una columna segons meta.json."""
+        if name.startswith("game_"):
+            return self.meta["games"]
+        if name.startswith("material_"):
+            return self.meta.get("material_entries", 0)
+        return self.meta["positions"]
+
+    def _column(self, name: str):
+        """memmap de només lectura d'una columna (None si encara és buida)."""
+        count = self._count(name)
+        if not count:
+            return None
+        column = self._maps.get(name)
+        if column is None or len(column) != count:
+            column = np.memmap(os.path.join(self.directory, name + ".bin"), dtype=COLUMN_FILES[name],
+                               mode="r", shape=(count,))
+            self._maps[name] = column
+        return column
+
+    # --- Construcció (incremental) ---
+    def update(self, db: GameDatabase, rebuild: bool = False, batch_games: int = 2000, progress=None) -> int:
+        """Afegeix a l'índex les partides noves de la BBDD. Retorna quantes n'ha afegit."""
+        started = time.perf_counter()
+        if rebuild or self.outdated:
+            self.meta = self._empty_meta()
+            self._maps.clear()
+            if os.path.isdir(self.directory): # També les columnes de versions anteriors (game_bloom.bin...)
+                for name in os.listdir(self.directory):
+                    if name.endswith(".bin"):
+                        os.remove(os.path.join(self.directory, name))
+        os.makedirs(self.directory, exist_ok=True)
+        self._maps.clear() # Els fitxers creixeran: es tornen a mapar en llegir
+        self._truncate_to_meta()
+        added = 0
+        cursor = db.conn.execute("SELECT id, fen, moves FROM games WHERE id > ? ORDER BY id",
+                                 (self.meta["last_game_id"],))
+        while True:
+            rows = cursor.fetchmany(batch_games)
+            if not rows:
+                break
+            self._append_games(rows)
+            self._save_meta() # Cada lot queda consolidat: una interrupció no perd la feina feta
+            added += len(rows)
+            if progress:
+                progress(added)
+        if len(self.meta["material_runs"]) > MAX_MATERIAL_RUNS:
+            self._merge_material_runs()
+        self._save_meta()
+        if added:
+            log.info("Índex de posicions: +%d partides (%d posicions) en %.1f s",
+                     added, self.meta["positions"], time.perf_counter() - started)
+        return added
+
+    def _append_games(self, rows):
+        bitboards = [[] for _ in BITBOARD_COLUMNS]
+        material, games, plies, turn = [], [], [], []
+        game_ids, game_starts, material_keys, material_games = [], [], [], []
+        position = self.meta["positions"]
+        game_index = self.meta["games"]
+        for game_id, fen, blob in rows:
+            try:
+                board = chess.Board(fen)
+            except ValueError:
+                log.warning("FEN no vàlid a la partida %d: no s'indexa", game_id)
+                continue
+            game_ids.append(game_id)
+            game_starts.append(position)
+            signatures = set()
+            moves = decode_moves(blob)
+            for ply in range(len(moves) + 1):
+                white, black = board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK]
+                masks = [board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings]
+                for column, value in zip(bitboards, [m & white for m in masks] + [m & black for m in masks]):
+                    column.append(value)
+                signature = material_signature([(m & white).bit_count() for m in masks[:5]],
+                                               [(m & black).bit_count() for m in masks[:5]])
+                material.append(signature)
+                signatures.add(signature)
+                games.append(game_index)
+                plies.append(ply)
+                turn.append(board.turn)
+                position += 1
+                if ply < len(moves):
+                    board.push(moves[ply])
+            material_keys.extend(signatures)
+            material_games.extend([game_index] * len(signatures))
+            game_index += 1
+        keys = np.asarray(material_keys, dtype=np.uint64)
+        owners = np.asarray(material_games, dtype=np.uint32)
+        order = np.lexsort((owners, keys)) # Un tram nou, ordenat per (signatura, partida)
+        columns = {
+            **dict(zip(BITBOARD_COLUMNS, bitboards)), "material": material, "games": games, "plies": plies, "turn": turn,
+            "game_ids": game_ids, "game_starts": game_starts,
+            "material_keys": keys[order], "material_games": owners[order],
+        }
+        for name, values in columns.items():
+            with open(os.path.join(self.directory, name + ".bin"), "ab") as f:
+                np.asarray(values, dtype=COLUMN_FILES[name]).tofile(f)
+        self.meta["positions"] = position
+        self.meta["games"] = game_index
+        self.meta["last_game_id"] = rows[-1][0]
+        if len(keys):
+            self.meta["material_entries"] += len(keys)
+            self.meta["material_runs"].append(self.meta["material_entries"])
+
+    def _merge_material_runs(self):
+        """Fusiona els trams de signatures en un de sol (una cerca binària en lloc de moltes)."""
+        count = self.meta["material_entries"]
+        keys = np.fromfile(os.path.join(self.directory, "material_keys.bin"), dtype=np.uint64, count=count)
+        owners = np.fromfile(os.path.join(self.directory, "material_games.bin"), dtype=np.uint32, count=count)
+        order = np.lexsort((owners, keys))
+        for name, values in (("material_keys", keys[order]), ("material_games", owners[order])):
+            path = os.path.join(self.directory, name + ".bin")
+            values.tofile(path + ".tmp")
+            os.replace(path + ".tmp", path) # Si s'interromp, cada tram antic continua ordenat
+        self.meta["material_runs"] = [count]
+        self._maps.clear()
+
+    def _truncate_to_meta(self):
+        """Descarta files escrites després de l'últim meta.json (actualització interrompuda)."""
+        for name, dtype in COLUMN_FILES.items():
+            path = os.path.join(self.directory, name + ".bin")
+            size = self._count(name) * np.dtype(dtype).itemsize
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+
+    def _save_meta(self):
+        with open(os.path.join(self.directory, "meta.json"), "w") as f:
+            json.dump(self.meta, f)
+
+    # --- Cerca ---
+    def _blocks(self, query: PositionQuery):
+        """
+        Genera els blocs de posicions a examinar: slices de CHUNK_ROWS files o,
+        si el prefiltre de material deixa poques partides candidates, arrays
+        amb els índexs de les seves posicions (el memmap només llegeix aquestes pàgines).
+        """
+        total = self.meta["positions"]
+        candidates = None
+        if query.material is not None:
+            candidates = self._material_games(query.material)
+            metrics.set_gauge("positions.candidate_games", len(candidates))
+        if candidates is None or len(candidates) > self.meta["games"] // 4:
+            for begin in range(0, total, CHUNK_ROWS):
+                yield slice(begin, min(begin + CHUNK_ROWS, total))
+            return
+        starts = self._column("game_starts").astype(np.int64)
+        ends = np.append(starts[1:], total)
+        # Concatena els rangs [inici, final) de cada partida candidata, per blocs
+        step = max(1, len(candidates) * CHUNK_ROWS // max(total, 1))
+        for i in range(0, len(candidates), step):
+            chosen = candidates[i:i + step]
+            lengths = ends[chosen] - starts[chosen]
+            firsts = np.cumsum(lengths) - lengths
+            yield np.arange(lengths.sum()) + np.repeat(starts[chosen] - firsts, lengths)
+
+    def _material_games(self, signature: int) -> "np.ndarray":
+        """Índexs (ordenats) de les partides amb alguna posició amb aquesta signatura de material."""
+        keys, owners = self._column("material_keys"), self._column("material_games")
+        if keys is None:
+            return np.empty(0, dtype=np.int64)
+        found = []
+        low = 0
+        for high in self.meta["material_runs"]:
+            run = keys[low:high]
+            first = np.searchsorted(run, np.uint64(signature), side="left")
+            last = np.searchsorted(run, np.uint64(signature), side="right")
+            if last > first:
+                found.append(np.asarray(owners[low + first:low + last], dtype=np.int64))
+            low = high
+        return np.unique(np.concatenate(found)) if found else np.empty(0, dtype=np.int64)
+
+    def _match_block(self, query: PositionQuery, rows):
+        """Màscara booleana de les posicions 'rows' (slice o array d'índexs) que compleixen la consulta."""
+        mask = None
+        if query.material is not None:
+            mask = self._column("material")[rows] == np.uint64(query.material)
+        if query.side_to_move is not None:
+            side = self._column("turn")[rows] == (1 if query.side_to_move == chess.WHITE else 0)
+            mask = side if mask is None else mask & side
+        if mask is not None and not mask.any():
+            return mask
+        if query.pieces or query.pawns is not None:
+            conditions = [((piece_column(piece), chess.BB_SQUARES[square]), False)
+                          for square, piece in query.pieces.items()]
+            if query.pawns is not None:
+                conditions += [(("bb_wp", query.pawns[0]), True), (("bb_bp", query.pawns[1]), True)]
+            for (column, bits), exact in conditions:
+                values = self._column(column)[rows]
+                condition = values == np.uint64(bits) if exact else (values & np.uint64(bits)) != 0
+                mask = condition if mask is None else mask & condition
+        return mask
+
+    def search(self, query: PositionQuery, limit: int | None = None) -> list[tuple[int, int]]:
+        """
+        Retorna [(id de partida, ply)] de les posicions que compleixen la consulta,
+        en ordre d'índex. Amb 'limit' s'atura en arribar-hi.
+        """
+        if not self.meta["positions"] or query.is_empty():
+            return []
+        with metrics.timer("positions.search"):
+            games = self._column("games")
+            plies = self._column("plies")
+            game_ids = self._column("game_ids")
+            results = []
+            for rows in self._blocks(query):
+                mask = self._match_block(query, rows)
+                if isinstance(rows, slice):
+                    hits = np.nonzero(mask)[0] + rows.start
+                else:
+                    hits = rows[mask]
+                if len(hits):
+                    ids = game_ids[games[hits]]
+                    results.extend(zip(ids.tolist(), plies[hits].tolist()))
+                    if limit is not None and len(results) >= limit:
+                        return results[:limit]
+            return results
+
+    def search_games(self, query: PositionQuery, limit: int | None = None) -> list[int]:
+        """Ids de les partides (sense repetir) amb alguna posició que compleix la consulta."""
+        seen = {}
+        for game_id, ply in self.search(query):
+            if game_id not in seen:
+                seen[game_id] = ply
+                if limit is not None and len(seen) >= limit:
+                    break
+        return list(seen)
@@ -0,0 +1,514 @@
+# src/puzzle_miner.py
+"""
+Extracció de problemes tàctics (puzzles) de col·leccions de partides PGN.
+
+Tres etapes en paral·lel, unides per cues de mida limitada (si una etapa va
+més lenta, les anteriors s'esperen i la memòria no creix):
+
+1. Lectura: un fil llegeix el PGN en streaming (pgn_io.iter_games, comprimit
+   o no) i passa el text de cada partida.
+2. Passada ràpida: SCAN_WORKERS motors d'un fil avaluen cada posició de la
+   línia principal a SCAN_DEPTH. Una jugada és candidata si l'avaluació del
+   qui la fa cau com a mínim MIN_SWING cp i deixa el rival guanyant (com a
+   mínim WIN_THRESHOLD cp) quan abans no ho estava.
+3. Confirmació: els candidats es tornen a analitzar a CONFIRM_DEPTH amb dues
+   línies. És un problema si la millor jugada guanya i és única: la segona
+   queda com a mínim UNIQUE_MARGIN cp per sota i no guanya.
+
+Cada problema és una línia TSV: id, FEN (el torn és del qui resol), solució
+(uci; la PV mentre el qui resol continuï amb captures, escacs o
+promocions), temes, puntuació, jugada que l'ha provocat i partida
+(fitxer:offset, blanques, negres). El mateix problema (mateixa posició) surt
+un sol cop.
+
+Es pot interrompre i continuar: cada CHECKPOINT_SECONDS es desa al fitxer
+<sortida>.state l'offset fins on totes les partides estan acabades (amb els
+seus problemes ja escrits). En tornar a començar es continua des d'allà; els
+problemes de les partides que ja s'havien fet després d'aquell punt no es
+repeteixen (es llegeixen els ids del fitxer de sortida).
+
+Ús (des de src):
+    python puzzle_miner.py partides.pgn.zst --output puzzles.tsv [--workers 16]
+"""
+import argparse
+import hashlib
+import io
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import chess
+import chess.pgn
+from engine_manager import ChessEngine, AnalysisCache
+from engine_profiles import EngineProfiles
+from pgn_importer import MainlineVisitor
+from pgn_io import open_pgn_binary, iter_games, CompressedReader
+
+log = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_ENGINE = os.environ.get("GEMINI_CHESS_ENGINE") or \
+    os.path.join(BASE_DIR, "..", "assets", "engines", "stockfish-ubuntu-x86-64-sse41-popcnt")
+SCAN_DEPTH = 10
+CONFIRM_DEPTH = 18
+MIN_SWING = 250 # cp que perd el qui fa la jugada
+WIN_THRESHOLD = 200 # cp a partir dels quals el qui resol "guanya"
+UNIQUE_MARGIN = 150 # cp entre la millor jugada i la segona
+MATE_SCORE = 10000
+SCORE_CAP = 1500 # Les puntuacions es limiten a ±SCORE_CAP per comparar (un mat en 3 o en 5 no és una caiguda)
+MAX_SOLUTION_PLIES = 7
+QUEUE_SIZE = 4 # Elements per fil consumidor a cada cua
+CHECKPOINT_SECONDS = 30
+PROGRESS_SECONDS = 10
+PIECE_VALUES = {chess.PAWN: 1, chess.KNIGHT: 3, chess.BISHOP: 3, chess.ROOK: 5, chess.QUEEN: 9, chess.KING: 100}
+COLUMNS = ("id", "fen", "moves", "themes", "score", "blunder", "game", "white", "black")
+
+
+def line_score(line: dict) -> int:
+    """Puntuació (cp, punt de vista de les blanques) d'una línia de get_analysis."""
+    if line.get("Mate") is not None:
+        mate = line["Mate"]
+        return (MATE_SCORE - abs(mate)) * (1 if mate > 0 else -1)
+    return line.get("Centipawn") or 0
+
+
+def position_score(lines: list, board: chess.Board) -> int:
+    """Com line_score per la millor línia; les posicions acabades no en tenen."""
+    if lines:
+        return line_score(lines[0])
+    if board.is_checkmate():
+        return -MATE_SCORE if board.turn == chess.WHITE else MATE_SCORE
+    return 0
+
+
+def puzzle_id(fen: str) -> str:
+    return hashlib.blake2b(AnalysisCache.position_key(fen).encode(), digest_size=6).hexdigest()
+
+
+def material(board: chess.Board, color: chess.Color) -> int:
+    return sum(len(board.pieces(piece, color)) * PIECE_VALUES[piece] for piece in PIECE_VALUES if piece != chess.KING)
+
+
+def find_swings(scores: list, board: chess.Board, moves: list) -> list[int]:
+    """
+    Índexs i de les jugades moves[i] que regalen l'avantatge. scores[i] és la
+    puntuació (blanques) de la posició abans de moves[i]; scores[-1], la final.
+    """
+    swings = []
+    turn = board.turn
+    for i in range(len(moves)):
+        sign = 1 if turn == chess.WHITE else -1
+        before = max(-SCORE_CAP, min(SCORE_CAP, scores[i] * sign))
+        after = max(-SCORE_CAP, min(SCORE_CAP, scores[i + 1] * sign))
+        if before - after >= MIN_SWING and -after >= WIN_THRESHOLD and -before < WIN_THRESHOLD:
+            swings.append(i)
+        turn = not turn
+    return swings
+
+
+def solution_line(board: chess.Board, pv: list[str]) -> list[str]:
+    """Primera jugada de la PV i les següents del qui resol mentre siguin forçades (captura, escac, promoció)."""
+    board = board.copy(stack=False)
+    line = [pv[0]]
+    board.push_uci(pv[0])
+    i = 1
+    while i + 1 < len(pv) and len(line) + 2 <= MAX_SOLUTION_PLIES and not board.is_game_over():
+        board.push_uci(pv[i])
+        move = chess.Move.from_uci(pv[i + 1])
+        if not (board.is_capture(move) or board.gives_check(move) or move.promotion):
+            break
+        board.push(move)
+        line += pv[i:i + 2]
+        i += 2
+    return line
+
+
+def themes(board: chess.Board, line: list[str], best: dict, ply: int) -> list[str]:
+    """Temes simples que es poden deduir de la posició i de la solució."""
+    found = []
+    solver = board.turn
+    if best.get("Mate") is not None and best["Mate"] * (1 if solver == chess.WHITE else -1) > 0:
+        found += ["mate", f"mateIn{(len(line) + 1) // 2}"]
+    first = chess.Move.from_uci(line[0])
+    mover = board.piece_at(first.from_square)
+    if board.is_capture(first) and not board.is_en_passant(first) \
+            and not board.is_attacked_by(not solver, first.to_square):
+        found.append("hangingPiece")
+    after = board.copy(stack=False)
+    after.push(first)
+    if mover is not None:
+        value = PIECE_VALUES[mover.piece_type]
+        targets = 0
+        for square in after.attacks(first.to_square):
+            target = after.piece_at(square)
+            if target is not None and target.color != solver and (
+                    target.piece_type == chess.KING or PIECE_VALUES[target.piece_type] > value
+                    or not after.is_attacked_by(not solver, square)):
+                targets += 1
+        if targets >= 2:
+            found.append("fork")
+    if len(line) > 1: # Sacrifici: després de la resposta el qui resol té menys material que abans
+        reply = after.copy(stack=False)
+        reply.push_uci(line[1])
+        if material(reply, solver) - material(reply, not solver) < material(board, solver) - material(board, not solver):
+            found.append("sacrifice")
+    if any(chess.Move.from_uci(move).promotion for move in line[::2]):
+        found.append("promotion")
+    heavy = material(board, chess.WHITE) + material(board, chess.BLACK) \
+        - len(board.pieces(chess.PAWN, chess.WHITE)) - len(board.pieces(chess.PAWN, chess.BLACK))
+    found.append("opening" if ply < 20 else "endgame" if heavy <= 26 else "middlegame")
+    found.append("oneMove" if len(line) == 1 else "short" if len(line) <= 3 else "long")
+    return found
+
+
+class _Game:
+    """Una partida llegida: seq (ordre al fitxer), offset, final i text."""
+    __slots__ = ("seq", "offset", "end", "data")
+
+    def __init__(self, seq: int, offset: int, end: int, data: bytes):
+        self.seq, self.offset, self.end, self.data = seq, offset, end, data
+
+
+class PuzzleMiner:
+    """
+    Pipeline d'extracció. run(filename) processa un fitxer (continuant des de
+    l'estat desat si n'hi ha) i escriu els problemes a 'output'.
+    """
+    def __init__(self, output: str, engine_path: str = DEFAULT_ENGINE, scan_workers: int = 1,
+                 confirm_workers: int = 1, engine_options: dict | None = None,
+                 scan_depth: int = SCAN_DEPTH, confirm_depth: int = CONFIRM_DEPTH):
+        self.output = output
+        self.state_path = output + ".state"
+        self.engine_path = engine_path
+        self.scan_workers = max(1, scan_workers)
+        self.confirm_workers = max(1, confirm_workers)
+        self.engine_options = {"Threads": 1, **(engine_options or {})}
+        self.scan_depth = scan_depth
+        self.confirm_depth = confirm_depth
+        self.stats = {"games": 0, "positions": 0, "candidates": 0, "puzzles": 0, "errors": 0}
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._seen = self._load_ids() # Posicions ja escrites o ja enviades a confirmar
+        self._source = ""
+        self._engines = []
+        self._state = self._load_state()
+
+    # --- Estat i sortida ---
+    def _load_ids(self) -> set:
+        ids = set()
+        if not os.path.exists(self.output):
+            return ids
+        with open(self.output, "r+b") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"): # Línia a mitges d'una execució interrompuda
+                f.truncate(data.rfind(b"\n") + 1)
+                data = data[:data.rfind(b"\n") + 1]
+        for line in data.decode("utf-8", errors="replace").splitlines()[1:]:
+            ids.add(line.split("\t", 1)[0])
+        return ids
+
+    def _load_state(self) -> dict:
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            log.warning("No s'ha pogut llegir l'estat %s (es torna a començar): %s", self.state_path, e)
+            return {}
+
+    def _save_state(self, out):
+        out.flush()
+        os.fsync(out.fileno()) # Els problemes, al disc abans que l'offset que els dona per fets
+        temporary = self.state_path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(self._state, f, indent=2)
+        os.replace(temporary, self.state_path)
+
+    # --- Etapes ---
+    def _put(self, target: queue.Queue, item) -> bool:
+        """put() que deixa d'esperar si s'atura el pipeline."""
+        while not self._stop.is_set():
+            try:
+                target.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _get(self, source: queue.Queue):
+        """get() que torna None si s'atura el pipeline (l'etapa anterior pot no arribar a posar els finals)."""
+        while not self._stop.is_set():
+            try:
+                return source.get(timeout=0.5)
+            except queue.Empty:
+                pass
+        return None
+
+    def _read(self, stream, start: int, games: queue.Queue):
+        try:
+            seq = 0
+            for offset, data in iter_games(stream, start):
+                if not self._put(games, _Game(seq, offset, offset + len(data), data)):
+                    return
+                seq += 1
+        except Exception as e:
+            log.error("Error llegint el PGN: %s", e)
+            self._stop.set()
+        finally:
+            for _ in range(self.scan_workers):
+                self._put(games, None)
+
+    def _scan(self, engine: ChessEngine, games: queue.Queue, candidates: queue.Queue, results: queue.Queue):
+        while not self._stop.is_set():
+            game = self._get(games)
+            if game is None:
+                return
+            sent = 0
+            parsed = chess.pgn.read_game(io.StringIO(game.data.decode("utf-8", errors="replace")),
+                                         Visitor=MainlineVisitor)
+            if parsed is not None:
+                headers, moves, _ = parsed
+                try:
+                    board = chess.Board(headers.get("FEN")) if headers.get("FEN") else chess.Board()
+                except ValueError:
+                    moves = []
+                    board = chess.Board()
+                start = board.copy(stack=False)
+                fens, scores = [], []
+                for move in [None] + moves:
+                    if move is not None:
+                        board.push(move)
+                    fen = board.fen()
+                    lines = [] if board.is_game_over() else engine.get_analysis(fen, self.scan_depth, 1)
+                    if lines is None: # La partida es perd; el motor es torna a engegar per les següents
+                        self._count("errors")
+                        engine = self._replace_engine(engine)
+                        break
+                    fens.append(fen)
+                    scores.append(position_score(lines, board))
+                else:
+                    self._count("positions", len(fens))
+                    for i in find_swings(scores, start, moves):
+                        fen = fens[i + 1]
+                        key = puzzle_id(fen)
+                        with self._lock:
+                            if key in self._seen:
+                                continue
+                            self._seen.add(key)
+                        candidate = {"seq": game.seq, "fen": fen, "ply": start.ply() + i + 1,
+                                     "blunder": moves[i].uci(), "game": f"{self._source}:{game.offset}",
+                                     "white": headers.get("White", "?"), "black": headers.get("Black", "?")}
+                        if not self._put(candidates, candidate):
+                            return
+                        sent += 1
+            self._put(results, ("scanned", game.seq, game.end, sent))
+
+    def _confirm(self, engine: ChessEngine, candidates: queue.Queue, results: queue.Queue):
+        while not self._stop.is_set():
+            candidate = self._get(candidates)
+            if candidate is None:
+                return
+            puzzle = None
+            lines = engine.get_analysis(candidate["fen"], self.confirm_depth, 2)
+            if lines is None:
+                self._count("errors")
+                engine = self._replace_engine(engine)
+            elif lines:
+                puzzle = self._puzzle(candidate, lines)
+            self._put(results, ("confirmed", candidate["seq"], puzzle))
+
+    def _puzzle(self, candidate: dict, lines: list) -> dict | None:
+        board = chess.Board(candidate["fen"])
+        sign = 1 if board.turn == chess.WHITE else -1
+        best = line_score(lines[0]) * sign
+        second = line_score(lines[1]) * sign if len(lines) > 1 else None
+        if best < WIN_THRESHOLD:
+            return None
+        if second is not None and (second >= WIN_THRESHOLD or best - second < UNIQUE_MARGIN):
+            return None
+        moves = solution_line(board, lines[0]["PV"])
+        return {"id": puzzle_id(candidate["fen"]), "fen": candidate["fen"], "moves": " ".join(moves),
+                "themes": " ".join(themes(board, moves, lines[0], candidate["ply"])), "score": best,
+                "blunder": candidate["blunder"], "game": candidate["game"],
+                "white": candidate["white"], "black": candidate["black"]}
+
+    def _replace_engine(self, engine: ChessEngine) -> ChessEngine:
+        """Tanca un motor que ha fallat i n'engega un altre (una execució llarga no s'ha de quedar sense motors)."""
+        engine.close()
+        if self._stop.is_set():
+            return engine
+        try:
+            replacement = ChessEngine(self.engine_path, self.engine_options)
+        except Exception as e:
+            log.error("No s'ha pogut tornar a engegar el motor: %s", e)
+            self._stop.set()
+            return engine
+        with self._lock:
+            self._engines[self._engines.index(engine)] = replacement
+        return replacement
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.stats[name] += amount
+
+    # --- Orquestració ---
+    def run(self, filename: str) -> dict:
+        """Processa 'filename'; retorna les estadístiques d'aquest fitxer."""
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        files = self._state.setdefault("files", {})
+        saved = files.get(path)
+        if saved and (saved["size"], saved["mtime"]) != (stat.st_size, stat.st_mtime):
+            log.warning("%s ha canviat des de l'última execució: es torna a començar", path)
+            saved = None
+        if saved and saved.get("complete"):
+            log.info("%s ja està fet", path)
+            return dict(saved["stats"])
+        start = saved["offset"] if saved else 0
+        self.stats = dict(saved["stats"]) if saved else dict.fromkeys(self.stats, 0)
+        entry = files[path] = {"size": stat.st_size, "mtime": stat.st_mtime, "offset": start,
+                               "complete": False, "stats": dict(self.stats),
+                               "checkpoints": saved.get("checkpoints", []) if saved else []}
+        if start:
+            log.info("Es continua %s des de l'offset %d (%d partides fetes)", path, start, self.stats["games"])
+
+        total_workers = self.scan_workers + self.confirm_workers
+        engines = self._engines = [ChessEngine(self.engine_path, self.engine_options) for _ in range(total_workers)]
+        games = queue.Queue(QUEUE_SIZE * self.scan_workers)
+        candidates = queue.Queue(QUEUE_SIZE * self.confirm_workers)
+        results = queue.Queue(QUEUE_SIZE * total_workers)
+        self._stop.clear()
+        self._source = os.path.basename(path)
+        new_file = not os.path.exists(self.output)
+        stream = open_pgn_binary(path)
+        raw = getattr(stream, "raw", None)
+        if isinstance(raw, CompressedReader):
+            raw.add_frame_checkpoints(entry["checkpoints"])
+        scanners = [threading.Thread(target=self._scan, args=(engine, games, candidates, results), daemon=True)
+                    for engine in engines[:self.scan_workers]]
+        confirmers = [threading.Thread(target=self._confirm, args=(engine, candidates, results), daemon=True)
+                      for engine in engines[self.scan_workers:]]
+
+        def finish():
+            for thread in scanners:
+                thread.join()
+            for _ in confirmers:
+                self._put(candidates, None)
+            for thread in confirmers:
+                thread.join()
+            self._put(results, None)
+
+        reader = threading.Thread(target=self._read, args=(stream, start, games), daemon=True)
+        threads = [reader, *scanners, *confirmers, threading.Thread(target=finish, daemon=True)]
+        pending = {} # seq -> estat (veure _handle)
+        next_seq = 0
+        started = last_checkpoint = last_progress = time.monotonic()
+        games_before = self.stats["games"]
+        try:
+            with open(self.output, "a", encoding="utf-8", newline="\n") as out:
+                if new_file:
+                    out.write("\t".join(COLUMNS) + "\n")
+                for thread in threads:
+                    thread.start()
+                try:
+                    while True:
+                        try:
+                            message = results.get(timeout=1.0)
+                        except queue.Empty:
+                            message = ()
+                        if message is None or (not message and self._stop.is_set()): # Acabat o error d'una etapa
+                            break
+                        if message:
+                            self._handle(message, pending, out)
+                            # Offset fins on tot està fet: les partides acabades consecutives des de next_seq
+                            while next_seq in pending and pending[next_seq][0] and pending[next_seq][1] == 0:
+                                entry["offset"] = pending.pop(next_seq)[2]
+                                next_seq += 1
+                        now = time.monotonic()
+                        if now - last_checkpoint >= CHECKPOINT_SECONDS:
+                            self._checkpoint(entry, stream, out)
+                            last_checkpoint = now
+                        if now - last_progress >= PROGRESS_SECONDS:
+                            rate = (self.stats["games"] - games_before) / (now - started)
+                            log.info("%d partides (%.1f/s), %d posicions, %d candidats, %d problemes",
+                                     self.stats["games"], rate, self.stats["positions"], self.stats["candidates"],
+                                     self.stats["puzzles"])
+                            last_progress = now
+                except KeyboardInterrupt:
+                    log.warning("Interromput: es continuarà des de l'offset %d", entry["offset"])
+                    self._stop.set()
+                    self._checkpoint(entry, stream, out)
+                    raise
+                entry["complete"] = not self._stop.is_set()
+                self._checkpoint(entry, stream, out)
+        finally:
+            self._stop.set()
+            with self._lock:
+                engines = list(self._engines)
+            for engine in engines:
+                engine.close()
+            stream.close()
+        return dict(self.stats)
+
+    def _handle(self, message: tuple, pending: dict, out):
+        """Missatge d'una etapa: partida escanejada o candidat confirmat (amb el problema, si n'és)."""
+        kind, seq = message[0], message[1]
+        state = pending.setdefault(seq, [False, 0, 0]) # [escanejada, candidats per confirmar, final]
+        if kind == "scanned":
+            state[0], state[2] = True, message[2]
+            state[1] += message[3]
+            self._count("games")
+            self._count("candidates", message[3])
+        else:
+            state[1] -= 1
+            puzzle = message[2]
+            if puzzle is not None:
+                out.write("\t".join(str(puzzle[column]) for column in COLUMNS) + "\n")
+                self._count("puzzles")
+
+    def _checkpoint(self, entry: dict, stream, out):
+        entry["stats"] = dict(self.stats)
+        raw = getattr(stream, "raw", None)
+        if isinstance(raw, CompressedReader):
+            entry["checkpoints"] = raw.frame_checkpoints()
+        self._save_state(out)
+
+
+def main(argv=None) -> int:
+    from log_setup import setup_logging
+    parser = argparse.ArgumentParser(description="Extreu problemes tàctics de fitxers PGN amb el motor")
+    parser.add_argument("files", nargs="+", help="Fitxers PGN (.pgn, .gz, .bz2, .xz, .zst)")
+    parser.add_argument("--output", "-o", required=True, help="Fitxer TSV de problemes (s'hi afegeixen)")
+    parser.add_argument("--engine", default=DEFAULT_ENGINE)
+    parser.add_argument("--workers", type=int, help="Motors en total (per defecte, els del perfil batch)")
+    parser.add_argument("--confirm-workers", type=int, help="Dels quals, per confirmar (per defecte 1/4)")
+    parser.add_argument("--scan-depth", type=int, default=SCAN_DEPTH)
+    parser.add_argument("--confirm-depth", type=int, default=CONFIRM_DEPTH)
+    parser.add_argument("--hash", type=int, help="Hash (MB) de cada motor (per defecte, el del perfil batch)")
+    args = parser.parse_args(argv)
+    setup_logging("INFO")
+
+    profiles = EngineProfiles()
+    options = profiles.options("batch")
+    if args.hash:
+        options["Hash"] = args.hash
+    workers = max(2, args.workers or profiles.workers("batch"))
+    confirm = args.confirm_workers or max(1, workers // 4)
+    miner = PuzzleMiner(args.output, args.engine, max(1, workers - confirm), confirm, options,
+                        args.scan_depth, args.confirm_depth)
+    try:
+        for filename in args.files:
+            stats = miner.run(filename)
+            print(f"{filename}: {stats['games']} partides, {stats['positions']} posicions, "
+                  f"{stats['candidates']} candidats, {stats['puzzles']} problemes")
+    except KeyboardInterrupt:
+        return 130
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
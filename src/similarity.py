@@ -0,0 +1,297 @@
+# src/similarity.py
+"""
+"Posicions semblants": mateixa estructura de peons o disposició de peces gairebé igual.
+
+Complementa position_search.PositionIndex (en fa servir les columnes de
+bitboards) amb dues claus per posició, calculades amb NumPy en indexar:
+
+- pawn_hash: hash de 64 bits dels bitboards de peons blancs i negres.
+  Dues posicions amb la mateixa estructura de peons tenen la mateixa clau,
+  sigui quin sigui la resta del material.
+- Signatura LSH de la disposició de peces: les 64 caselles es reparteixen
+  (de forma fixa i pseudoaleatòria) en BANDS grups de 16, i cada grup dona
+  una clau de 32 bits amb les peces que hi ha. Si dues posicions només
+  difereixen en caselles d'un o dos grups, comparteixen la resta de claus:
+  com més semblants, més probable és que col·lideixin en alguna banda.
+
+Les claus es guarden en segments ordenats (clau, posició); cada update()
+n'afegeix un de nou i quan n'hi ha més de MAX_SEGMENTS es fusionen. Una
+consulta és una cerca binària (np.searchsorted) per segment. Els candidats
+de les bandes es puntuen amb la similitud de Jaccard exacta sobre els
+12 bitboards i es retornen els millors.
+"""
+import json
+import logging
+import os
+import time
+import chess
+
+try:
+    import numpy as np
+except ImportError: # Opcional, com a position_search
+    np = None
+
+from instrumentation import metrics
+from position_search import PositionIndex, BITBOARD_COLUMNS
+from db_manager import GameDatabase
+
+log = logging.getLogger(__name__)
+
+BANDS = 4
+MAX_SEGMENTS = 8
+MAX_BUCKET = 100_000 # D'una clau de banda més freqüent (p. ex. un grup de caselles buit) se'n mira una mostra
+MAX_PAWN_POSITIONS = 500_000 # Una estructura de peons freqüent (la inicial) es retalla, no es descarta
+CHUNK_ROWS = 1 << 21
+_MULTIPLIERS = [0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93,
+                0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53, 0x94D049BB133111EB, 0xBF58476D1CE4E5B9,
+                0x2545F4914F6CDD1D, 0x9FB21C651E98DF25, 0x7FB5D329728EA185, 0x81DADEF4BC2DD44D]
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("Cal el paquet 'numpy' per la cerca de posicions semblants (pip install numpy)")
+
+
+def _band_masks() -> list[int]:
+    """Repartiment fix de les 64 caselles en BANDS grups (llavor fixa: no pot canviar)."""
+    import random
+    squares = list(chess.SQUARES)
+    random.Random(20250424).shuffle(squares)
+    size = 64 // BANDS
+    return [sum(1 << sq for sq in squares[i * size:(i + 1) * size]) for i in range(BANDS)]
+
+
+BAND_MASKS = _band_masks()
+
+
+def _mix64(x):
+    """Finalitzador de splitmix64 sobre un array uint64 (el desbordament és mòdul 2^64)."""
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def _popcount(x):
+    if hasattr(np, "bitwise_count"): # NumPy >= 2.0
+        return np.bitwise_count(x)
+    bytes_view = x.view(np.uint8).reshape(x.shape + (8,))
+    return np.unpackbits(bytes_view, axis=-1).sum(axis=-1)
+
+
+def pawn_keys(white_pawns, black_pawns):
+    return _mix64(white_pawns * np.uint64(_MULTIPLIERS[0]) ^ _mix64(black_pawns + np.uint64(_MULTIPLIERS[1])))
+
+
+def band_keys(bitboards: list) -> "np.ndarray":
+    """Claus LSH (n x BANDS, uint64 amb el número de banda als 32 bits alts)."""
+    n = len(bitboards[0])
+    keys = np.empty((n, BANDS), dtype=np.uint64)
+    for band, mask in enumerate(BAND_MASKS):
+        acc = np.zeros(n, dtype=np.uint64)
+        for column, multiplier in zip(bitboards, _MULTIPLIERS):
+            acc = _mix64(acc ^ ((column & np.uint64(mask)) * np.uint64(multiplier)))
+        keys[:, band] = (np.uint64(band) << np.uint64(32)) | (acc >> np.uint64(32))
+    return keys
+
+
+def board_bitboards(board: chess.Board) -> list:
+    """Els 12 bitboards d'un tauler en l'ordre de BITBOARD_COLUMNS, com arrays d'un element."""
+    values = []
+    for color in (chess.WHITE, chess.BLACK):
+        for piece_type in chess.PIECE_TYPES:
+            values.append(np.array([board.pieces_mask(piece_type, color)], dtype=np.uint64))
+    return values
+
+
+class SimilarityIndex:
+    """Índex de claus de peons i LSH sobre un PositionIndex (mateix directori)."""
+    def __init__(self, positions: PositionIndex):
+        _require_numpy()
+        self.positions = positions
+        self.directory = positions.directory
+        self.meta = self._empty_meta()
+        meta_path = os.path.join(self.directory, "similarity.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                self.meta = json.load(f)
+
+    def _empty_meta(self) -> dict:
+        # 'build': el de l'índex de posicions amb què es van calcular els segments
+        return {"indexed": 0, "pawn_segments": [], "band_segments": [], "next_segment": 0,
+                "build": self.positions.meta.get("build")}
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    # --- Construcció ---
+    def update(self) -> int:
+        """Calcula les claus de les posicions noves de l'índex i n'escriu un segment."""
+        total = len(self.positions)
+        first = self.meta["indexed"]
+        if first > total or self.meta.get("build") != self.positions.meta.get("build"):
+            # L'índex de posicions s'ha reconstruït: els segments apunten a una altra numeració
+            self.reset()
+            first = 0
+        if first >= total:
+            return 0
+        started = time.perf_counter()
+        columns = [self.positions._column(name) for name in BITBOARD_COLUMNS]
+        pawn_parts, band_parts = [], []
+        for begin in range(first, total, CHUNK_ROWS):
+            end = min(begin + CHUNK_ROWS, total)
+            bitboards = [np.asarray(column[begin:end]) for column in columns]
+            positions = np.arange(begin, end, dtype=np.uint64)
+            pawn_parts.append((pawn_keys(bitboards[0], bitboards[6]), positions))
+            keys = band_keys(bitboards)
+            band_parts.append((keys.ravel(), np.repeat(positions, BANDS)))
+        self._add_segment("pawn_segments", pawn_parts)
+        self._add_segment("band_segments", band_parts)
+        self.meta["indexed"] = total
+        self._save_meta()
+        log.info("Índex de semblança: +%d posicions en %.1f s", total - first, time.perf_counter() - started)
+        return total - first
+
+    def reset(self):
+        for name in self.meta["pawn_segments"] + self.meta["band_segments"]:
+            for extension in (".keys", ".pos"):
+                if os.path.exists(self._path(name + extension)):
+                    os.remove(self._path(name + extension))
+        self.meta = self._empty_meta()
+
+    def _add_segment(self, kind: str, parts: list):
+        keys = np.concatenate([k for k, _ in parts])
+        positions = np.concatenate([p for _, p in parts])
+        segments = self.meta[kind]
+        if len(segments) >= MAX_SEGMENTS: # Fusiona-ho tot en un sol segment
+            for name in segments:
+                old_keys, old_positions = self._load_segment(name)
+                keys = np.concatenate([old_keys, keys])
+                positions = np.concatenate([old_positions, positions])
+                del old_keys, old_positions # Allibera el memmap abans d'esborrar el fitxer
+            for name in segments:
+                os.remove(self._path(name + ".keys"))
+                os.remove(self._path(name + ".pos"))
+            segments.clear()
+        order = np.argsort(keys, kind="stable")
+        name = f"{kind[:-9]}_{self.meta['next_segment']}"
+        self.meta["next_segment"] += 1
+        keys[order].tofile(self._path(name + ".keys"))
+        positions[order].tofile(self._path(name + ".pos"))
+        segments.append(name)
+
+    def _load_segment(self, name: str):
+        keys = np.memmap(self._path(name + ".keys"), dtype=np.uint64, mode="r")
+        positions = np.memmap(self._path(name + ".pos"), dtype=np.uint64, mode="r")
+        return keys, positions
+
+    def _save_meta(self):
+        with open(self._path("similarity.json"), "w") as f:
+            json.dump(self.meta, f)
+
+    # --- Consultes ---
+    def _lookup(self, kind: str, keys, limit: int | None = None) -> tuple["np.ndarray", bool]:
+        """
+        (posicions, retallat): posicions de tots els segments amb alguna de les
+        claus. Sense 'limit' (bandes LSH), d'una clau de més de MAX_BUCKET
+        posicions se'n pren una mostra repartida de MAX_BUCKET; amb 'limit'
+        (peons) se'n retornen com a màxim 'limit'. En tots dos casos, retallat
+        diu si n'hi havia més.
+        """
+        found = []
+        remaining = limit
+        truncated = False
+        for name in self.meta[kind]:
+            segment_keys, segment_positions = self._load_segment(name)
+            lows = np.searchsorted(segment_keys, keys, side="left")
+            highs = np.searchsorted(segment_keys, keys, side="right")
+            for low, high in zip(lows.tolist(), highs.tolist()):
+                if high == low:
+                    continue
+                if limit is None:
+                    step = -(-(high - low) // MAX_BUCKET) # Amb step > 1 la mostra cobreix tota la BBDD
+                    truncated = truncated or step > 1
+                    found.append(np.asarray(segment_positions[low:high:step]))
+                    continue
+                if high - low > remaining:
+                    high, truncated = low + remaining, True
+                if high > low:
+                    found.append(np.asarray(segment_positions[low:high]))
+                    remaining -= high - low
+        positions = np.unique(np.concatenate(found)) if found else np.empty(0, dtype=np.uint64)
+        return positions, truncated
+
+    def _to_games(self, positions, scores=None) -> list[tuple]:
+        """(id de partida, ply[, puntuació]) amb la millor posició de cada partida."""
+        games = self.positions._column("games")[positions]
+        game_ids = self.positions._column("game_ids")[games]
+        plies = self.positions._column("plies")[positions]
+        results = {}
+        for i, game_id in enumerate(game_ids.tolist()):
+            score = float(scores[i]) if scores is not None else 1.0
+            if game_id not in results or score > results[game_id][1]:
+                results[game_id] = (int(plies[i]), score)
+        ordered = sorted(results.items(), key=lambda item: -item[1][1])
+        if scores is None:
+            return [(game_id, ply) for game_id, (ply, _) in ordered]
+        return [(game_id, ply, score) for game_id, (ply, score) in ordered]
+
+    def same_pawn_structure(self, board: chess.Board,
+                            limit: int = MAX_PAWN_POSITIONS) -> tuple[list[tuple[int, int]], bool]:
+        """
+        ([(id de partida, ply)], retallat): les partides que arriben a la
+        mateixa estructura de peons. Si hi ha més de 'limit' posicions amb
+        l'estructura només es miren les 'limit' primeres i retallat és cert.
+        """
+        with metrics.timer("similarity.pawns"):
+            white = np.array([board.pawns & board.occupied_co[chess.WHITE]], dtype=np.uint64)
+            black = np.array([board.pawns & board.occupied_co[chess.BLACK]], dtype=np.uint64)
+            positions, truncated = self._lookup("pawn_segments", pawn_keys(white, black), limit)
+            if not len(positions):
+                return [], truncated
+            # Les col·lisions de hash són improbables, però es comproven els bitboards
+            exact = (self.positions._column("bb_wp")[positions] == white[0]) & \
+                    (self.positions._column("bb_bp")[positions] == black[0])
+            return self._to_games(positions[exact]), truncated
+
+    def similar_positions(self, board: chess.Board, min_similarity: float = 0.7,
+                          limit: int = 200) -> tuple[list[tuple[int, int, float]], bool]:
+        """
+        ([(id de partida, ply, similitud)], retallat): les posicions amb
+        disposició de peces semblant (Jaccard sobre les parelles peça-casella),
+        la millor per partida. Retallat és cert si alguna clau era tan
+        freqüent (obertura, mig joc primerenc) que només se n'ha mirat una mostra.
+        """
+        with metrics.timer("similarity.layout"):
+            query = board_bitboards(board)
+            candidates, truncated = self._lookup("band_segments", band_keys(query)[0])
+            metrics.set_gauge("similarity.candidates", len(candidates))
+            if not len(candidates):
+                return [], truncated
+            intersection = np.zeros(len(candidates), dtype=np.int64)
+            union = np.zeros(len(candidates), dtype=np.int64)
+            for name, value in zip(BITBOARD_COLUMNS, query):
+                column = self.positions._column(name)[candidates]
+                intersection += _popcount(column & value[0])
+                union += _popcount(column | value[0])
+            scores = intersection / np.maximum(union, 1)
+            keep = scores >= min_similarity
+            return self._to_games(candidates[keep], scores[keep])[:limit], truncated
+
+
+def update_indexes(db: GameDatabase, positions: PositionIndex | None = None,
+                   similarity: "SimilarityIndex | None" = None, progress=None) -> tuple:
+    """
+    Afegeix les partides noves de la BBDD a l'índex de posicions i al de
+    semblança (els crea si cal). progress(partides fetes, partides noves) es
+    crida després de cada lot; si llança una excepció, la feina feta fins
+    aquí queda desada. Retorna (PositionIndex, SimilarityIndex).
+    """
+    positions = positions if positions is not None else PositionIndex.for_database(db)
+    last_id = 0 if positions.outdated else positions.meta["last_game_id"]
+    pending = db.conn.execute("SELECT COUNT(*) FROM games WHERE id > ?", (last_id,)).fetchone()[0]
+    positions.update(db, progress=(lambda done: progress(done, pending)) if progress else None)
+    similarity = similarity if similarity is not None else SimilarityIndex(positions)
+    similarity.update()
+    return positions, similarity
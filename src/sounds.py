@@ -0,0 +1,130 @@
+# src/sounds.py
+"""
+Sons de les jugades (assets/sounds): jugada, captura, enroc, promoció,
+escac, mat i final de partida.
+
+- Cada so és un QSoundEffect creat un sol cop (preload, quan la finestra ja
+  es veu); QtMultimedia el descodifica en segon pla i el guarda en memòria.
+  Reproduir-lo després no llegeix res del disc.
+- play() no espera mai: només apunta el so i arrenca un temporitzador. Un
+  so que encara s'està carregant se salta; així handle_square_click no té
+  cap cost afegit.
+- Les peticions que arriben juntes (la jugada i el final de la partida) o
+  massa seguides (passar jugades ràpidament) s'ajunten: en sona com a màxim
+  un cada MIN_INTERVAL_MS, el més important, i el nou talla l'anterior.
+- Sense QtMultimedia (o sense el backend d'àudio del sistema) l'aplicació
+  funciona igual, sense sons.
+"""
+import logging
+import os
+import time
+from PySide6.QtCore import QObject, QTimer, QUrl, Slot
+
+try:
+    from PySide6.QtMultimedia import QSoundEffect
+except ImportError: # PySide6 sense QtMultimedia o sense libpulse
+    QSoundEffect = None
+
+log = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SOUNDS_DIR = os.path.join(BASE_DIR, "..", "assets", "sounds")
+SOUND_FILES = {
+    "start": "start.wav",
+    "move": "move.wav",
+    "capture": "x.wav",
+    "castle_king": "CastleK.wav",
+    "castle_queen": "CastleQ.wav",
+    "promote": "Promote.wav",
+    "check": "Check.wav",
+    "end": "end.wav",
+    "mate": "Mate.wav",
+}
+# Quan se n'ajunten diversos, sona el que surt més tard en aquesta llista
+PRIORITY = ("move", "capture", "castle_king", "castle_queen", "promote", "check", "start", "end", "mate")
+MIN_INTERVAL_MS = 90
+VOLUME = 0.6
+ENABLED = os.environ.get("GEMINI_CHESS_SOUNDS", "1") not in ("", "0")
+
+
+def sound_for_san(san: str) -> str:
+    """So d'una jugada a partir del seu SAN (ja diu si és captura, enroc, escac o mat)."""
+    if san.endswith("#"):
+        return "mate"
+    if san.endswith("+"):
+        return "check"
+    if san.startswith("O-O-O"):
+        return "castle_queen"
+    if san.startswith("O-O"):
+        return "castle_king"
+    if "=" in san:
+        return "promote"
+    if "x" in san:
+        return "capture"
+    return "move"
+
+
+class MoveSounds(QObject):
+    """Efectes precarregats; play(nom) des del fil de la interfície."""
+
+    def __init__(self, directory: str = SOUNDS_DIR, parent=None):
+        super().__init__(parent)
+        self.directory = directory
+        self.enabled = ENABLED
+        self._effects = {} # nom -> QSoundEffect
+        self._pending = None # So més important demanat des de l'últim que ha sonat
+        self._playing = None
+        self._last_play = 0.0
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._flush)
+
+    @property
+    def available(self) -> bool:
+        return QSoundEffect is not None
+
+    @Slot()
+    def preload(self):
+        """Crea els efectes (la descodificació la fa QtMultimedia en segon pla)."""
+        if QSoundEffect is None:
+            log.info("QtMultimedia no està disponible: l'aplicació funcionarà sense sons")
+            return
+        for name, filename in SOUND_FILES.items():
+            path = os.path.join(self.directory, filename)
+            if not os.path.exists(path):
+                log.warning("No s'ha trobat el so %s: %s", name, path)
+                continue
+            effect = QSoundEffect(self)
+            effect.setSource(QUrl.fromLocalFile(os.path.abspath(path)))
+            effect.setVolume(VOLUME)
+            self._effects[name] = effect
+
+    def play(self, name: str):
+        if not self.enabled or name not in self._effects:
+            return
+        if self._pending is not None and PRIORITY.index(self._pending) >= PRIORITY.index(name):
+            return
+        self._pending = name
+        if not self._timer.isActive():
+            elapsed_ms = (time.monotonic() - self._last_play) * 1000
+            self._timer.start(max(0, int(MIN_INTERVAL_MS - elapsed_ms)))
+
+    @Slot()
+    def _flush(self):
+        name, self._pending = self._pending, None
+        effect = self._effects.get(name)
+        if effect is None or not effect.isLoaded(): # Encara es descodifica: no s'espera
+            return
+        if self._playing is not None and self._playing is not effect:
+            self._playing.stop()
+        effect.play()
+        self._playing = effect
+        self._last_play = time.monotonic()
+
+    def set_enabled(self, enabled: bool):
+        self.enabled = enabled
+        if not enabled:
+            self._pending = None
+            self._timer.stop()
+            if self._playing is not None:
+                self._playing.stop()